@@ -0,0 +1,93 @@
+"""
+Speed and accuracy of the SHAP modes of src/models/explain_model.py against exact
+TreeSHAP with all the trees, on --rows customers of test_data.csv explained by a
+model artifact of train_model. For each mode prints the time per customer, the
+speedup, the mean absolute error of the SHAP values (summed by ERP feature), their
+correlation with the exact values and the share of the exact top --top-k reasons
+that the mode also returns.
+
+Run from the project root (after make train):
+
+    python -m benchmarks.explain_model [--model models/random_forest_clf_for_churn/v1] [--rows 100]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.data.make_dataset import load_dataset, make_pipeline
+from src.features.build_features import PROCESSED_SCHEMA
+from src.models.explain_model import _to_dense, explain, feature_groups, make_explainer
+from src.models.train_model import FEATURE_FUNCS, load_model
+
+TEST_DATA = "data/processed/test_data.csv"
+# (name, mode, background_size, max_trees)
+CASES = [
+    ("exact", "exact", None, None),
+    ("exact 100 trees", "exact", None, 100),
+    ("exact 25 trees", "exact", None, 25),
+    ("approximate", "approximate", None, None),
+    ("interventional bg 100", "interventional", 100, None),
+    ("interventional bg 20", "interventional", 20, None),
+    ("interventional bg 20, 100 trees", "interventional", 20, 100),
+]
+
+
+def top_k_agreement(values: np.ndarray, exact: np.ndarray, top_k: int) -> float:
+    """Mean share of the exact top_k features of each row found in the top_k of values."""
+    top = np.argsort(-values, axis=1)[:, :top_k]
+    top_exact = np.argsort(-exact, axis=1)[:, :top_k]
+    return np.mean([len(np.intersect1d(a, b)) / top_k for a, b in zip(top, top_exact)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="models/random_forest_clf_for_churn/v1")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pipeline, manifest = load_model(args.model, compiled=False)
+    features = (
+        manifest["features"]["NUM_FEATURES"] + manifest["features"]["CAT_FEATURES"]
+    )
+    test_data = make_pipeline(
+        dataframe=load_dataset(TEST_DATA, schema=PROCESSED_SCHEMA),
+        functions=FEATURE_FUNCS[manifest["model_name"]],
+    )
+    X = _to_dense(pipeline[:-1].transform(test_data[features]))
+    rng = np.random.default_rng(args.seed)
+    X_explain = X[rng.choice(len(X), min(args.rows, len(X)), replace=False)]
+    _, indicator = feature_groups(pipeline[:-1])
+
+    print(f"{manifest['model_name']}: {len(X_explain)} customers, {X.shape[1]} inputs")
+    print(
+        f"{'mode':<34} {'ms/customer':>11} {'speedup':>8} {'mae':>9} "
+        f"{'corr':>6} {f'top-{args.top_k}':>6}"
+    )
+    exact, exact_seconds = None, None
+    for name, mode, background_size, max_trees in CASES:
+        background = (
+            X[rng.choice(len(X), background_size, replace=False)]
+            if background_size
+            else None
+        )
+        explainer = make_explainer(pipeline[-1], mode, background, max_trees)
+        start = time.perf_counter()
+        values = explain(explainer, X_explain, indicator)
+        seconds = time.perf_counter() - start
+        if exact is None:
+            exact, exact_seconds = values, seconds
+        print(
+            f"{name:<34} {seconds / len(X_explain) * 1e3:11.2f} "
+            f"{exact_seconds / seconds:7.1f}x "
+            f"{np.abs(values - exact).mean():9.5f} "
+            f"{np.corrcoef(values.ravel(), exact.ravel())[0, 1]:6.3f} "
+            f"{top_k_agreement(values, exact, args.top_k):6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
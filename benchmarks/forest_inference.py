@@ -0,0 +1,84 @@
+"""
+Compares the latency of the sklearn random forest with its CompiledForest
+(numba and numpy engines) at several batch sizes. Only the model step is timed:
+the batches are sampled from the preprocessed test data.
+
+Run from the project root:
+
+    python -m benchmarks.forest_inference [--sizes 1 1000 1000000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.data.make_dataset import load_dataset, make_pipeline
+from src.features import rf_feature_funcs
+from src.models.forest_inference import CompiledForest
+from src.models.predict_model import load_model_config
+from src.models.train_model import make_model_pipeline
+
+CONFIG = "config/random_forest_clf_for_churn_config.yaml"
+
+
+def best_time(func, repeat: int) -> float:
+    """Returns the best wall time (s) of repeat calls of func."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 1000, 1000000])
+    args = parser.parse_args()
+
+    config = load_model_config(CONFIG)
+    features = (
+        config["model_features"]["NUM_FEATURES"]
+        + config["model_features"]["CAT_FEATURES"]
+    )
+    train_data = make_pipeline(
+        load_dataset("data/processed/train_data.csv"), rf_feature_funcs
+    )
+    test_data = make_pipeline(
+        load_dataset("data/processed/test_data.csv"), rf_feature_funcs
+    )
+    pipeline = make_model_pipeline(config).fit(
+        train_data[features], train_data[config["model_target"]]
+    )
+    forest = pipeline[-1]
+    compiled = CompiledForest.from_estimator(forest)
+    Xt = pipeline[:-1].transform(test_data[features])
+    compiled.predict_proba(Xt[:1])  # numba compilation
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        X = Xt[rng.integers(0, Xt.shape[0], size)]
+        repeat = 20 if size <= 1000 else 1
+        reference = forest.predict_proba(X)
+        for engine in ["numba", "numpy"]:
+            max_diff = np.abs(
+                compiled.predict_proba(X, engine=engine) - reference
+            ).max()
+            assert max_diff <= 1e-9, f"{engine} differs from sklearn by {max_diff}"
+        sklearn_time = best_time(lambda: forest.predict_proba(X), repeat)
+        numba_time = best_time(
+            lambda: compiled.predict_proba(X, engine="numba"), repeat
+        )
+        numpy_time = best_time(
+            lambda: compiled.predict_proba(X, engine="numpy"), repeat
+        )
+        print(
+            f"batch {size:>8}: sklearn {sklearn_time * 1e3:10.2f} ms  "
+            f"numba {numba_time * 1e3:10.2f} ms ({sklearn_time / numba_time:6.1f}x)  "
+            f"numpy {numpy_time * 1e3:10.2f} ms ({sklearn_time / numpy_time:6.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
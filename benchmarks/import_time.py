@@ -0,0 +1,82 @@
+"""
+Cold start of the src package and of the CLIs. Runs each target in a new
+interpreter with python -X importtime and prints the best of --repeat runs of
+the import time of the target module (the cumulative time reported by
+-X importtime) and the wall time of the process, plus the slowest imports of
+--detail.
+
+Run from the project root:
+
+    python -m benchmarks.import_time [--repeat 5] [--detail src.models.predict_model]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+TARGETS = [
+    ("import src", ["-c", "import src"]),
+    ("import src.data", ["-c", "import src.data"]),
+    ("import src.features", ["-c", "import src.features"]),
+    ("import src.models", ["-c", "import src.models"]),
+    ("src.make_pipeline", ["-c", "import src; src.make_pipeline"]),
+    ("predict_model --help", ["-m", "src.models.predict_model", "--help"]),
+    ("score_server --help", ["-m", "src.models.score_server", "--help"]),
+    ("make_dataset --help", ["-m", "src.data.make_dataset", "--help"]),
+]
+
+
+def parse_importtime(stderr: str) -> list:
+    """(cumulative us, self us, module) of each line of the -X importtime output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        imports.append((int(cumulative_us), int(self_us), module.strip()))
+    return imports
+
+
+def run_target(args: list) -> tuple:
+    """Runs python -X importtime with args. Returns the wall time (s) and the imports."""
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, parse_importtime(process.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--detail",
+        default="src.models.predict_model",
+        help="module whose slowest imports are printed",
+    )
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    print(f"{'target':<24} {'src imports (ms)':>17} {'process (ms)':>13}")
+    for name, target_args in TARGETS:
+        walls, import_times = [], []
+        for _ in range(args.repeat):
+            wall, imports = run_target(target_args)
+            walls.append(wall)
+            import_times.append(
+                sum(cumulative for cumulative, _, module in imports if module == "src")
+            )
+        print(f"{name:<24} {min(import_times) / 1e3:17.1f} {min(walls) * 1e3:13.1f}")
+
+    _, imports = run_target(["-c", f"import {args.detail}"])
+    print(f"\nslowest imports (cumulative) of import {args.detail}:")
+    for cumulative, self_us, module in sorted(imports, reverse=True)[: args.top]:
+        print(f"{cumulative / 1e3:9.1f} ms {self_us / 1e3:9.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Throughput of make_pipeline_parallel (src/features/parallel_pipeline.py) against
+make_pipeline on the raw ERP export repeated --scale times, with the data
+cleaning and feature functions (list_funcs + list_feature_funcs) and a
+create_missing_indicator without subset (a global step). Checks that the outputs
+are equal.
+
+Run from the project root:
+
+    python -m benchmarks.parallel_pipeline [--scale 100] [--n-jobs 1 2 4]
+"""
+
+import argparse
+import os
+import time
+
+import pandas as pd
+
+from src.data.make_dataset import (
+    RAW_SCHEMA,
+    list_funcs,
+    make_pipeline,
+    read_csv_with_schema,
+)
+from src.features import (
+    create_missing_indicator,
+    list_feature_funcs,
+    make_pipeline_parallel,
+)
+
+RAW_DATA = "data/raw/customer_churn_data - customer_churn_data.csv"
+FUNCTIONS = list_funcs + [{"function": create_missing_indicator}] + list_feature_funcs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument(
+        "--n-jobs", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count()})
+    )
+    args = parser.parse_args()
+
+    raw = read_csv_with_schema(RAW_DATA, RAW_SCHEMA)
+    raw = pd.concat([raw] * args.scale, ignore_index=True)
+    start = time.perf_counter()
+    expected = make_pipeline(dataframe=raw, functions=FUNCTIONS)
+    serial = time.perf_counter() - start
+    print(f"{len(raw)} rows, {os.cpu_count()} cpus")
+    print(f"make_pipeline            {len(raw) / serial:12.0f} rows/s")
+    for n_jobs in args.n_jobs:
+        start = time.perf_counter()
+        output = make_pipeline_parallel(
+            dataframe=raw, functions=FUNCTIONS, n_jobs=n_jobs
+        )
+        elapsed = time.perf_counter() - start
+        pd.testing.assert_frame_equal(output, expected)
+        print(
+            f"make_pipeline_parallel {n_jobs:>2} {len(raw) / elapsed:12.0f} rows/s  "
+            f"speedup {serial / elapsed:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares the peak memory allocated by make_pipeline with and without
+copy_on_write on a frame 100x the size of the raw sample.
+
+Run from the project root:
+
+    python -m benchmarks.pipeline_memory [--scale 100]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+from src.data.make_dataset import list_funcs, make_pipeline
+from src.features import (
+    FREQ_COLS,
+    count_class_frequency,
+    create_eq_or_gt_feature,
+    create_missing_indicator,
+)
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+RAW_FILE = (
+    PROJECT_DIR / "data" / "raw" / "customer_churn_data - customer_churn_data.csv"
+)
+
+feature_funcs = [
+    {"function": create_missing_indicator},
+    {
+        "function": count_class_frequency,
+        "function_kwargs": {"class_to_count": "Uso frequente", "columns": FREQ_COLS},
+    },
+    {
+        "function": create_eq_or_gt_feature,
+        "function_kwargs": {
+            "feature_name": "is_receita_mensal_maior_ou_igual_70",
+            "value": 70.0,
+            "columns": "receita_mensal",
+        },
+    },
+]
+
+
+def measure(dataframe: pd.DataFrame, functions: list[dict], copy_on_write: bool):
+    """Returns the peak traced allocation (MiB) and wall time (s) of one run."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = make_pipeline(
+        dataframe=dataframe, functions=functions, copy_on_write=copy_on_write
+    )
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / 2**20, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=100)
+    args = parser.parse_args()
+
+    raw_df = pd.read_csv(RAW_FILE)
+    raw_df = pd.concat([raw_df] * args.scale, ignore_index=True)
+    cleared_df = make_pipeline(dataframe=raw_df, functions=list_funcs)
+    input_mib = cleared_df.memory_usage(deep=True).sum() / 2**20
+    print(f"rows: {len(raw_df)}  cleared frame: {input_mib:.1f} MiB")
+
+    for name, df, funcs in [
+        ("make_dataset", raw_df, list_funcs),
+        ("build_features", cleared_df, feature_funcs),
+    ]:
+        results = {}
+        for copy_on_write in (False, True):
+            out, peak, elapsed = measure(df, funcs, copy_on_write)
+            results[copy_on_write] = out
+            print(
+                f"{name:<15} copy_on_write={copy_on_write!s:<5} "
+                f"peak={peak:9.1f} MiB  time={elapsed:6.2f} s"
+            )
+        pd.testing.assert_frame_equal(results[False], results[True])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Throughput/latency trade-off of PredictionBatcher (src/models/batching.py).
+Fits the random forest pipeline from its config and scores the rows of the test
+data one per call from --threads threads, first with one make_predict per call
+and then through PredictionBatcher with each (max_batch_size, max_wait_ms) pair.
+
+Run from the project root:
+
+    python -m benchmarks.prediction_batching [--calls 2000] [--threads 16]
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.data.make_dataset import load_dataset, make_pipeline
+from src.features import rf_feature_funcs
+from src.models.batching import PredictionBatcher
+from src.models.predict_model import load_model_config, make_predict
+from src.models.train_model import make_model_pipeline
+
+CONFIG = "config/random_forest_clf_for_churn_config.yaml"
+SETTINGS = [(8, 1.0), (32, 2.0), (64, 5.0), (256, 10.0)]
+
+
+def run_calls(predict: callable, rows: list, threads: int) -> tuple:
+    """Calls predict on each row from threads threads. Returns the elapsed time and latencies."""
+
+    def call(row):
+        start = time.perf_counter()
+        predict(row)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = np.array(list(executor.map(call, rows))) * 1000
+    return time.perf_counter() - start, latencies
+
+
+def report(name: str, elapsed: float, latencies: np.ndarray, extra: str = ""):
+    print(
+        f"{name:<28} {len(latencies) / elapsed:8.0f} calls/s  "
+        f"p50 {np.percentile(latencies, 50):8.2f} ms  "
+        f"p99 {np.percentile(latencies, 99):8.2f} ms  {extra}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    config = load_model_config(CONFIG)
+    features = (
+        config["model_features"]["NUM_FEATURES"]
+        + config["model_features"]["CAT_FEATURES"]
+    )
+    train_data = make_pipeline(
+        load_dataset("data/processed/train_data.csv"), rf_feature_funcs
+    )
+    test_data = make_pipeline(
+        load_dataset("data/processed/test_data.csv"), rf_feature_funcs
+    )
+    pipeline = make_model_pipeline(config).fit(
+        train_data[features], train_data[config["model_target"]]
+    )
+    X_test = test_data[features]
+    rows = [X_test.iloc[[i % len(X_test)]] for i in range(args.calls)]
+
+    elapsed, latencies = run_calls(
+        lambda row: make_predict(pipeline, row, return_classes=True), rows, args.threads
+    )
+    report("make_predict per call", elapsed, latencies)
+    for max_batch_size, max_wait_ms in SETTINGS:
+        with PredictionBatcher(
+            model=pipeline, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
+        ) as batcher:
+            elapsed, latencies = run_calls(batcher.predict, rows, args.threads)
+            metrics = batcher.metrics()
+        report(
+            f"batch {max_batch_size:>3}, wait {max_wait_ms:>4} ms",
+            elapsed,
+            latencies,
+            f"mean batch {metrics['mean_batch_size']:.1f}",
+        )
+
+
+if __name__ == "__main__":
+    main()
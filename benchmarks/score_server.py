@@ -0,0 +1,155 @@
+"""
+Latency of the single-customer scoring server (src/models/score_server.py)
+with a local client. Fits the random forest from its config, starts the server on
+a Unix socket and sends the customers of the raw ERP export one per request from
+--concurrency clients. Prints the client p50/p99 latency, the server stats and the
+latency of the DataFrame path (make_pipeline + Pipeline.predict_proba on one row).
+Then checks that a process that scores some customers and closes the service
+exits (numba kernels called from worker threads can hang the interpreter exit).
+
+Run from the project root:
+
+    python -m benchmarks.score_server [--requests 2000] [--concurrency 32]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from src.data.make_dataset import list_funcs, load_dataset, make_pipeline
+from src.features import list_feature_funcs, rf_feature_funcs
+from src.models.predict_model import load_model_config
+from src.models.score_server import ScoringService, request, start_server
+from src.models.train_model import make_model_pipeline
+
+CONFIG = "config/random_forest_clf_for_churn_config.yaml"
+RAW_DATA = "data/raw/customer_churn_data - customer_churn_data.csv"
+# scores the records of sys.argv[3] with the pipeline of sys.argv[1] (features in
+# sys.argv[2]) and closes the service, run in a new process by check_exit
+SCORE_THEN_CLOSE = """
+import asyncio, json, sys
+import joblib
+from src.models.score_server import ScoringService
+
+with open(sys.argv[2]) as f:
+    features = json.load(f)
+with open(sys.argv[3]) as f:
+    records = json.load(f)
+service = ScoringService(pipeline=joblib.load(sys.argv[1]), features=features)
+
+async def score():
+    await asyncio.gather(*[service.score(record) for record in records])
+    await service.close()
+
+asyncio.run(score())
+"""
+
+
+async def run_clients(records: list, concurrency: int, unix_socket: Path) -> list:
+    """Sends each record in one request, concurrency at a time. Returns the latencies (s)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send(record):
+        async with semaphore:
+            start = time.perf_counter()
+            await request("POST", "/score", record, unix_socket=unix_socket)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[send(record) for record in records])
+    return latencies
+
+
+async def benchmark(service: ScoringService, records: list, concurrency: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        unix_socket = Path(tmp_dir) / "score.sock"
+        server = await start_server(service, unix_socket=unix_socket)
+        await run_clients(records[:concurrency], concurrency, unix_socket)  # warm up
+        service.reset_stats()
+        start = time.perf_counter()
+        latencies = np.array(await run_clients(records, concurrency, unix_socket))
+        elapsed = time.perf_counter() - start
+        stats = await request("GET", "/stats", unix_socket=unix_socket)
+        server.close()
+        await server.wait_closed()
+        await service.close()
+    print(
+        f"client: {len(records)} requests in {elapsed:.2f} s "
+        f"({len(records) / elapsed:.0f} req/s), "
+        f"p50 {np.percentile(latencies, 50) * 1e3:.2f} ms, "
+        f"p99 {np.percentile(latencies, 99) * 1e3:.2f} ms"
+    )
+    print(
+        f"server: p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+        f"mean batch size {stats['mean_batch_size']:.1f}"
+    )
+
+
+def check_exit(pipeline, features: list, records: list, timeout: float = 120):
+    """Runs SCORE_THEN_CLOSE in a new process and fails if it doesn't exit."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [Path(tmp_dir) / name for name in ("model.joblib", "f.json", "r.json")]
+        joblib.dump(pipeline, paths[0])
+        paths[1].write_text(json.dumps(features))
+        paths[2].write_text(json.dumps(records))
+        start = time.perf_counter()
+        try:
+            subprocess.run(
+                [sys.executable, "-c", SCORE_THEN_CLOSE, *map(str, paths)],
+                check=True,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            raise SystemExit(f"score then close didn't exit in {timeout} s")
+    print(f"score then close: exited in {time.perf_counter() - start:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    config = load_model_config(CONFIG)
+    features = (
+        config["model_features"]["NUM_FEATURES"]
+        + config["model_features"]["CAT_FEATURES"]
+    )
+    train_data = make_pipeline(
+        load_dataset("data/processed/train_data.csv"), rf_feature_funcs
+    )
+    pipeline = make_model_pipeline(config).fit(
+        train_data[features], train_data[config["model_target"]]
+    )
+    raw = pd.read_csv(RAW_DATA)
+    # JSON has no NaN, missing values are sent as null
+    records = [
+        {k: None if isinstance(v, float) and math.isnan(v) else v for k, v in r.items()}
+        for r in raw.to_dict("records")
+    ]
+    records = (records * math.ceil(args.requests / len(records)))[: args.requests]
+
+    one_row = raw.iloc[[0]]
+    functions = list_funcs + list_feature_funcs
+    start = time.perf_counter()
+    for _ in range(20):
+        pipeline.predict_proba(make_pipeline(one_row, functions)[features])
+    print(f"DataFrame path: {(time.perf_counter() - start) / 20 * 1e3:.2f} ms/customer")
+
+    service = ScoringService(pipeline=pipeline, features=features)
+    asyncio.run(benchmark(service, records, args.concurrency))
+    check_exit(pipeline, features, records[: args.concurrency * 4])
+
+
+if __name__ == "__main__":
+    main()
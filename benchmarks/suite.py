@@ -0,0 +1,379 @@
+"""
+Benchmark suite of the data cleaning, the features and the scoring. Synthesizes
+datasets shaped like the raw ERP export for each --sizes (rows sampled from
+the raw export with new ids and new receita values, so the currency strings
+don't repeat like in a copy of the file) and times:
+
+- each function of src/data/make_dataset.py and src/features/build_features.py;
+- make_pipeline end to end (list_funcs + list_feature_funcs);
+- make_predict with the configured random forest and decision tree, fitted on
+  data/processed/train_data.csv.
+
+Each case records the best and the median time of --repeat runs (fast cases run
+in loops of at least MIN_RUN_SECONDS), the throughput (rows/s) and the peak
+memory allocated (tracemalloc, in a separate run). The results are saved to a
+json file and two result files can be compared to flag regressions.
+
+Run from the project root (or with make benchmark / make benchmark_compare):
+
+    python -m benchmarks.suite run [--sizes 10000 100000 1000000] [--output reports/benchmarks/latest.json]
+    python -m benchmarks.suite compare BASELINE.json NEW.json [--threshold 0.2]
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from src.data.make_dataset import (
+    BRL_TRANSLATE_TABLE,
+    RAW_SCHEMA,
+    apply_schema,
+    clear_numeric_strings,
+    convert_to_numeric,
+    drop_cols,
+    list_funcs,
+    load_dataset,
+    make_pipeline,
+    parse_brl_currency,
+    rename_cols,
+)
+from src.features import (
+    FREQ_COLS,
+    MAP_TEMP_PERM,
+    PROCESSED_SCHEMA,
+    classify_col,
+    convert_to_categoric,
+    count_class_frequency,
+    create_eq_or_gt_feature,
+    create_missing_indicator,
+    list_feature_funcs,
+    rf_feature_funcs,
+)
+from src.models.predict_model import load_model_config, make_predict
+from src.models.train_model import make_model_pipeline
+
+RAW_DATA = "data/raw/customer_churn_data - customer_churn_data.csv"
+TRAIN_DATA = "data/processed/train_data.csv"
+MODEL_CONFIGS = {
+    "random_forest": "config/random_forest_clf_for_churn_config.yaml",
+    "decision_tree": "config/decision_tree_clf_for_churn_config.yaml",
+}
+RAW_NUM_COLS = ["Receita mensal", "Receita total"]
+MIN_RUN_SECONDS = 0.2
+# clear_numeric_strings parses the list subsets row by row (DataFrame.apply)
+SLOW_CASE_MAX_ROWS = 10_000
+
+
+def format_brl(values: np.ndarray) -> pd.Series:
+    """Formats floats like the raw export ("R$ 1.889,50"). NaN stays NaN."""
+    formatted = pd.Series(values).map("{:,.2f}".format)
+    formatted = "R$ " + formatted.str.translate(str.maketrans(",.", ".,"))
+    return formatted.where(~np.isnan(values))
+
+
+def synthesize_raw(raw: pd.DataFrame, n_rows: int, seed: int) -> pd.DataFrame:
+    """
+    Dataset shaped like the raw ERP export with n_rows rows: the rows of raw are
+    sampled with replacement, the ids are 1..n_rows and the receita columns get
+    new values (the monthly revenue with +-10% noise and the total as monthly
+    revenue x months), keeping the missing values of the sampled rows.
+    """
+    rng = np.random.default_rng(seed)
+    synthetic = raw.iloc[rng.integers(0, len(raw), n_rows)].reset_index(drop=True)
+    synthetic["ID"] = np.arange(1, n_rows + 1)
+    monthly = parse_brl_currency(synthetic[RAW_NUM_COLS], RAW_NUM_COLS)
+    new_monthly = np.round(
+        monthly["Receita mensal"].to_numpy() * rng.uniform(0.9, 1.1, n_rows), 2
+    )
+    new_total = np.round(
+        new_monthly * np.maximum(synthetic["Meses de permanência "].to_numpy(), 1), 2
+    )
+    new_total[np.isnan(monthly["Receita total"].to_numpy())] = np.nan
+    synthetic["Receita mensal"] = format_brl(new_monthly)
+    synthetic["Receita total"] = format_brl(new_total)
+    return apply_schema(synthetic, RAW_SCHEMA)
+
+
+def fit_models() -> dict:
+    """Fits the configured models on the train data. Returns name -> (pipeline, features, threshold)."""
+    train_data = make_pipeline(
+        load_dataset(TRAIN_DATA, schema=PROCESSED_SCHEMA), rf_feature_funcs
+    )
+    models = {}
+    for name, config_path in MODEL_CONFIGS.items():
+        config = load_model_config(config_path)
+        features = (
+            config["model_features"]["NUM_FEATURES"]
+            + config["model_features"]["CAT_FEATURES"]
+        )
+        pipeline = make_model_pipeline(config).fit(
+            train_data[features], train_data[config["model_target"]]
+        )
+        threshold = (
+            config["model_parameters"]
+            .get("predict_params", {})
+            .get("decision_threshold", 0.5)
+        )
+        models[name] = (pipeline, features, threshold)
+    return models
+
+
+def make_cases(raw: pd.DataFrame, models: dict) -> list:
+    """(group, name, function without args, max rows) of each case on the raw frame."""
+    cleared = make_pipeline(raw, list_funcs)
+    features = make_pipeline(cleared, list_feature_funcs)
+    # output of clear_numeric_strings, the input of convert_to_numeric
+    cleared_strings = raw[RAW_NUM_COLS].apply(
+        lambda s: s.astype(str).str.translate(BRL_TRANSLATE_TABLE).where(s.notna())
+    )
+    cases = [
+        (
+            "make_dataset",
+            "drop_cols",
+            lambda: drop_cols(raw, ["Emite boletos.1", "ID"]),
+        ),
+        ("make_dataset", "rename_cols", lambda: rename_cols(raw)),
+        (
+            "make_dataset",
+            "clear_numeric_strings",
+            lambda: clear_numeric_strings(raw, RAW_NUM_COLS),
+            SLOW_CASE_MAX_ROWS,
+        ),
+        (
+            "make_dataset",
+            "convert_to_numeric",
+            lambda: convert_to_numeric(cleared_strings, RAW_NUM_COLS),
+        ),
+        (
+            "make_dataset",
+            "parse_brl_currency",
+            lambda: parse_brl_currency(raw, RAW_NUM_COLS),
+        ),
+        (
+            "build_features",
+            "convert_to_categoric",
+            lambda: convert_to_categoric(cleared, ["contrato", "tipo_de_pagamento"]),
+        ),
+        (
+            "build_features",
+            "classify_col",
+            lambda: classify_col(
+                cleared,
+                col_to_clf="meses_de_permanência",
+                new_col_name="clf_meses_permanência",
+                map=MAP_TEMP_PERM,
+            ),
+        ),
+        (
+            "build_features",
+            "create_missing_indicator",
+            lambda: create_missing_indicator(cleared),
+        ),
+        (
+            "build_features",
+            "count_class_frequency",
+            lambda: count_class_frequency(cleared, "Uso frequente", FREQ_COLS),
+        ),
+        (
+            "build_features",
+            "create_eq_or_gt_feature",
+            lambda: create_eq_or_gt_feature(
+                cleared, 70.0, "receita_mensal", "is_receita_mensal_maior_ou_igual_70"
+            ),
+        ),
+        (
+            "pipeline",
+            "make_pipeline",
+            lambda: make_pipeline(raw, list_funcs + list_feature_funcs),
+        ),
+    ]
+    for name, (pipeline, model_features, threshold) in models.items():
+        X = features[model_features]
+        cases.append(
+            (
+                "predict",
+                f"make_predict_{name}",
+                lambda pipeline=pipeline, X=X, threshold=threshold: make_predict(
+                    pipeline, X, threshold=threshold, return_classes=True
+                ),
+            )
+        )
+    return [case if len(case) == 4 else case + (None,) for case in cases]
+
+
+def time_case(function: callable, repeat: int) -> list:
+    """Seconds per call of each of repeat runs (timeit style loops for fast calls)."""
+    start = time.perf_counter()
+    function()
+    first = time.perf_counter() - start
+    loops = max(1, math.ceil(MIN_RUN_SECONDS / max(first, 1e-9)))
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        times.append((time.perf_counter() - start) / loops)
+    return times
+
+
+def peak_memory(function: callable) -> float:
+    """Peak memory (MiB) allocated by one call."""
+    gc.collect()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def environment(args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "sizes": args.sizes,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+
+def run(args: argparse.Namespace):
+    raw = pd.read_csv(RAW_DATA)
+    print("fitting the models")
+    models = fit_models()
+    results = []
+    for n_rows in args.sizes:
+        synthetic = synthesize_raw(raw, n_rows, args.seed)
+        print(f"\n{n_rows} rows")
+        for group, name, function, max_rows in make_cases(synthetic, models):
+            if max_rows is not None and n_rows > max_rows:
+                print(f"  {name:<32} skipped (more than {max_rows} rows)")
+                continue
+            times = time_case(function, args.repeat)
+            result = {
+                "group": group,
+                "name": name,
+                "rows": n_rows,
+                "wall_s_min": min(times),
+                "wall_s_median": float(np.median(times)),
+                "rows_per_s": n_rows / min(times),
+                "peak_memory_mb": peak_memory(function),
+            }
+            results.append(result)
+            print(
+                f"  {name:<32} {result['wall_s_min'] * 1e3:10.2f} ms "
+                f"{result['rows_per_s']:14.0f} rows/s "
+                f"{result['peak_memory_mb']:10.1f} MiB"
+            )
+        del synthetic
+        gc.collect()
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(args), "results": results}, f, indent=2)
+    print(f"\nresults saved to {output}")
+
+
+def compare(args: argparse.Namespace) -> int:
+    """Prints the time and memory ratios (new / baseline) of the common cases.
+    Returns 1 if a ratio is over 1 + threshold."""
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    baseline_results = {(r["name"], r["rows"]): r for r in baseline["results"]}
+    n_regressions = 0
+    print(f"{'case':<32} {'rows':>9} {'time':>8} {'memory':>8}")
+    for result in new["results"]:
+        key = (result["name"], result["rows"])
+        if key not in baseline_results:
+            print(f"{key[0]:<32} {key[1]:>9} {'new case':>8}")
+            continue
+        base = baseline_results[key]
+        time_ratio = result["wall_s_min"] / base["wall_s_min"]
+        memory_ratio = result["peak_memory_mb"] / max(base["peak_memory_mb"], 1e-9)
+        flags = []
+        if time_ratio > 1 + args.threshold:
+            flags.append("TIME REGRESSION")
+        elif time_ratio < 1 / (1 + args.threshold):
+            flags.append("faster")
+        if memory_ratio > 1 + args.memory_threshold:
+            flags.append("MEMORY REGRESSION")
+        n_regressions += any("REGRESSION" in flag for flag in flags)
+        print(
+            f"{key[0]:<32} {key[1]:>9} {time_ratio:7.2f}x {memory_ratio:7.2f}x  "
+            + ", ".join(flags)
+        )
+    print(
+        f"\n{n_regressions} regressions (threshold {args.threshold:.0%} time, "
+        f"{args.memory_threshold:.0%} memory) of {new['environment']['commit']} "
+        f"against {baseline['environment']['commit']}"
+    )
+    return 1 if n_regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--output", default="reports/benchmarks/latest.json")
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="time ratio over 1 + threshold is a regression",
+    )
+    compare_parser.add_argument(
+        "--memory-threshold",
+        type=float,
+        default=0.1,
+        help="memory ratio over 1 + threshold is a regression",
+    )
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
-from .data import *
-from .features import *
-from .models import *
+from . import data, features, models
+from ._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    {"data": data.__all__, "features": features.__all__, "models": models.__all__},
+)
@@ -0,0 +1,39 @@
+import importlib
+import sys
+
+
+def attach(package_name: str, submodules: dict) -> tuple:
+    """
+    Lazy exports of a package: the names of each submodule are imported on the
+    first access (module level __getattr__, PEP 562), so importing the package
+    doesn't import the submodules and their dependencies (pandas, sklearn...).
+
+    Example, in the __init__.py of a package:
+
+    >>>
+    __getattr__, __dir__, __all__ = attach(__name__, {"cache": ["StepCache"]})
+
+    Args:
+        package_name (str): __name__ of the package.
+        submodules (dict): submodule name (relative to the package) -> exported names.
+
+    Returns:
+        tuple: __getattr__, __dir__ and __all__ of the package.
+    """
+    exports = {
+        name: submodule for submodule, names in submodules.items() for name in names
+    }
+
+    def __getattr__(name: str):
+        if name not in exports:
+            raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+        module = importlib.import_module(f"{package_name}.{exports[name]}")
+        value = getattr(module, name)
+        # next accesses don't go through __getattr__
+        setattr(sys.modules[package_name], name, value)
+        return value
+
+    def __dir__() -> list:
+        return sorted(set(vars(sys.modules[package_name])) | set(exports))
+
+    return __getattr__, __dir__, list(exports)
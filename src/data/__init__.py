@@ -1 +1,38 @@
-from .make_dataset import *
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    {
+        "cache": ["hash_dataframe", "hash_function", "StepCache"],
+        "make_dataset": [
+            "NUM_FEATS",
+            "CONFIG_DIR",
+            "DATASET_SUFFIXES",
+            "BRL_TRANSLATE_TABLE",
+            "BRL_NUMBER_PATTERN",
+            "FREQ_CATEGORIES",
+            "YES_NO_CATEGORIES",
+            "RAW_SCHEMA",
+            "CLEARED_SCHEMA",
+            "apply_schema",
+            "read_csv_with_schema",
+            "drop_cols",
+            "rename_cols",
+            "clear_numeric_strings",
+            "convert_to_numeric",
+            "parse_brl_currency",
+            "add_to_pipe",
+            "PIPELINE_STEPS",
+            "FUSION_RULES",
+            "PipelinePlan",
+            "load_pipeline_spec",
+            "PipelineProfiler",
+            "make_pipeline",
+            "make_pipeline_by_chunks",
+            "make_pipeline_incremental",
+            "save_dataset",
+            "load_dataset",
+            "list_funcs",
+        ],
+    },
+)
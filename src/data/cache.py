@@ -0,0 +1,205 @@
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+
+def hash_dataframe(dataframe: pd.DataFrame) -> str:
+    """
+    Content hash of a DataFrame. Takes into account the values, the index, the
+    column names and the dtypes.
+
+    Args:
+        dataframe (pd.DataFrame): DataFrame to hash.
+
+    Returns:
+        str: sha256 hex digest of the dataframe.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(list(dataframe.columns)).encode())
+    digest.update(repr([str(dtype) for dtype in dataframe.dtypes]).encode())
+    digest.update(
+        pd.util.hash_pandas_object(dataframe, index=True).to_numpy().tobytes()
+    )
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _module_source_hash(module_name: str) -> str:
+    """sha256 of the source of a module ("" if it has no source)."""
+    try:
+        source = inspect.getsource(inspect.getmodule(sys.modules[module_name]))
+    except (KeyError, OSError, TypeError):
+        source = ""
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def hash_function(f: dict) -> str:
+    """
+    Hash of a make_pipeline function dict: the function module, name and source
+    code, the source of the module that defines it (so editing a helper called
+    by the function changes the hash too), the pandas and numpy versions and the
+    repr of its function_args and function_kwargs.
+
+    Args:
+        f (dict): a dict with the make_pipeline functions pattern.
+
+    Returns:
+        str: sha256 hex digest of the function dict.
+    """
+    func = f["function"]
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = ""
+    module = getattr(func, "__module__", None) or ""
+    identity = [
+        module,
+        getattr(func, "__qualname__", repr(func)),
+        source,
+        _module_source_hash(module),
+        pd.__version__,
+        np.__version__,
+        repr(f.get("function_args")),
+        repr(f.get("function_kwargs")),
+    ]
+    return hashlib.sha256("\0".join(identity).encode()).hexdigest()
+
+
+class StepCache:
+    """
+    On-disk cache for the output of each make_pipeline step.
+
+    The key of a step is the hash of the previous step key and the step function
+    (see hash_function), starting with the hash of the input dataframe, so the
+    key of a step identifies the input and all the functions applied until it.
+    Outputs are saved as parquet files (needs pyarrow) and the least recently
+    used files are removed when the cache gets bigger than max_bytes.
+
+    Example:
+
+    >>>
+    cache = StepCache("./data/interim/pipeline_cache")
+    train_data = make_pipeline(dataframe=train_data, functions=list_funcs, cache=cache)
+    cache.stats()
+    # Output:
+    # {'hits': 3, 'misses': 0, 'evictions': 0, 'size_bytes': 1290552}
+
+    Args:
+        cache_dir (Union[str, Path]): directory to save the cached outputs.
+        max_bytes (int, optional): max size of the cache directory. Defaults to 1GiB.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = 2**30):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def step_keys(self, dataframe: pd.DataFrame, functions: list[dict]) -> list[str]:
+        """
+        Cache keys of each step of a make_pipeline run.
+
+        Args:
+            dataframe (pd.DataFrame): input dataframe of the pipeline.
+            functions (list[dict]): functions of the pipeline.
+
+        Returns:
+            list[str]: the key of each function in functions.
+        """
+        keys = []
+        key = hash_dataframe(dataframe)
+        for f in functions:
+            key = hashlib.sha256(f"{key}{hash_function(f)}".encode()).hexdigest()
+            keys.append(key)
+        return keys
+
+    def load_prefix(self, keys: list[str]) -> tuple[int, Union[pd.DataFrame, None]]:
+        """
+        Loads the output of the last cached step. The steps until it count as hits
+        and the steps after it as misses.
+
+        Args:
+            keys (list[str]): keys of the pipeline steps (see step_keys).
+
+        Returns:
+            tuple[int, Union[pd.DataFrame, None]]: the position of the first step to
+            run and the output of the step before it. If no step is cached returns
+            0 and None.
+        """
+        for i in range(len(keys) - 1, -1, -1):
+            path = self._path(keys[i])
+            if path.exists():
+                dataframe = self._read(path)
+                os.utime(path)
+                self.hits += i + 1
+                self.misses += len(keys) - i - 1
+                return i + 1, dataframe
+        self.misses += len(keys)
+        return 0, None
+
+    def save(self, key: str, dataframe: pd.DataFrame) -> None:
+        """
+        Saves a step output and evicts the least recently used outputs if the
+        cache is bigger than max_bytes.
+
+        Args:
+            key (str): key of the step.
+            dataframe (pd.DataFrame): output of the step.
+        """
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        dataframe.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: number of steps loaded from the cache (hits), steps computed
+            (misses), files evicted and current size of the cache in bytes.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size_bytes": sum(p.stat().st_size for p in self._files()),
+        }
+
+    def clear(self) -> None:
+        """Removes all cached outputs."""
+        for path in self._files():
+            path.unlink(missing_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.parquet"
+
+    def _read(self, path: Path) -> pd.DataFrame:
+        dataframe = pd.read_parquet(path)
+        # parquet gives back the missing values of object columns as None
+        for col in dataframe.select_dtypes(include="object").columns:
+            dataframe[col] = dataframe[col].where(dataframe[col].notna(), np.nan)
+        return dataframe
+
+    def _files(self) -> list[Path]:
+        return list(self.cache_dir.glob("*.parquet"))
+
+    def _evict(self) -> None:
+        files = sorted(self._files(), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for path in files:
+            if total <= self.max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+            self.evictions += 1
+            logging.getLogger(__name__).info(f"evicted {path.name} from step cache")
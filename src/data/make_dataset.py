@@ -1,13 +1,143 @@
 # -*- coding: utf-8 -*-
+import cProfile
+import importlib
+import inspect
+import json
 import logging
+import re
+import time
+import tracemalloc
+from collections.abc import Iterable
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Union
 
 import click
 import numpy as np
 import pandas as pd
+import yaml
 
 NUM_FEATS = ["receita_mensal", "receita_total"]
+CONFIG_DIR = Path(__file__).resolve().parents[2] / "config"
+DATASET_SUFFIXES = [".csv", ".parquet", ".feather"]
+BRL_TRANSLATE_TABLE = str.maketrans(
+    {"R": None, "$": None, ".": None, " ": None, ",": "."}
+)
+# a BRL value after BRL_TRANSLATE_TABLE: only digits, a decimal point and a sign,
+# so strings that float() also parses ("1,5e3", "inf", "nan") are invalid
+BRL_NUMBER_PATTERN = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)")
+FREQ_CATEGORIES = pd.CategoricalDtype(["Nunca utilizou", "Pouco uso", "Uso frequente"])
+YES_NO_CATEGORIES = pd.CategoricalDtype(["Não", "Sim"])
+# Declared dtypes of the low-cardinality string columns of the raw ERP export.
+# They are read as categoricals with these fixed categories (int8 codes), so
+# every file and chunk gets the same categories.
+RAW_SCHEMA = {
+    "Tipo de empresa": pd.CategoricalDtype(["Micro empresa", "Pequena empresa"]),
+    "Possui mais de um sócio": YES_NO_CATEGORIES,
+    "Funcionários": pd.CategoricalDtype(
+        ["até 5 funcionários", "6 ou mais funcionários"]
+    ),
+    "Utiliza serviços financeiros": YES_NO_CATEGORIES,
+    "PossuiContador": pd.CategoricalDtype(["Não ", "Sim"]),
+    "Faz conciliação bancária": pd.CategoricalDtype(
+        ["automática", "manual", "não faz"]
+    ),
+    "Frequência de utilização de feature do sistema: Módulo financeiro": FREQ_CATEGORIES,
+    "Frequência de utilização de feature do sistema: Emissão de nota fiscal": FREQ_CATEGORIES,
+    "Frequência de utilização de feature do sistema: Integração bancária": FREQ_CATEGORIES,
+    "Frequência de utilização de feature do sistema: Módulo de vendas": FREQ_CATEGORIES,
+    "Frequência de utilização de feature do sistema: Relatórios": FREQ_CATEGORIES,
+    "Frequência de utilização de feature do sistema: Utilização de APIs de integração": FREQ_CATEGORIES,
+    "Contrato": pd.CategoricalDtype(["Mês-a-mês", "Trimestral", "Anual"]),
+    "Emite boletos.1": pd.CategoricalDtype(["No", "Yes"]),
+    "Tipo de pagamento": pd.CategoricalDtype(
+        [
+            "Boleto - pagamento único",
+            "Boleto - mês a mês",
+            "Cartão de crédito - pagamento único",
+            "Cartão de crédito - mês a mês",
+        ]
+    ),
+    "Churn": YES_NO_CATEGORIES,
+}
+
+
+def _copy_frame(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copy used by the pipeline steps. With pandas copy-on-write enabled (see
+    make_pipeline copy_on_write) a shallow copy is enough because the data is only
+    copied when modified.
+    """
+    return dataframe.copy(deep=pd.get_option("mode.copy_on_write") is not True)
+
+
+def apply_schema(dataframe: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """
+    Converts the columns of dataframe in schema to their declared categorical
+    dtype. Columns of schema that aren't in dataframe are ignored. Values that
+    aren't in the declared categories become NaN and are logged.
+
+    Args:
+        dataframe (pd.DataFrame): Input DataFrame.
+        schema (dict): column name -> pd.CategoricalDtype (see RAW_SCHEMA).
+
+    Returns:
+        pd.DataFrame: A new DataFrame with the schema columns as categoricals.
+    """
+    logger = logging.getLogger(__name__)
+    new_df = _copy_frame(dataframe)
+    for col, dtype in schema.items():
+        if col not in new_df.columns:
+            continue
+        values = new_df[col].astype("category")
+        unknown = values.cat.categories.difference(dtype.categories)
+        if len(unknown) > 0:
+            n_unknown = values.isin(unknown).sum()
+            logger.warning(
+                f"{n_unknown} values of {col} not in the schema converted to NaN: "
+                f"{list(unknown[:5])}"
+            )
+        new_df[col] = values.cat.set_categories(dtype.categories)
+    return new_df
+
+
+def read_csv_with_schema(path: Union[str, Path], schema: dict, **kwargs):
+    """
+    pd.read_csv that reads the columns of schema as categoricals with the declared
+    categories (see apply_schema), instead of object columns. The other keyword
+    arguments are passed to pd.read_csv.
+
+    Args:
+        path (Union[str, Path]): csv file to read.
+        schema (dict): column name -> pd.CategoricalDtype (see RAW_SCHEMA).
+
+    Returns:
+        pd.DataFrame: the data, or an iterator of DataFrames if chunksize is given.
+    """
+    dtype = {col: "category" for col in schema}
+    dtype.update(kwargs.pop("dtype", {}))
+    data = pd.read_csv(path, dtype=dtype, **kwargs)
+    if isinstance(data, pd.DataFrame):
+        return apply_schema(data, schema)
+    return _SchemaReader(data, schema)
+
+
+class _SchemaReader:
+    """Chunks of a pd.read_csv TextFileReader with apply_schema applied."""
+
+    def __init__(self, reader, schema: dict):
+        self.reader = reader
+        self.schema = schema
+
+    def __iter__(self):
+        for chunk in self.reader:
+            yield apply_schema(chunk, self.schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reader.close()
 
 
 def drop_cols(dataframe: pd.DataFrame, subset: Union[str, list]) -> pd.DataFrame:
@@ -21,7 +151,7 @@ def drop_cols(dataframe: pd.DataFrame, subset: Union[str, list]) -> pd.DataFrame
     Returns:
         pd.DataFrame: a new DataFrame with dropped columns.
     """
-    new_df = dataframe.copy()
+    new_df = _copy_frame(dataframe)
     new_df = new_df.drop(labels=subset, axis=1)
     return new_df
 
@@ -42,7 +172,7 @@ def rename_cols(dataframe: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: A new DataFrame with the columns renamed according to the described steps.
     """
-    new_df = dataframe.copy()
+    new_df = _copy_frame(dataframe)
     new_cols_name = (
         pd.Series(dataframe.columns)
         .str.strip()
@@ -74,7 +204,7 @@ def clear_numeric_strings(
     Returns:
         pd.DataFrame: A new DataFrame with numeric strings cleaned in the specified columns.
     """
-    new_df = dataframe.copy()
+    new_df = _copy_frame(dataframe)
     if isinstance(subset, str):
         new_df[subset] = (
             new_df[subset]
@@ -107,11 +237,53 @@ def convert_to_numeric(
     Returns:
         pd.DataFrame: A new DataFrame with the subset columns changed to type float.
     """
-    new_df = dataframe.copy()
+    new_df = _copy_frame(dataframe)
     new_df[subset] = new_df[subset].astype("float")
     return new_df
 
 
+def parse_brl_currency(
+    dataframe: pd.DataFrame, subset: Union[str, list]
+) -> pd.DataFrame:
+    """
+    Converts BRL currency strings like "R$ 1.889,50" to float64 (1889.5). Does
+    the same of clear_numeric_strings followed by convert_to_numeric in one step:
+    for each column in subset the distinct values are parsed once with
+    BRL_TRANSLATE_TABLE (removes "R", "$", "." and spaces and changes "," to ".")
+    and mapped back to the rows. Values that can't be parsed or that aren't
+    only digits and separators (BRL_NUMBER_PATTERN, e.g. "1,5e3") become NaN and
+    their count is logged.
+
+    Args:
+        dataframe (pd.DataFrame): Input dataframe to parse currency strings.
+        subset (Union[str, list]): Column/Columns names with currency strings. If str
+        then one column is parsed or if list then each column in list is parsed.
+
+    Returns:
+        pd.DataFrame: A new DataFrame with the subset columns changed to type float.
+    """
+    logger = logging.getLogger(__name__)
+    new_df = _copy_frame(dataframe)
+    for col in [subset] if isinstance(subset, str) else subset:
+        if pd.api.types.is_numeric_dtype(new_df[col]):
+            new_df[col] = new_df[col].astype("float64")
+            continue
+        codes, uniques = pd.factorize(new_df[col])
+        values = (
+            pd.Series(uniques, dtype="object")
+            .astype(str)
+            .str.translate(BRL_TRANSLATE_TABLE)
+        )
+        values = values.where(values.str.fullmatch(BRL_NUMBER_PATTERN))
+        parsed = pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64")
+        n_invalid = np.isnan(parsed)[codes[codes >= 0]].sum()
+        if n_invalid > 0:
+            logger.warning(f"{n_invalid} invalid values in {col} converted to NaN")
+        # missing values have code -1, which takes the NaN appended at the end
+        new_df[col] = np.append(parsed, np.nan)[codes]
+    return new_df
+
+
 def add_to_pipe(
     dataframe: pd.DataFrame, func: callable, *args, **kwargs
 ) -> pd.DataFrame.pipe:
@@ -131,82 +303,699 @@ def add_to_pipe(
     return dataframe.pipe(func, *args, **kwargs)
 
 
-def make_pipeline(dataframe: pd.DataFrame, functions: list[dict]) -> pd.DataFrame:
+def _as_list(subset: Union[str, list]) -> list:
+    return [subset] if isinstance(subset, str) else list(subset)
+
+
+def _fuse_subsets(kwargs_a: dict, kwargs_b: dict) -> Union[dict, None]:
+    """Fuses two calls of a step over column subsets into one call over both."""
+    if kwargs_a.keys() != {"subset"} or kwargs_b.keys() != {"subset"}:
+        return None
+    if kwargs_a["subset"] is None or kwargs_b["subset"] is None:
+        return None
+    subset = _as_list(kwargs_a["subset"])
+    return {
+        "subset": subset + [c for c in _as_list(kwargs_b["subset"]) if c not in subset]
+    }
+
+
+def _fuse_brl_parsing(kwargs_a: dict, kwargs_b: dict) -> Union[dict, None]:
+    """clear_numeric_strings + convert_to_numeric on the same list of columns is
+    parse_brl_currency (with a str subset clear_numeric_strings keeps the ".")."""
+    if kwargs_a.keys() != {"subset"} or kwargs_b.keys() != {"subset"}:
+        return None
+    if isinstance(kwargs_a["subset"], str):
+        return None
+    if list(kwargs_a["subset"]) != _as_list(kwargs_b["subset"]):
+        return None
+    return kwargs_a
+
+
+# Registry of the functions that can be used in the pipeline specs (yaml files in
+# config/, see load_pipeline_spec) by name. src/features/build_features.py adds
+# the feature functions when it is imported (see _resolve_steps).
+PIPELINE_STEPS = {
+    "drop_cols": drop_cols,
+    "rename_cols": rename_cols,
+    "clear_numeric_strings": clear_numeric_strings,
+    "convert_to_numeric": convert_to_numeric,
+    "parse_brl_currency": parse_brl_currency,
+    "rename": pd.DataFrame.rename,
+}
+# (function, next function) -> (fused function, fuse(kwargs, next kwargs)). Adjacent
+# steps of a PipelinePlan are run as one call of the fused function when fuse
+# doesn't return None.
+FUSION_RULES = {
+    (drop_cols, drop_cols): (drop_cols, _fuse_subsets),
+    (parse_brl_currency, parse_brl_currency): (parse_brl_currency, _fuse_subsets),
+    (clear_numeric_strings, convert_to_numeric): (
+        parse_brl_currency,
+        _fuse_brl_parsing,
+    ),
+}
+
+
+def _compile_step(i: int, f: dict) -> tuple:
+    """
+    Checks a function dict of make_pipeline and binds its args to the signature
+    of the function, so wrong args fail before the pipeline runs.
+
+    Returns:
+        tuple: (function, args, kwargs) of the step.
+    """
+    unknown_keys = f.keys() - {"function", "function_args", "function_kwargs"}
+    if unknown_keys:
+        raise ValueError(f"step {i}: unknown keys {sorted(unknown_keys)}")
+    func = f.get("function")
+    if not callable(func):
+        raise TypeError(f"step {i}: function must be a callable")
+    args = f.get("function_args", ())
+    if isinstance(args, (str, dict)) or not isinstance(args, Iterable):
+        raise TypeError(f"step {i}: function_args must be a iterable")
+    args = tuple(args)
+    kwargs = f.get("function_kwargs", {})
+    if not isinstance(kwargs, dict):
+        raise TypeError(f"step {i}: function_kwargs must be a dict")
+    try:
+        signature = inspect.signature(func)
+    except (TypeError, ValueError):  # builtins without signature aren't checked
+        signature = None
+    if signature is not None:
+        try:
+            signature.bind(None, *args, **kwargs)
+        except TypeError as e:
+            raise TypeError(f"step {i} ({func.__qualname__}): {e}") from None
+    return func, args, kwargs
+
+
+def _fuse_steps(steps: list[tuple]) -> list[tuple]:
+    """Fuses the adjacent steps with a rule in FUSION_RULES."""
+    fused = []
+    for func, args, kwargs in steps:
+        if fused and not args and not fused[-1][1]:
+            rule = FUSION_RULES.get((fused[-1][0], func))
+            if rule is not None:
+                fused_kwargs = rule[1](fused[-1][2], kwargs)
+                if fused_kwargs is not None:
+                    fused[-1] = (rule[0], (), fused_kwargs)
+                    continue
+        fused.append((func, args, kwargs))
+    return fused
+
+
+class PipelinePlan:
+    """
+    make_pipeline functions validated and compiled once: each function dict is
+    checked and its args are bound to the function signature (see _compile_step),
+    and adjacent steps with a rule in FUSION_RULES are fused into one call (e.g.
+    two drop_cols, or clear_numeric_strings + convert_to_numeric as
+    parse_brl_currency). make_pipeline compiles its functions in a plan, so a
+    plan can be built once and reused by many runs (chunks, batches).
+
+    Example:
+
+    >>>
+    plan = PipelinePlan(list_funcs)
+    cleared_df = make_pipeline(dataframe=raw_df, functions=plan)
+
+    Args:
+        functions (list[dict]): List of dict with functions, same pattern used in
+        make_pipeline.
+        fuse (bool, optional): If False every function is a step. Defaults to True.
+    """
+
+    def __init__(self, functions: list[dict], fuse: bool = True):
+        self.functions = list(functions)
+        steps = [_compile_step(i, f) for i, f in enumerate(self.functions)]
+        self.steps = _fuse_steps(steps) if fuse else steps
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __repr__(self) -> str:
+        names = [func.__qualname__ for func, _, _ in self.steps]
+        return f"PipelinePlan({' -> '.join(names)})"
+
+
+class _SpecLoader(yaml.SafeLoader):
+    """yaml loader of the pipeline specs, with a !range [start, stop] tag."""
+
+
+_SpecLoader.add_constructor(
+    "!range", lambda loader, node: range(*loader.construct_sequence(node))
+)
+
+
+def _resolve_steps(names: set) -> None:
+    """
+    Imports src/features/build_features.py when a spec uses names that aren't in
+    PIPELINE_STEPS: the feature module registers its functions in PIPELINE_STEPS
+    and FUSION_RULES when it is imported. Only possible when this module is part
+    of the src package (python -m src.data.make_dataset, not as a script).
+    """
+    if names - PIPELINE_STEPS.keys() and __package__:
+        importlib.import_module("..features.build_features", __package__)
+
+
+def load_pipeline_spec(path: Union[str, Path]) -> list[dict]:
+    """
+    Loads a pipeline spec, a yaml file with the steps of a pipeline:
+
+        steps:
+        - function: drop_cols
+          function_kwargs:
+            subset: [Emite boletos.1, ID]
+        - function: rename_cols
+
+    Each function is a name of PIPELINE_STEPS (the feature functions of
+    build_features.py are registered when the spec uses them) and
+    function_args/function_kwargs are optional like in make_pipeline. Integer ranges are written as
+    !range [start, stop]. The spec is compiled in a PipelinePlan, so unknown
+    functions and wrong args fail here and not when the pipeline runs.
+
+    Args:
+        path (Union[str, Path]): path of the yaml spec.
+
+    Returns:
+        list[dict]: the functions of the spec in the make_pipeline pattern.
+    """
+    with open(path, encoding="utf-8") as f:
+        spec = yaml.load(f, Loader=_SpecLoader)
+    steps = spec.get("steps") or []
+    _resolve_steps({step.get("function") for step in steps})
+    functions = []
+    for i, step in enumerate(steps):
+        name = step.get("function")
+        if name not in PIPELINE_STEPS:
+            hint = "" if __package__ else " (run python -m src.data.make_dataset)"
+            raise ValueError(
+                f"{path} step {i}: unknown function {name!r}, "
+                f"the functions are {sorted(PIPELINE_STEPS)}{hint}"
+            )
+        functions.append({**step, "function": PIPELINE_STEPS[name]})
+    try:
+        PipelinePlan(functions)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"{path}: {e}") from None
+    return functions
+
+
+class PipelineProfiler:
+    """
+    Instrumentation hook of make_pipeline (profiler argument) that measures each
+    step: wall time, CPU time, peak memory allocated over the memory at the start
+    of the step (tracemalloc, which makes the steps slower), rows in and out and
+    the columns added and removed. Runs of many make_pipeline calls with the same
+    functions (chunks, batches) are summed by step position.
+
+    Example:
+
+    >>>
+    profiler = PipelineProfiler(keep_slowest=True)
+    cleared_df = make_pipeline(dataframe=raw_df, functions=list_funcs, profiler=profiler)
+    print(profiler.table())
+    profiler.to_json("./reports/pipeline_profile.json")
+    profiler.profile_slowest("./reports/slowest_step.prof")  # see python -m pstats
+
+    Args:
+        trace_memory (bool, optional): If False the peak memory isn't measured.
+        Defaults to True.
+        keep_slowest (bool, optional): If True keeps the input of the slowest step,
+        to run it again with cProfile in profile_slowest. Defaults to False.
+    """
+
+    def __init__(self, trace_memory: bool = True, keep_slowest: bool = False):
+        self.trace_memory = trace_memory
+        self.keep_slowest = keep_slowest
+        self.steps = {}
+        self._slowest = None
+
+    def run_step(
+        self, i: int, func: callable, dataframe: pd.DataFrame, args: tuple, kwargs: dict
+    ) -> pd.DataFrame:
+        """Runs step i of make_pipeline (func(dataframe, *args, **kwargs)) and records it."""
+        start_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        output = func(dataframe, *args, **kwargs)
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        peak_memory = None
+        if self.trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1] - memory_start
+        if start_tracing:
+            tracemalloc.stop()
+
+        step = self.steps.setdefault(
+            i,
+            {
+                "step": i,
+                "function": func.__qualname__,
+                "calls": 0,
+                "wall_s": 0.0,
+                "cpu_s": 0.0,
+                "peak_memory_mb": None,
+                "rows_in": 0,
+                "rows_out": 0,
+                "columns_added": [],
+                "columns_removed": [],
+            },
+        )
+        step["calls"] += 1
+        step["wall_s"] += wall
+        step["cpu_s"] += cpu
+        if peak_memory is not None:
+            step["peak_memory_mb"] = max(
+                step["peak_memory_mb"] or 0.0, peak_memory / 2**20
+            )
+        step["rows_in"] += len(dataframe)
+        step["rows_out"] += len(output)
+        step["columns_added"] = [
+            str(col) for col in output.columns.difference(dataframe.columns, sort=False)
+        ]
+        step["columns_removed"] = [
+            str(col) for col in dataframe.columns.difference(output.columns, sort=False)
+        ]
+        if self.keep_slowest and (self._slowest is None or wall > self._slowest[0]):
+            self._slowest = (wall, i, func, dataframe, args, kwargs)
+        return output
+
+    def report(self) -> pd.DataFrame:
+        """The measures of each step, with the share of the total wall time."""
+        report = pd.DataFrame(
+            [self.steps[i] for i in sorted(self.steps)],
+            columns=[
+                "step",
+                "function",
+                "calls",
+                "wall_s",
+                "cpu_s",
+                "peak_memory_mb",
+                "rows_in",
+                "rows_out",
+                "columns_added",
+                "columns_removed",
+            ],
+        )
+        report.insert(4, "wall_%", 100 * report["wall_s"] / report["wall_s"].sum())
+        return report.set_index("step")
+
+    def table(self) -> str:
+        """report as a text table, with the number of columns added and removed."""
+        report = self.report()
+        report["columns_added"] = report["columns_added"].str.len()
+        report["columns_removed"] = report["columns_removed"].str.len()
+        return report.to_string(float_format=lambda x: f"{x:.4f}")
+
+    def to_json(self, path: Union[str, Path]) -> Path:
+        """Saves the report of the steps and the totals in a json file."""
+        path = Path(path)
+        steps = [self.steps[i] for i in sorted(self.steps)]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "total_wall_s": sum(step["wall_s"] for step in steps),
+                    "total_cpu_s": sum(step["cpu_s"] for step in steps),
+                    "steps": steps,
+                },
+                f,
+                indent=2,
+                ensure_ascii=False,
+            )
+        return path
+
+    def profile_slowest(self, path: Union[str, Path]) -> Path:
+        """
+        Runs the slowest step again on its input with cProfile and saves the stats
+        to path (read with python -m pstats or snakeviz). Needs keep_slowest=True.
+        """
+        if self._slowest is None:
+            raise RuntimeError("no step kept, use PipelineProfiler(keep_slowest=True)")
+        _, _, func, dataframe, args, kwargs = self._slowest
+        profile = cProfile.Profile()
+        profile.runcall(func, dataframe, *args, **kwargs)
+        profile.dump_stats(path)
+        return Path(path)
+
+
+def make_pipeline(
+    dataframe: pd.DataFrame,
+    functions: Union[list[dict], PipelinePlan],
+    copy_on_write: bool = False,
+    cache=None,
+    profiler=None,
+) -> pd.DataFrame:
     """_summary_
 
     Args:
         dataframe (pd.DataFrame): _description_
-        functions (list): List of dict with functions to apply on input dataframe.
-        The dicts have this pattern:
+        functions (Union[list[dict], PipelinePlan]): List of dict with functions to
+        apply on input dataframe, or a PipelinePlan of them. The dicts have this pattern:
         {"function":func,"function_kwargs":{"keyword_1":value},"function_args":[value1,value2]}
         The dict must have a function but function_kwargs and function_args can be optional.
         If function_kwargs in dict its value must be a dict and if function_args in
-        dict then its must be a iterable.
+        dict then its must be a iterable. The functions are compiled in a
+        PipelinePlan before running, so wrong args raise TypeError before any
+        function is applied.
+        copy_on_write (bool, optional): If True the pipeline copies the input dataframe
+        once and runs the functions with pandas copy-on-write enabled, so the steps
+        don't make full copies of the dataframe. Defaults to False.
+        cache (src.data.cache.StepCache, optional): on-disk cache of the step outputs.
+        If given, the longest prefix of functions already cached for this input is
+        loaded instead of computed and the output of the other steps is saved in
+        the cache. Steps are not fused when a cache is given. Defaults to None.
+        profiler (PipelineProfiler, optional): instrumentation hook, an object with a
+        run_step(i, func, dataframe, args, kwargs) method that runs each step and
+        returns its output (see PipelineProfiler). Defaults to None.
 
     Returns:
         pd.DataFrame: A new DataFrame with all the functions listed applied on input dataframe
     """
+    if not isinstance(functions, PipelinePlan):
+        functions = PipelinePlan(functions, fuse=cache is None)
+    plan = functions
+    start = 0
+    new_df = None
+    if cache is not None:
+        if len(plan) != len(plan.functions):
+            plan = PipelinePlan(plan.functions, fuse=False)
+        keys = cache.step_keys(dataframe=dataframe, functions=plan.functions)
+        start, new_df = cache.load_prefix(keys)
+    if new_df is None:
+        new_df = dataframe.copy()
+
+    cow_context = (
+        pd.option_context("mode.copy_on_write", True)
+        if copy_on_write
+        else nullcontext()
+    )
+    with cow_context:
+        for i, (func, args, kwargs) in enumerate(plan.steps[start:], start=start):
+            if profiler is None:
+                new_df = func(new_df, *args, **kwargs)
+            else:
+                new_df = profiler.run_step(i, func, new_df, args, kwargs)
+            if cache is not None:
+                cache.save(keys[i], new_df)
+    return new_df
 
-    new_df = dataframe.copy()
-    for f in functions:
-        if "function_args" in f.keys() and "function_kwargs" in f.keys():
-            try:
-                new_df = add_to_pipe(
-                    new_df,
-                    *f["function_args"],
-                    func=f["function"],
-                    **f["function_kwargs"],
-                )
-            except TypeError:
-                print(
-                    "function_args must be a iterable and function_kwargs must be a dict."
+
+def make_pipeline_by_chunks(
+    input_file: Union[str, Path],
+    output_file: Union[str, Path],
+    functions: list[dict],
+    chunksize: int,
+    schema: Union[dict, None] = None,
+    profiler: Union[PipelineProfiler, None] = None,
+) -> int:
+    """
+    Streaming version of make_pipeline. Reads the input csv in chunks of
+    chunksize rows, applies the functions on each chunk and appends the result
+    to output_file, so peak memory depends on chunksize and not on the size of
+    the input file. Every function in functions must be row-wise (the output of a
+    row can't depend on other rows) for the result to be the same as
+    make_pipeline on the whole file.
+
+    Args:
+        input_file (Union[str, Path]): path to the csv file to read.
+        output_file (Union[str, Path]): path to the csv file to write. If it exists
+        it's overwritten.
+        functions (list[dict]): List of dict with functions to apply on each chunk.
+        Same pattern used in make_pipeline.
+        chunksize (int): number of rows read from input_file at a time.
+        schema (Union[dict, None], optional): declared categorical dtypes of the input
+        columns (see read_csv_with_schema), so all chunks have the same categories.
+        Defaults to None.
+        profiler (Union[PipelineProfiler, None], optional): instrumentation hook
+        given to make_pipeline for each chunk. Defaults to None.
+
+    Returns:
+        int: number of rows written to output_file.
+    """
+    logger = logging.getLogger(__name__)
+    plan = PipelinePlan(functions)
+    n_rows = 0
+    first_dtypes = None
+    with read_csv_with_schema(input_file, schema or {}, chunksize=chunksize) as reader:
+        for i, chunk in enumerate(reader):
+            cleared_chunk = make_pipeline(
+                dataframe=chunk, functions=plan, profiler=profiler
+            )
+            if first_dtypes is None:
+                first_dtypes = cleared_chunk.dtypes
+            elif not cleared_chunk.dtypes.equals(first_dtypes):
+                logger.warning(
+                    f"chunk {i} has different dtypes from the first chunk, "
+                    "output may differ from the in-memory pipeline."
                 )
-        elif "function_kwargs" in f.keys() and "function_args" not in f.keys():
-            try:
-                new_df = add_to_pipe(new_df, func=f["function"], **f["function_kwargs"])
-            except TypeError:
-                raise Exception(f"function_kwargs must be a dict")
-        elif "function_args" in f.keys() and "function_kwargs" not in f.keys():
-            try:
-                new_df = add_to_pipe(new_df, *f["function_args"], func=f["function"])
-            except TypeError:
-                raise Exception(f"function must be a iterable")
-        else:
-            try:
-                new_df = add_to_pipe(new_df, func=f["function"])
-            except TypeError:
-                raise Exception(f"function must be a callable")
-            except KeyError:
-                raise Exception(f"function must be a key on dict.")
-    return new_df
+            cleared_chunk.to_csv(
+                output_file, mode="w" if i == 0 else "a", header=i == 0, index=False
+            )
+            n_rows += len(cleared_chunk)
+    return n_rows
+
+
+def make_pipeline_incremental(
+    snapshot: pd.DataFrame,
+    delta: pd.DataFrame,
+    functions: list[dict],
+    id_col: str = "ID",
+    deleted_col: str = "_deleted",
+) -> pd.DataFrame:
+    """
+    Incremental version of make_pipeline. Updates snapshot, the output of
+    make_pipeline for the previous data indexed by id_col, with delta, the rows of
+    the input that changed since then. Only the rows of delta go through the
+    functions: changed customers replace their rows in snapshot, new customers are
+    appended at the end and the customers marked as deleted are removed. Like
+    make_pipeline_by_chunks, every function must be row-wise for the result to be
+    the same as make_pipeline on the whole updated input.
 
+    The customer id is kept as the index through the pipeline, so functions that
+    drop the id_col column (like drop_cols in list_funcs) can be used.
 
-list_funcs = [
-    {"function": drop_cols, "function_kwargs": {"subset": ["Emite boletos.1", "ID"]}},
-    {
-        "function": rename_cols,
-    },
-    {"function": clear_numeric_strings, "function_kwargs": {"subset": NUM_FEATS}},
-    {"function": convert_to_numeric, "function_kwargs": {"subset": NUM_FEATS}},
-]
+    Args:
+        snapshot (pd.DataFrame): previous output of the functions, indexed by id_col.
+        delta (pd.DataFrame): changed, new and deleted rows, in the input format of
+        functions and with the id_col column. If an id appears more than once, its
+        last row is used.
+        functions (list[dict]): List of dict with functions, same pattern used in
+        make_pipeline.
+        id_col (str, optional): customer id column. Defaults to "ID".
+        deleted_col (str, optional): column of delta with 1 for the deleted customers.
+        It's optional in delta and it isn't given to the functions. Defaults to "_deleted".
+
+    Returns:
+        pd.DataFrame: the updated output, indexed by id_col.
+    """
+    logger = logging.getLogger(__name__)
+    if snapshot.index.name != id_col or not snapshot.index.is_unique:
+        raise ValueError(f"snapshot must have a unique index named {id_col}")
+    delta = delta.drop_duplicates(subset=id_col, keep="last")
+    if deleted_col in delta.columns:
+        is_deleted = (
+            pd.to_numeric(delta[deleted_col], errors="coerce").fillna(0).astype(bool)
+        )
+        deleted_ids = pd.Index(delta.loc[is_deleted, id_col])
+        upserts = delta.loc[~is_deleted].drop(columns=deleted_col)
+    else:
+        deleted_ids = pd.Index([])
+        upserts = delta
+    upserts = upserts.set_index(pd.Index(upserts[id_col], name=id_col))
+    new_rows = make_pipeline(dataframe=upserts, functions=functions)
+    if list(new_rows.columns) != list(snapshot.columns):
+        raise ValueError("functions give different columns from the snapshot columns")
+    # the delta file can change dtypes (int columns with NaN in the deleted rows are
+    # read as float), so the rows get the snapshot dtypes when no value changes
+    for col in new_rows.columns[~new_rows.dtypes.eq(snapshot.dtypes)]:
+        try:
+            converted = new_rows[col].astype(snapshot[col].dtype)
+        except (TypeError, ValueError):
+            continue
+        if converted.astype(new_rows[col].dtype).equals(new_rows[col]):
+            new_rows[col] = converted
+    if not new_rows.dtypes.equals(snapshot.dtypes):
+        logger.warning(
+            "delta rows have different dtypes from the snapshot, "
+            "output may differ from the full pipeline."
+        )
+
+    kept = snapshot.drop(index=deleted_ids, errors="ignore")
+    is_update = new_rows.index.isin(kept.index)
+    order = kept.index.append(new_rows.index[~is_update])
+    updated = pd.concat([kept.drop(index=new_rows.index[is_update]), new_rows])
+    logger.info(
+        f"{(~is_update).sum()} added, {is_update.sum()} updated and "
+        f"{len(snapshot) - len(kept)} deleted rows, {len(kept) - is_update.sum()} unchanged"
+    )
+    return updated.loc[order]
+
+
+def save_dataset(dataframe: pd.DataFrame, path: Union[str, Path]) -> Path:
+    """
+    Saves dataframe in the format given by the path suffix: ".csv", ".parquet" or
+    ".feather". For parquet and feather the object (string) columns are saved as
+    category, so they are loaded back with the right dtype and without repeated
+    strings on disk. Parquet and feather need pyarrow installed.
+
+    Args:
+        dataframe (pd.DataFrame): DataFrame to save.
+        path (Union[str, Path]): file path to save the dataframe.
+
+    Returns:
+        Path: path of the saved file.
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        dataframe.to_csv(path, index=False)
+    elif path.suffix == ".parquet":
+        _object_to_category(dataframe).to_parquet(path, index=False)
+    elif path.suffix == ".feather":
+        _object_to_category(dataframe).reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError(f"{path.suffix} is not one of {DATASET_SUFFIXES}")
+    return path
+
+
+def load_dataset(
+    path: Union[str, Path],
+    columns: Union[list, None] = None,
+    schema: Union[dict, None] = None,
+) -> pd.DataFrame:
+    """
+    Loads a dataset saved with save_dataset. Parquet and feather files keep the
+    saved dtypes and only the requested columns are read from disk. For csv
+    files the schema columns are read as categoricals and the other object
+    (string) columns are converted to category after reading.
+
+    Args:
+        path (Union[str, Path]): path of the file to load.
+        columns (Union[list, None], optional): columns to load, in this order. If None
+        all columns are loaded. Defaults to None.
+        schema (Union[dict, None], optional): declared categorical dtypes (see
+        apply_schema), for example CLEARED_SCHEMA. The columns in schema get the
+        declared categories, so the same category gets the same code in every
+        file. Defaults to None.
+
+    Returns:
+        pd.DataFrame: the loaded dataset.
+    """
+    path = Path(path)
+    schema = schema or {}
+    if path.suffix == ".csv":
+        dataframe = _object_to_category(
+            read_csv_with_schema(path, schema, usecols=columns)
+        )
+        return dataframe if columns is None else dataframe[columns]
+    elif path.suffix == ".parquet":
+        return apply_schema(pd.read_parquet(path, columns=columns), schema)
+    elif path.suffix == ".feather":
+        return apply_schema(pd.read_feather(path, columns=columns), schema)
+    raise ValueError(f"{path.suffix} is not one of {DATASET_SUFFIXES}")
+
+
+def _object_to_category(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Changes the object columns of dataframe to category."""
+    object_cols = dataframe.select_dtypes(include="object").columns
+    return dataframe.astype({col: "category" for col in object_cols})
+
+
+# Pipeline specs of config/ exported as module attributes: the data cleaning
+# steps (list_funcs), from the raw ERP export to cleared_df. They are loaded on
+# the first access (module __getattr__, PEP 562), so importing this module
+# doesn't read the yaml files.
+PIPELINE_SPECS = {"list_funcs": CONFIG_DIR / "data_cleaning_pipeline.yaml"}
+
+
+def __getattr__(name: str):
+    if name not in PIPELINE_SPECS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    functions = load_pipeline_spec(PIPELINE_SPECS[name])
+    globals()[name] = functions
+    return functions
+
+
+# RAW_SCHEMA with the column names given by rename_cols (columns of cleared_df)
+CLEARED_SCHEMA = dict(
+    zip(
+        rename_cols(pd.DataFrame(columns=list(RAW_SCHEMA))).columns, RAW_SCHEMA.values()
+    )
+)
 
 
 @click.command()
 @click.argument("input_filepath", type=click.Path(exists=True))
 @click.argument("output_filepath", type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option(
+    "--chunksize",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Read and process the raw data in chunks of this many rows (csv output only).",
+)
+@click.option(
+    "--output-format",
+    type=click.Choice(["csv", "parquet", "feather"]),
+    default="csv",
+    help="File format of cleared_df. parquet and feather keep categorical dtypes.",
+)
+@click.option(
+    "--pipeline-spec",
+    type=click.Path(exists=True),
+    default=None,
+    help="yaml spec of the data cleaning steps. Defaults to config/data_cleaning_pipeline.yaml.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Log the time and memory of each step and save the report "
+    "(cleared_df_profile.json) and a cProfile dump of the slowest step "
+    "(cleared_df_slowest_step.prof) with cleared_df.",
+)
+def main(
+    input_filepath, output_filepath, chunksize, output_format, pipeline_spec, profile
+):
     """Runs data processing scripts to turn raw data from (../raw) into
     cleaned data ready to be analyzed (saved in ../processed).
     """
+    functions = load_pipeline_spec(pipeline_spec or PIPELINE_SPECS["list_funcs"])
     input_path = Path(input_filepath)
     output_path = Path(output_filepath)
     logger = logging.getLogger(__name__)
     logger.info("making final data set from raw data")
-    raw_df = pd.read_csv(input_path / "customer_churn_data - customer_churn_data.csv")
+    input_file = input_path / "customer_churn_data - customer_churn_data.csv"
+    output_file = output_path / f"cleared_df.{output_format}"
+    profiler = PipelineProfiler(keep_slowest=True) if profile else None
+
+    if chunksize is not None:
+        if output_format != "csv":
+            raise click.BadParameter(
+                "only csv output can be written in chunks", param_hint="--chunksize"
+            )
+        n_rows = make_pipeline_by_chunks(
+            input_file=input_file,
+            output_file=output_file,
+            functions=functions,
+            chunksize=chunksize,
+            schema=RAW_SCHEMA,
+            profiler=profiler,
+        )
+        logger.info(f"{n_rows} rows processed in chunks of {chunksize}")
+    else:
+        raw_df = read_csv_with_schema(input_file, RAW_SCHEMA)
+
+        cleared_df = make_pipeline(
+            dataframe=raw_df, functions=functions, profiler=profiler
+        )
 
-    cleared_df = make_pipeline(dataframe=raw_df, functions=list_funcs)
+        save_dataset(dataframe=cleared_df, path=output_file)
 
-    cleared_df.to_csv(output_path / "cleared_df.csv", index=False)
+    if profiler is not None:
+        logger.info(f"pipeline profile:\n{profiler.table()}")
+        profiler.to_json(output_path / "cleared_df_profile.json")
+        profiler.profile_slowest(output_path / "cleared_df_slowest_step.prof")
 
 
 if __name__ == "__main__":
@@ -216,4 +1005,9 @@ if __name__ == "__main__":
     # not used in this stub but often useful for finding various files
     project_dir = Path(__file__).resolve().parents[2]
 
-    main()
+    if __spec__ is None:  # run as a script, the specs can use only the steps above
+        main()
+    else:
+        # main of the imported module (python -m), because src.features registers
+        # the feature steps in its PIPELINE_STEPS and not in the ones of __main__
+        importlib.import_module(__spec__.name).main()
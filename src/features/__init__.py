@@ -1 +1,34 @@
-from .build_features import *
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    {
+        "build_features": [
+            "FREQ_COLS",
+            "MAP_TEMP_PERM",
+            "PROCESSED_SCHEMA",
+            "convert_to_categoric",
+            "classify_col",
+            "create_missing_indicator",
+            "count_class_frequency",
+            "create_eq_or_gt_feature",
+            "baseline_feature_funcs",
+            "rf_feature_funcs",
+            "list_feature_funcs",
+        ],
+        "record_features": [
+            "drop_cols_record",
+            "rename_cols_record",
+            "parse_brl_currency_record",
+            "classify_col_record",
+            "create_missing_indicator_record",
+            "count_class_frequency_record",
+            "create_eq_or_gt_feature_record",
+            "rename_record",
+            "RECORD_FUNCTIONS",
+            "compile_record_pipeline",
+            "make_record_pipeline",
+        ],
+        "parallel_pipeline": ["GLOBAL_STEPS", "make_pipeline_parallel"],
+    },
+)
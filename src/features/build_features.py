@@ -1,8 +1,41 @@
+import sys
 from typing import Union
 
 import numpy as np
 import pandas as pd
 
+from ..data.make_dataset import (
+    CLEARED_SCHEMA,
+    CONFIG_DIR,
+    FUSION_RULES,
+    PIPELINE_STEPS,
+    _as_list,
+    _copy_frame,
+    _fuse_subsets,
+    load_pipeline_spec,
+)
+
+FREQ_COLS = [
+    "frequência_de_utilização_de_feature_do_sistema_módulo_financeiro",
+    "frequência_de_utilização_de_feature_do_sistema_emissão_de_nota_fiscal",
+    "frequência_de_utilização_de_feature_do_sistema_integração_bancária",
+    "frequência_de_utilização_de_feature_do_sistema_módulo_de_vendas",
+    "frequência_de_utilização_de_feature_do_sistema_relatórios",
+    "frequência_de_utilização_de_feature_do_sistema_utilização_de_apis_de_integração",
+]
+MAP_TEMP_PERM = {
+    "Menor que 3 meses": range(0, 3),
+    "Entre 3 a 12 meses": range(3, 12),
+    "Entre 12 a 36 meses": range(12, 36),
+    "Maior que 36 meses": range(36, 100),
+}
+# declared categorical dtypes of train_data/test_data (see load_dataset schema),
+# where the target churn is already 0/1
+PROCESSED_SCHEMA = {
+    **{col: dtype for col, dtype in CLEARED_SCHEMA.items() if col != "churn"},
+    "clf_meses_permanência": pd.CategoricalDtype(list(MAP_TEMP_PERM)),
+}
+
 
 def convert_to_categoric(dataframe: pd.DataFrame, subset: Union[str, list]):
     """
@@ -17,17 +50,66 @@ def convert_to_categoric(dataframe: pd.DataFrame, subset: Union[str, list]):
     Returns:
         pd.DataFrame: A new DataFrame with the subset columns changed to type float.
     """
-    new_df = dataframe.copy()
+    new_df = _copy_frame(dataframe)
     new_df[subset] = new_df[subset].astype("category")
     return new_df
 
 
+def _map_to_intervals(map: dict) -> Union[pd.IntervalIndex, None]:
+    """
+    Converts the values of a classify_col map to an IntervalIndex. range objects
+    with step 1 become left closed intervals [start, stop). Returns None if some
+    value isn't a range or a pd.Interval or if the intervals overlap.
+    """
+    intervals = []
+    for values in map.values():
+        if isinstance(values, range) and values.step == 1 and len(values) > 0:
+            intervals.append(pd.Interval(values.start, values.stop, closed="left"))
+        elif isinstance(values, pd.Interval):
+            intervals.append(values)
+        else:
+            return None
+    try:
+        bins = pd.IntervalIndex(intervals)
+    except ValueError:
+        return None
+    if bins.is_overlapping:
+        return None
+    return bins
+
+
+def _bin_codes(values: pd.Series, bins: pd.IntervalIndex) -> np.ndarray:
+    """
+    Position of the interval in bins that contains each value, -1 if there is
+    none. bins must not overlap, so the only candidate for a value is the interval
+    with the biggest left edge not greater than it, found with one searchsorted.
+    """
+    if len(bins) == 0:
+        return np.full(len(values), -1)
+    values = values.to_numpy(dtype="float64", na_value=np.nan)
+    order = np.argsort(bins.left.to_numpy())
+    left = bins.left.to_numpy(dtype="float64")[order]
+    right = bins.right.to_numpy(dtype="float64")[order]
+    side = "right" if bins.closed_left else "left"
+    idx = np.searchsorted(left, values, side=side) - 1
+    candidate = np.clip(idx, 0, None)
+    if bins.closed_right:
+        in_bin = values <= right[candidate]
+    else:
+        in_bin = values < right[candidate]
+    return np.where((idx >= 0) & in_bin, order[candidate], -1)
+
+
 def classify_col(
     dataframe: pd.DataFrame, col_to_clf: str, new_col_name: str, map: dict
 ) -> pd.DataFrame:
     """
     Creates a qualitative column from a quantitative column. Search
-    for a range of values and sets a category for them.
+    for a range of values and sets a category for them. If all the values in
+    map are range (step 1) or pd.Interval objects that don't overlap, the column is
+    classified with one searchsorted over the interval edges, so float values are
+    also classified (range(0,3) is the interval [0,3)). Otherwise each value in
+    map is searched with Series.isin.
 
     Example:
 
@@ -54,43 +136,65 @@ def classify_col(
         classify columns. Example {"valores maiores que 10":range(10,20),"valor igual a 1 ou 2":[1,2]}
 
     Returns:
-        pd.DataFrame: A new dataframe with new qualitative columns.
+        pd.DataFrame: A new dataframe with new qualitative columns. The new column
+        is a category with the keys of map as categories and NaN for values that
+        don't belong to any class.
     """
-    new_df = dataframe.copy()
-    new_df[new_col_name] = np.nan
-    for cat, range in map.items():
-        values = dataframe[col_to_clf].isin(range)
-        new_df[new_col_name] = new_df[new_col_name].mask(values, cat)
+    new_df = _copy_frame(dataframe)
+    bins = _map_to_intervals(map)
+    if bins is not None:
+        codes = _bin_codes(dataframe[col_to_clf], bins)
+    else:
+        codes = np.full(len(dataframe), -1)
+        for i, values in enumerate(map.values()):
+            codes[dataframe[col_to_clf].isin(values).to_numpy()] = i
+    new_df[new_col_name] = pd.Categorical.from_codes(codes, categories=list(map.keys()))
     return new_df
 
 
-def create_missing_indicator(dataframe: pd.DataFrame) -> pd.DataFrame:
+def create_missing_indicator(
+    dataframe: pd.DataFrame, subset: Union[str, list, None] = None
+) -> pd.DataFrame:
     """
     Creates new columns that indicates a missing values in dataframe columns.
     Args:
         dataframe (pd.DataFrame): input DataFrame to search for missing values.
+        subset (Union[str, list, None], optional): Column/Columns to create the indicator
+        columns for, even if they have no missing values. Use it to get the same
+        columns on data that is processed in parts (batches, chunks). If None
+        creates indicators only for the columns with missing values. Defaults to None.
 
     Returns:
         pd.DataFrame: new DataFrame with missing value indicator columns. The new column names
         have name "is_columnname_null".
     """
-    new_df = dataframe.copy()
-    is_null_in_cols = new_df.isnull().any()
-    cols_with_null_values = list(is_null_in_cols[is_null_in_cols == True].index)
+    new_df = _copy_frame(dataframe)
+    if subset is None:
+        is_null_in_cols = new_df.isnull().any()
+        cols_with_null_values = list(is_null_in_cols[is_null_in_cols == True].index)
+    else:
+        cols_with_null_values = [subset] if isinstance(subset, str) else subset
     for col in cols_with_null_values:
         new_df[f"is_{col}_null"] = new_df[col].isnull().astype(int)
     return new_df
 
 
 def count_class_frequency(
-    dataframe: pd.DataFrame, class_to_count: str, columns: Union[str, list]
+    dataframe: pd.DataFrame,
+    class_to_count: Union[str, list],
+    columns: Union[str, list],
 ) -> pd.DataFrame:
     """
-    Count a frequency of a class on column/columns.
+    Count a frequency of a class on column/columns. The counts are made over
+    integer codes: categorical columns (see load_dataset schema) are compared by
+    their codes without decoding the strings and other columns are encoded once
+    with the classes as categories, so counting several classes costs the same
+    as counting one.
 
     Args:
         dataframe (pd.DataFrame): input DataFrame to count a class frequency.
-        class_to_count (str): the class value to count in column/columns
+        class_to_count (Union[str, list]): the class value to count in column/columns.
+        If list a count column is created for each class in list.
         columns (Union[str, list]): column/columns to count a class frequency.
         if str count a frequency on one column or if list count a frequency of class
         in each column in list.
@@ -99,15 +203,27 @@ def count_class_frequency(
         pd.DataFrame: a new DataFrame with count frequency columns. The
         name of the columns have this pattern "qty_class_to_count".
     """
-    new_df = dataframe.copy()
-    str_class_to_count = class_to_count.strip().lower().replace(" ", "")
-    new_df[f"qty_{str_class_to_count}"] = (
-        new_df[columns]
-        .map(
-            func=lambda s: 1 if s == class_to_count else 0,
-        )
-        .agg("sum", axis=1)
-    )
+    new_df = _copy_frame(dataframe)
+    if isinstance(class_to_count, str):
+        class_to_count = [class_to_count]
+    if isinstance(columns, str):
+        columns = [columns]
+    classes = list(dict.fromkeys(class_to_count))
+    class_codes = np.arange(len(classes), dtype="int8")
+    counts = np.zeros((len(new_df), len(classes)), dtype="int64")
+    for col in columns:
+        values = new_df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            targets = values.cat.categories.get_indexer(classes)
+            # classes that aren't categories of the column never match (-1 is NaN)
+            targets = np.where(targets >= 0, targets, -2)
+            counts += values.cat.codes.to_numpy()[:, np.newaxis] == targets
+        else:
+            codes = pd.Categorical(values, categories=classes).codes
+            counts += codes[:, np.newaxis] == class_codes
+    for i, cls in enumerate(classes):
+        str_class_to_count = cls.strip().lower().replace(" ", "")
+        new_df[f"qty_{str_class_to_count}"] = counts[:, i]
     return new_df
 
 
@@ -130,7 +246,70 @@ def create_eq_or_gt_feature(
     Returns:
         pd.DataFrame: new DataFrame that contain the new feature.
     """
-    new_df = dataframe.copy()
+    new_df = _copy_frame(dataframe)
     new_df[feature_name] = new_df[columns].gt(value) | new_df[columns].eq(value)
     new_df[feature_name] = new_df[feature_name].astype("int")
     return new_df
+
+
+def _fuse_class_counts(kwargs_a: dict, kwargs_b: dict) -> Union[dict, None]:
+    """Fuses two count_class_frequency on the same columns into one call that
+    counts the classes of both."""
+    if kwargs_a.keys() != {"class_to_count", "columns"} or kwargs_b.keys() != {
+        "class_to_count",
+        "columns",
+    }:
+        return None
+    if _as_list(kwargs_a["columns"]) != _as_list(kwargs_b["columns"]):
+        return None
+    return {
+        "class_to_count": _as_list(kwargs_a["class_to_count"])
+        + _as_list(kwargs_b["class_to_count"]),
+        "columns": kwargs_a["columns"],
+    }
+
+
+PIPELINE_STEPS.update(
+    {
+        "convert_to_categoric": convert_to_categoric,
+        "classify_col": classify_col,
+        "create_missing_indicator": create_missing_indicator,
+        "count_class_frequency": count_class_frequency,
+        "create_eq_or_gt_feature": create_eq_or_gt_feature,
+    }
+)
+FUSION_RULES.update(
+    {
+        (count_class_frequency, count_class_frequency): (
+            count_class_frequency,
+            _fuse_class_counts,
+        ),
+        (create_missing_indicator, create_missing_indicator): (
+            create_missing_indicator,
+            _fuse_subsets,
+        ),
+    }
+)
+
+# Functions (make_pipeline pattern) that build the features of the models, from
+# the pipeline specs in config/. baseline_feature_funcs are the steps of
+# notebook 03, from the cleared data (output of src/data/make_dataset.py) to
+# train_data.csv/test_data.csv, rf_feature_funcs are the steps of notebook 04
+# for the random forest and list_feature_funcs are both. Like list_funcs of
+# make_dataset they are loaded on the first access (module __getattr__).
+PIPELINE_SPECS = {
+    "baseline_feature_funcs": CONFIG_DIR / "baseline_features_pipeline.yaml",
+    "rf_feature_funcs": CONFIG_DIR / "rf_features_pipeline.yaml",
+}
+
+
+def __getattr__(name: str):
+    if name == "list_feature_funcs":
+        module = sys.modules[__name__]
+        functions = module.baseline_feature_funcs + module.rf_feature_funcs
+    elif name in PIPELINE_SPECS:
+        functions = load_pipeline_spec(PIPELINE_SPECS[name])
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = functions
+    return functions
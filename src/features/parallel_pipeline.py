@@ -0,0 +1,177 @@
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # make_pipeline_parallel runs the pipeline in one process
+    feather = None
+
+from ..data.make_dataset import make_pipeline
+from .build_features import create_missing_indicator
+
+
+def _null_columns(dataframe: pd.DataFrame) -> pd.Series:
+    return dataframe.isnull().any()
+
+
+def _missing_indicator_is_global(f: dict) -> bool:
+    return (
+        not f.get("function_args")
+        and f.get("function_kwargs", {}).get("subset") is None
+    )
+
+
+def _missing_indicator_resolve(f: dict, summaries: list) -> dict:
+    has_null = pd.concat(summaries, axis=1).any(axis=1)
+    return {
+        **f,
+        "function_kwargs": {
+            **f.get("function_kwargs", {}),
+            "subset": list(has_null[has_null].index),
+        },
+    }
+
+
+# Steps whose output depends on all the rows. pipeline function ->
+# (is_global(f), summarize(shard before the step), resolve(f, summaries)): the
+# shards are summarized in the workers and resolve gives a row-wise version of f
+# (create_missing_indicator with the subset of the columns with nulls in any shard)
+GLOBAL_STEPS = {
+    create_missing_indicator: (
+        _missing_indicator_is_global,
+        _null_columns,
+        _missing_indicator_resolve,
+    ),
+}
+
+
+def _split_global_steps(functions: list[dict]) -> list[list[dict]]:
+    """Splits functions before each global step (see GLOBAL_STEPS)."""
+    segments = [[]]
+    for f in functions:
+        step = GLOBAL_STEPS.get(f["function"])
+        if step is not None and step[0](f):
+            segments.append([])
+        segments[-1].append(f)
+    return segments
+
+
+def _write_shard(dataframe: pd.DataFrame, path: Path):
+    feather.write_feather(dataframe, path, compression="uncompressed")
+
+
+def _read_shard(path: Path) -> pd.DataFrame:
+    dataframe = feather.read_table(path, memory_map=True).to_pandas()
+    # arrow gives back the missing values of object columns as None
+    for col in dataframe.select_dtypes(include="object").columns:
+        dataframe[col] = dataframe[col].where(dataframe[col].notna(), np.nan)
+    return dataframe
+
+
+def _run_shard(
+    input_path: Path,
+    output_path: Path,
+    functions: list[dict],
+    summarize: Union[callable, None],
+):
+    """Worker of make_pipeline_parallel: runs functions on one shard file and
+    writes the output to output_path. Returns the summary for the next global step."""
+    shard = make_pipeline(dataframe=_read_shard(input_path), functions=functions)
+    _write_shard(shard, output_path)
+    return summarize(shard) if summarize is not None else None
+
+
+def make_pipeline_parallel(
+    dataframe: pd.DataFrame,
+    functions: list[dict],
+    n_jobs: Union[int, None] = None,
+    shard_size: Union[int, None] = None,
+    tmp_dir: Union[str, Path, None] = None,
+) -> pd.DataFrame:
+    """
+    Multi-process version of make_pipeline. The rows of dataframe are split in
+    shards, the functions run on the shards in a pool of n_jobs processes and the
+    outputs are concatenated in the order of the rows. The shards are exchanged as
+    uncompressed Arrow (feather) files that the workers memory map, so the
+    dataframe isn't pickled to the processes.
+
+    The functions must be row-wise, except the steps in GLOBAL_STEPS:
+    create_missing_indicator without subset creates the indicators of the columns
+    with nulls in the whole dataframe, so the pipeline stops before it, the null
+    columns of all shards are combined and the step runs with that subset. The
+    functions must be picklable (module level functions, not lambdas).
+
+    Example:
+
+    >>>
+    cleared_df = make_pipeline_parallel(dataframe=raw_df, functions=list_funcs, n_jobs=4)
+
+    Args:
+        dataframe (pd.DataFrame): input DataFrame. Column names must be strings.
+        functions (list[dict]): List of dict with functions, same pattern used in
+        make_pipeline.
+        n_jobs (Union[int, None], optional): number of processes. If None uses
+        os.cpu_count(). With 1 process (or without pyarrow) runs make_pipeline.
+        Defaults to None.
+        shard_size (Union[int, None], optional): rows of each shard. If None the
+        rows are split in n_jobs shards. Defaults to None.
+        tmp_dir (Union[str, Path, None], optional): directory of the shard files.
+        If None uses the system temp directory. Defaults to None.
+
+    Returns:
+        pd.DataFrame: same output of make_pipeline(dataframe, functions).
+    """
+    logger = logging.getLogger(__name__)
+    n_jobs = n_jobs or os.cpu_count()
+    n_shards = n_jobs if shard_size is None else -(-len(dataframe) // shard_size)
+    n_shards = min(n_shards, len(dataframe))
+    if n_jobs == 1 or n_shards <= 1 or feather is None:
+        if feather is None:
+            logger.warning("pyarrow is not installed, running make_pipeline")
+        return make_pipeline(dataframe=dataframe, functions=functions)
+
+    segments = _split_global_steps(functions)
+    bounds = np.linspace(0, len(dataframe), n_shards + 1).astype(int)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp, ProcessPoolExecutor(
+        max_workers=n_jobs
+    ) as executor:
+        paths = [Path(tmp) / f"shard_{i}_0.arrow" for i in range(n_shards)]
+        for path, start, end in zip(paths, bounds[:-1], bounds[1:]):
+            _write_shard(dataframe.iloc[start:end], path)
+        summaries = None
+        for k, segment in enumerate(segments):
+            if summaries is not None:
+                segment = [
+                    GLOBAL_STEPS[segment[0]["function"]][2](segment[0], summaries)
+                ] + segment[1:]
+            next_step = segments[k + 1][0] if k + 1 < len(segments) else None
+            summarize = (
+                GLOBAL_STEPS[next_step["function"]][1]
+                if next_step is not None
+                else None
+            )
+            outputs = [Path(tmp) / f"shard_{i}_{k + 1}.arrow" for i in range(n_shards)]
+            summaries = list(
+                executor.map(
+                    _run_shard,
+                    paths,
+                    outputs,
+                    [segment] * n_shards,
+                    [summarize] * n_shards,
+                )
+            )
+            for path in paths:
+                path.unlink()
+            paths = outputs
+        new_df = pd.concat([_read_shard(path) for path in paths])
+    logger.info(
+        f"{len(dataframe)} rows processed in {n_shards} shards by {n_jobs} processes"
+    )
+    return new_df
@@ -0,0 +1,207 @@
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import Union
+
+import pandas as pd
+
+from ..data.make_dataset import (
+    BRL_NUMBER_PATTERN,
+    BRL_TRANSLATE_TABLE,
+    _as_list,
+    drop_cols,
+    parse_brl_currency,
+    rename_cols,
+)
+from .build_features import (
+    _map_to_intervals,
+    classify_col,
+    count_class_frequency,
+    create_eq_or_gt_feature,
+    create_missing_indicator,
+)
+
+
+def _is_null(value) -> bool:
+    """Same of pd.isna for the scalar values of a record (None and NaN)."""
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+@lru_cache(maxsize=None)
+def _cached_intervals(map_items: tuple) -> Union[pd.IntervalIndex, None]:
+    return _map_to_intervals(dict(map_items))
+
+
+def _record_intervals(map: dict) -> Union[pd.IntervalIndex, None]:
+    """_map_to_intervals of map, cached when the values of map are hashable."""
+    try:
+        return _cached_intervals(tuple(map.items()))
+    except TypeError:
+        return _map_to_intervals(map)
+
+
+def drop_cols_record(record: dict, subset: Union[str, list]) -> dict:
+    """Record version of drop_cols. Missing keys are ignored."""
+    subset = set(_as_list(subset))
+    return {key: value for key, value in record.items() if key not in subset}
+
+
+@lru_cache(maxsize=None)
+def _rename_col(col: str) -> str:
+    """The name given by rename_cols to col."""
+    return re.sub(r"([:.,])", "", col.strip().lower().replace(" ", "_"))
+
+
+def rename_cols_record(record: dict) -> dict:
+    """Record version of rename_cols."""
+    return {_rename_col(key): value for key, value in record.items()}
+
+
+def parse_brl_currency_record(record: dict, subset: Union[str, list]) -> dict:
+    """Record version of parse_brl_currency."""
+    logger = logging.getLogger(__name__)
+    new_record = dict(record)
+    for col in _as_list(subset):
+        value = record[col]
+        if _is_null(value):
+            new_record[col] = math.nan
+        elif isinstance(value, (int, float)):
+            new_record[col] = float(value)
+        else:
+            value = str(value).translate(BRL_TRANSLATE_TABLE)
+            if BRL_NUMBER_PATTERN.fullmatch(value):
+                new_record[col] = float(value)
+            else:
+                logger.warning(f"1 invalid values in {col} converted to NaN")
+                new_record[col] = math.nan
+    return new_record
+
+
+def classify_col_record(
+    record: dict, col_to_clf: str, new_col_name: str, map: dict
+) -> dict:
+    """Record version of classify_col. Values that don't belong to any class are NaN."""
+    new_record = dict(record)
+    value = record[col_to_clf]
+    bins = _record_intervals(map)
+    new_value = math.nan
+    if _is_null(value):
+        pass
+    elif bins is not None:
+        for cls, interval in zip(map.keys(), bins):
+            if value in interval:
+                new_value = cls
+                break
+    else:
+        for cls, values in map.items():
+            if value in values:
+                new_value = cls
+    new_record[new_col_name] = new_value
+    return new_record
+
+
+def create_missing_indicator_record(
+    record: dict, subset: Union[str, list, None] = None
+) -> dict:
+    """Record version of create_missing_indicator."""
+    new_record = dict(record)
+    if subset is None:
+        cols = [col for col, value in record.items() if _is_null(value)]
+    else:
+        cols = _as_list(subset)
+    for col in cols:
+        new_record[f"is_{col}_null"] = int(_is_null(record[col]))
+    return new_record
+
+
+def count_class_frequency_record(
+    record: dict, class_to_count: Union[str, list], columns: Union[str, list]
+) -> dict:
+    """Record version of count_class_frequency."""
+    new_record = dict(record)
+    values = [record[col] for col in _as_list(columns)]
+    for cls in dict.fromkeys(_as_list(class_to_count)):
+        str_class_to_count = cls.strip().lower().replace(" ", "")
+        new_record[f"qty_{str_class_to_count}"] = sum(v == cls for v in values)
+    return new_record
+
+
+def create_eq_or_gt_feature_record(
+    record: dict, value: Union[int, float], columns: str, feature_name: str
+) -> dict:
+    """Record version of create_eq_or_gt_feature (columns must be one column)."""
+    new_record = dict(record)
+    new_record[feature_name] = int(record[columns] >= value)
+    return new_record
+
+
+def rename_record(record: dict, columns: dict) -> dict:
+    """Record version of pd.DataFrame.rename(columns=columns)."""
+    return {columns.get(key, key): value for key, value in record.items()}
+
+
+# pipeline function -> record version, used by compile_record_pipeline
+RECORD_FUNCTIONS = {
+    drop_cols: drop_cols_record,
+    rename_cols: rename_cols_record,
+    parse_brl_currency: parse_brl_currency_record,
+    classify_col: classify_col_record,
+    create_missing_indicator: create_missing_indicator_record,
+    count_class_frequency: count_class_frequency_record,
+    create_eq_or_gt_feature: create_eq_or_gt_feature_record,
+    pd.DataFrame.rename: rename_record,
+}
+
+
+def compile_record_pipeline(functions: list[dict]) -> list[tuple]:
+    """
+    Changes the functions of a make_pipeline list (see make_pipeline) by their
+    record versions (RECORD_FUNCTIONS), so a single customer (a dict from column
+    name to value) is processed without building a DataFrame. The lookups are done
+    once here and not for each record.
+
+    Example:
+
+    >>>
+    steps = compile_record_pipeline(list_funcs + list_feature_funcs)
+    features = make_record_pipeline(raw_record, steps)
+
+    Args:
+        functions (list[dict]): List of dict with functions, same pattern used in
+        make_pipeline.
+
+    Returns:
+        list[tuple]: (record function, args, kwargs) of each function.
+    """
+    steps = []
+    for f in functions:
+        func = f["function"]
+        if func not in RECORD_FUNCTIONS:
+            raise ValueError(f"{func.__qualname__} has no record version")
+        steps.append(
+            (
+                RECORD_FUNCTIONS[func],
+                tuple(f.get("function_args", ())),
+                f.get("function_kwargs", {}),
+            )
+        )
+    return steps
+
+
+def make_record_pipeline(record: dict, steps: list[tuple]) -> dict:
+    """
+    Applies the steps of compile_record_pipeline on record. The output has the
+    same values of the row of make_pipeline applied on a one row DataFrame.
+
+    Args:
+        record (dict): a customer, from column name to value. Missing values are
+        None or NaN.
+        steps (list[tuple]): output of compile_record_pipeline.
+
+    Returns:
+        dict: a new record with all the steps applied.
+    """
+    for func, args, kwargs in steps:
+        record = func(record, *args, **kwargs)
+    return record
@@ -0,0 +1,82 @@
+import logging
+
+import click
+import pandas as pd
+
+from ..data.make_dataset import (
+    CLEARED_SCHEMA,
+    RAW_SCHEMA,
+    list_funcs,
+    load_dataset,
+    make_pipeline_incremental,
+    read_csv_with_schema,
+    save_dataset,
+)
+from .build_features import PROCESSED_SCHEMA, list_feature_funcs
+from .parallel_pipeline import make_pipeline_parallel
+
+# categorical dtypes of the features built from the raw export
+FEATURES_SCHEMA = {**CLEARED_SCHEMA, **PROCESSED_SCHEMA}
+
+
+@click.command()
+@click.argument("delta_filepath", type=click.Path(exists=True))
+@click.argument("output_filepath", type=click.Path())
+@click.option(
+    "--snapshot",
+    "snapshot_filepath",
+    type=click.Path(exists=True),
+    default=None,
+    help="Features of the previous run. If not given DELTA_FILEPATH is a full export.",
+)
+@click.option("--id-col", default="ID", show_default=True)
+@click.option(
+    "--deleted-col",
+    default="_deleted",
+    show_default=True,
+    help="Column of the delta file with 1 for the deleted customers.",
+)
+@click.option(
+    "--n-jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Processes used to build the features of a full export.",
+)
+def main(
+    delta_filepath, output_filepath, snapshot_filepath, id_col, deleted_col, n_jobs
+):
+    """Updates the features of the customers (data cleaning and features of
+    list_funcs + list_feature_funcs) with a delta of the raw ERP export
+    (DELTA_FILEPATH, csv with the changed, new and deleted customers), recomputing
+    only the rows in the delta. The features are saved with the id_col column to
+    OUTPUT_FILEPATH (.csv, .parquet or .feather, see save_dataset), to be the
+    snapshot of the next run.
+    """
+    logger = logging.getLogger(__name__)
+    functions = list_funcs + list_feature_funcs
+    delta = read_csv_with_schema(delta_filepath, RAW_SCHEMA)
+    if snapshot_filepath is None:
+        full = delta.drop(columns=deleted_col, errors="ignore")
+        full = full.set_index(pd.Index(full[id_col], name=id_col))
+        features = make_pipeline_parallel(
+            dataframe=full, functions=functions, n_jobs=n_jobs
+        )
+    else:
+        snapshot = load_dataset(snapshot_filepath, schema=FEATURES_SCHEMA)
+        features = make_pipeline_incremental(
+            snapshot=snapshot.set_index(id_col),
+            delta=delta,
+            functions=functions,
+            id_col=id_col,
+            deleted_col=deleted_col,
+        )
+    save_dataset(features.reset_index(), output_filepath)
+    logger.info(f"{len(features)} customers saved to {output_filepath}")
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
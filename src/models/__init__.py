@@ -1,2 +1,36 @@
-from .predict_model import *
-from .train_model import *
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    {
+        "explain_model": [
+            "feature_groups",
+            "make_explainer",
+            "explain",
+            "top_reasons",
+            "explain_by_batches",
+        ],
+        "predict_model": ["make_predict", "load_model_config", "predict_by_batches"],
+        "select_features": [
+            "FeatureSelection",
+            "select_features",
+            "save_feature_selection",
+        ],
+        "threshold_optimizer": [
+            "CostMatrix",
+            "sweep_thresholds",
+            "optimize_threshold",
+            "save_decision_threshold",
+            "save_artifact_threshold",
+        ],
+        "train_model": [
+            "MODELS",
+            "CategoricalOneHotEncoder",
+            "make_preprocessor",
+            "make_model_pipeline",
+            "save_model",
+            "find_model",
+            "load_model",
+        ],
+    },
+)
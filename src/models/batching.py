@@ -0,0 +1,272 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Union
+
+import numpy as np
+import pandas as pd
+
+from .predict_model import make_predict
+
+if TYPE_CHECKING:  # sklearn is imported when a model is loaded, not with this module
+    from sklearn.pipeline import Pipeline
+
+
+def _n_rows(X: Union[pd.DataFrame, np.ndarray]) -> int:
+    return len(X) if isinstance(X, pd.DataFrame) else np.atleast_2d(X).shape[0]
+
+
+def _concat(Xs: list) -> Union[pd.DataFrame, np.ndarray]:
+    if isinstance(Xs[0], pd.DataFrame):
+        return pd.concat(Xs, ignore_index=True)
+    return np.vstack([np.atleast_2d(X) for X in Xs])
+
+
+def _run_on_loop(loop: asyncio.AbstractEventLoop, func, *args, **kwargs):
+    """
+    Calls func on the thread of loop and waits for its result. If loop stops
+    before running it (or is closed), func is called in the current thread.
+    """
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    try:
+        loop.call_soon_threadsafe(run)
+    except RuntimeError:  # closed loop
+        return func(*args, **kwargs)
+    while True:
+        try:
+            return future.result(timeout=0.1)
+        except TimeoutError:
+            if not loop.is_running() and future.cancel():
+                return func(*args, **kwargs)
+
+
+class PredictionBatcher:
+    """
+    Coalesces many small concurrent make_predict calls into batches. The rows
+    submitted by the callers are queued and a worker thread flushes the queue when
+    it has max_batch_size rows or when the first queued rows waited max_wait_ms,
+    runs one make_predict on the whole batch and gives each caller the predictions
+    of its rows. So the fixed cost of a model call (the ColumnTransformer.transform
+    and the dispatch of each tree of a forest) is paid once per batch.
+
+    Can be used from threads (predict, submit) and from asyncio (predict_async).
+    The batches of predict_async calls are predicted on the thread of their event
+    loop and not on the worker thread, because the numba kernels of a
+    CompiledForest must not run on worker threads (see forest_inference). So
+    don't block the event loop waiting for the batcher (e.g. call close with
+    asyncio.to_thread).
+    metrics reports the queue depth, the batch size histogram, the latency
+    percentiles and the throughput, to choose max_batch_size and max_wait_ms: a
+    bigger wait makes bigger batches (more throughput) but adds latency to each call.
+
+    Example:
+
+    >>>
+    with PredictionBatcher(model=rf_pipeline, threshold=0.53, max_wait_ms=2) as batcher:
+        y_pred_proba, y_pred_cls = batcher.predict(X_test.iloc[[0]])
+
+    Args:
+        model (Pipeline): The model fitted to make predict (see make_predict).
+        threshold (float, optional): Threshold to make the decision to churn. Defaults to 0.5.
+        max_batch_size (int, optional): rows that flush the queue. A single call
+        with more rows is predicted in one batch. Defaults to 64.
+        max_wait_ms (float, optional): max time the first queued rows wait for
+        other rows. Defaults to 2.0.
+        dtype (Union[str, np.dtype], optional): dtype of the probabilities (see
+        make_predict). Defaults to "float64".
+        latency_window (int, optional): number of latest calls kept for the latency
+        percentiles. Defaults to 10000.
+    """
+
+    def __init__(
+        self,
+        model: "Pipeline",
+        threshold: float = 0.5,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 2.0,
+        dtype: Union[str, np.dtype] = "float64",
+        latency_window: int = 10000,
+    ):
+        self.model = model
+        self.threshold = threshold
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.dtype = dtype
+        self.latency_window = latency_window
+        self._lock = threading.Lock()
+        self.reset_metrics()
+        self._queue = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(
+            target=self._run, name="PredictionBatcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(
+        self,
+        X: Union[pd.DataFrame, np.ndarray],
+        loop: Union[asyncio.AbstractEventLoop, None] = None,
+    ) -> Future:
+        """
+        Queues the rows of X (a DataFrame, a 2d array or a single row as 1d array).
+        If loop is given the batch of X is predicted on the thread of loop.
+
+        Returns:
+            Future: resolves to (y_pred_proba, y_pred_cls) of the rows of X.
+        """
+        future = Future()
+        # under the lock, so no call is queued after the stop of close
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("PredictionBatcher is closed")
+            self._queue.put((X, future, time.perf_counter(), loop))
+        return future
+
+    def predict(self, X: Union[pd.DataFrame, np.ndarray], timeout=None) -> tuple:
+        """Blocking version of submit: returns (y_pred_proba, y_pred_cls) of X."""
+        return self.submit(X).result(timeout)
+
+    async def predict_async(self, X: Union[pd.DataFrame, np.ndarray]) -> tuple:
+        """asyncio version of submit: returns (y_pred_proba, y_pred_cls) of X."""
+        return await asyncio.wrap_future(self.submit(X, asyncio.get_running_loop()))
+
+    def _run(self):
+        """Worker loop: collects the queued calls into batches and predicts them."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, n_rows, stop = [item], _n_rows(item[0]), False
+            deadline = item[2] + self.max_wait_ms / 1000
+            while n_rows < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                n_rows += _n_rows(item[0])
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if batch:
+                self._predict_batch(batch)
+            if stop:
+                return
+
+    def _predict_batch(self, batch: list):
+        """Predicts a batch. If it fails, its calls are predicted one by one, so an
+        invalid call doesn't fail the other calls of the batch."""
+        start = time.perf_counter()
+        loop = next((loop for *_, loop in batch if loop is not None), None)
+        kwargs = {
+            "model": self.model,
+            "X_test": _concat([X for X, *_ in batch]),
+            "threshold": self.threshold,
+            "return_classes": True,
+            "dtype": self.dtype,
+        }
+        try:
+            if loop is None:
+                y_pred_proba, y_pred_cls = make_predict(**kwargs)
+            else:
+                y_pred_proba, y_pred_cls = _run_on_loop(loop, make_predict, **kwargs)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                for item in batch:
+                    self._predict_batch([item])
+            return
+        end = time.perf_counter()
+        offset = 0
+        for X, future, *_ in batch:
+            n = _n_rows(X)
+            future.set_result(
+                (y_pred_proba[offset : offset + n], y_pred_cls[offset : offset + n])
+            )
+            offset += n
+        with self._lock:
+            self._batch_sizes[offset] += 1
+            self._rows += offset
+            self._model_seconds += end - start
+            for _, _, submitted, _ in batch:
+                self._waits.append(start - submitted)
+                self._latencies.append(end - submitted)
+
+    def reset_metrics(self):
+        """Clears the metrics."""
+        with self._lock:
+            self._batch_sizes = Counter()
+            self._rows = 0
+            self._model_seconds = 0.0
+            self._waits = deque(maxlen=self.latency_window)
+            self._latencies = deque(maxlen=self.latency_window)
+            self._metrics_start = time.perf_counter()
+
+    def metrics(self) -> dict:
+        """
+        Metrics since the start or the last reset_metrics.
+
+        Returns:
+            dict: queue_depth (calls waiting), batches, rows, batch_sizes (rows of a
+            batch -> number of batches), mean_batch_size, latency_p50_ms and
+            latency_p99_ms (from submit to the predictions), wait_p50_ms (time
+            in the queue), rows_per_second (rows predicted per second since the start)
+            and model_rows_per_second (rows per second of model time).
+        """
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            waits = np.array(self._waits) * 1000
+            n_batches = sum(self._batch_sizes.values())
+            elapsed = time.perf_counter() - self._metrics_start
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": n_batches,
+                "rows": self._rows,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "mean_batch_size": self._rows / n_batches if n_batches else None,
+                "latency_p50_ms": (
+                    float(np.percentile(latencies, 50)) if len(latencies) else None
+                ),
+                "latency_p99_ms": (
+                    float(np.percentile(latencies, 99)) if len(latencies) else None
+                ),
+                "wait_p50_ms": float(np.percentile(waits, 50)) if len(waits) else None,
+                "rows_per_second": self._rows / elapsed if elapsed > 0 else None,
+                "model_rows_per_second": (
+                    self._rows / self._model_seconds
+                    if self._model_seconds > 0
+                    else None
+                ),
+            }
+
+    def close(self):
+        """Predicts the queued calls and stops the worker thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def __enter__(self) -> "PredictionBatcher":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,93 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import NamedTuple, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.model_selection import KFold
+
+from ..data.cache import hash_dataframe
+
+
+class Fold(NamedTuple):
+    """Preprocessed train and validation data of one cross-validation fold."""
+
+    X_train: Union[np.ndarray, sparse.spmatrix]
+    y_train: np.ndarray
+    X_valid: Union[np.ndarray, sparse.spmatrix]
+    y_valid: np.ndarray
+    feature_names: np.ndarray
+
+
+def precompute_folds(
+    preprocessor: ColumnTransformer,
+    X: pd.DataFrame,
+    y: Union[pd.Series, np.ndarray],
+    n_splits: int = 5,
+    random_state: int = 42,
+    cache_dir: Union[str, Path, None] = None,
+    mmap_mode: Union[str, None] = "r",
+) -> list[Fold]:
+    """
+    Fits a copy of preprocessor on the train part of each KFold split (shuffle=True)
+    and transforms the train and validation parts. When only the model changes
+    between fits (hyperparameter search, feature selection) the folds can be reused
+    instead of fitting the same preprocessing again.
+
+    If cache_dir is given the folds are saved there with joblib, keyed by a hash of
+    X, y, preprocessor, n_splits and random_state, and the next calls with the same
+    inputs load them from disk. The arrays (dense or the parts of the sparse
+    matrices) are loaded with mmap_mode, so worker processes share the same pages
+    instead of each one having a copy.
+
+    Args:
+        preprocessor (ColumnTransformer): preprocessor to fit on each fold.
+        X (pd.DataFrame): features.
+        y (Union[pd.Series, np.ndarray]): target.
+        n_splits (int, optional): number of folds. Defaults to 5.
+        random_state (int, optional): KFold random_state. Defaults to 42.
+        cache_dir (Union[str, Path, None], optional): directory to cache the folds. If
+        None the folds are only kept in memory. Defaults to None.
+        mmap_mode (Union[str, None], optional): joblib.load mmap_mode of the cached
+        folds. Defaults to "r".
+
+    Returns:
+        list[Fold]: the preprocessed data of each fold.
+    """
+    y = np.asarray(y)
+    if cache_dir is not None:
+        key = hashlib.sha256(
+            "".join(
+                [
+                    hash_dataframe(X),
+                    joblib.hash(y),
+                    joblib.hash(preprocessor),
+                    f"{n_splits}-{random_state}",
+                ]
+            ).encode()
+        ).hexdigest()
+        path = Path(cache_dir) / f"folds_{key}.joblib"
+        if path.exists():
+            return joblib.load(path, mmap_mode=mmap_mode)
+
+    folds = []
+    kf = KFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    for tr, ts in kf.split(X, y):
+        fold_preprocessor = clone(preprocessor)
+        X_train = fold_preprocessor.fit_transform(X.iloc[tr])
+        X_valid = fold_preprocessor.transform(X.iloc[ts])
+        feature_names = fold_preprocessor.get_feature_names_out()
+        folds.append(Fold(X_train, y[tr], X_valid, y[ts], feature_names))
+
+    if cache_dir is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        joblib.dump(folds, tmp_path)
+        os.replace(tmp_path, path)
+        return joblib.load(path, mmap_mode=mmap_mode)
+    return folds
@@ -0,0 +1,415 @@
+import copy
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Union
+
+import click
+import numpy as np
+import pandas as pd
+import shap
+from sklearn.pipeline import Pipeline
+
+from ..data.make_dataset import (
+    RAW_SCHEMA,
+    PipelinePlan,
+    list_funcs,
+    make_pipeline,
+    read_csv_with_schema,
+)
+from ..features.build_features import list_feature_funcs
+from .predict_model import make_predict
+from .score_server import TREE_MODELS, RecordEncoder
+from .train_model import load_model
+
+EXPLAIN_MODES = ("exact", "approximate", "interventional")
+
+# explainer of the worker processes of explain_by_batches (see _init_worker)
+_worker_explainer = None
+
+
+def feature_groups(preprocessor: Pipeline) -> tuple:
+    """
+    Maps the columns of the model input back to the features of the preprocessor:
+    the one-hot columns of a categoric feature (and the imputed column of a
+    numeric one) belong to the feature.
+
+    Args:
+        preprocessor (Pipeline): fitted steps before the model (pipeline[:-1]).
+        Must be supported by RecordEncoder.
+
+    Returns:
+        tuple: the feature names (np.ndarray) and the (model inputs, features)
+        indicator matrix that sums the SHAP values of the columns of each feature.
+    """
+    encoder = RecordEncoder.from_pipeline(preprocessor)
+    input_features = np.empty(encoder.n_inputs, dtype=object)
+    for j, col, _ in encoder.numeric:
+        input_features[j] = col
+    for col, index, nan_index, _ in encoder.onehot:
+        input_features[list(index.values())] = col
+        if nan_index is not None:
+            input_features[nan_index] = col
+    if encoder.selected is not None:
+        input_features = input_features[encoder.selected]
+    # the features in the order of the preprocessor
+    names = list(dict.fromkeys(input_features))
+    position = {name: i for i, name in enumerate(names)}
+    indicator = np.zeros((len(input_features), len(names)))
+    for j, name in enumerate(input_features):
+        indicator[j, position[name]] = 1.0
+    return np.array(names, dtype=object), indicator
+
+
+def make_explainer(
+    estimator,
+    mode: str = "exact",
+    background: Union[np.ndarray, None] = None,
+    max_trees: Union[int, None] = None,
+) -> tuple:
+    """
+    Creates the shap TreeExplainer of a fitted tree model.
+
+    - exact: TreeSHAP with the tree path dependent perturbation (the node counts
+      of the trees are the background).
+    - approximate: the Saabas values of the paths of each row (approximate=True of
+      shap_values), about 100x faster than exact.
+    - interventional: TreeSHAP against the background rows, the cost grows with
+      the number of background rows.
+
+    max_trees explains the first max_trees trees of a forest: they are bootstrap
+    samples, so the mean of a subset of the trees approximates the mean of all of
+    them.
+
+    Args:
+        estimator: fitted DecisionTreeClassifier, RandomForestClassifier or
+        ExtraTreesClassifier.
+        mode (str, optional): one of EXPLAIN_MODES. Defaults to "exact".
+        background (Union[np.ndarray, None], optional): model inputs of the
+        interventional mode. Defaults to None.
+        max_trees (Union[int, None], optional): number of trees explained. Defaults
+        to None (all of them).
+
+    Returns:
+        tuple: the explainer and whether shap_values must be approximate.
+    """
+    if not isinstance(estimator, TREE_MODELS):
+        raise ValueError(f"{type(estimator).__name__} is not a tree model")
+    if mode not in EXPLAIN_MODES:
+        raise ValueError(f"mode must be one of {', '.join(EXPLAIN_MODES)}, not {mode}")
+    if max_trees is not None and hasattr(estimator, "estimators_"):
+        estimator = copy.copy(estimator)
+        estimator.estimators_ = estimator.estimators_[:max_trees]
+        estimator.n_estimators = len(estimator.estimators_)
+    if mode == "interventional":
+        if background is None:
+            raise ValueError("the interventional mode needs background rows")
+        explainer = shap.TreeExplainer(
+            estimator, data=background, feature_perturbation="interventional"
+        )
+    else:
+        explainer = shap.TreeExplainer(
+            estimator, feature_perturbation="tree_path_dependent"
+        )
+    return explainer, mode == "approximate"
+
+
+def explain(
+    explainer: tuple, X: np.ndarray, indicator: np.ndarray, class_index: int = 1
+) -> np.ndarray:
+    """
+    SHAP values of the class_index probability for the rows of X (model inputs),
+    summed by feature (see feature_groups).
+
+    Args:
+        explainer (tuple): output of make_explainer.
+        X (np.ndarray): model inputs.
+        indicator (np.ndarray): indicator matrix of feature_groups.
+        class_index (int, optional): class explained. Defaults to 1 (churn).
+
+    Returns:
+        np.ndarray: SHAP values, shape (rows, features).
+    """
+    tree_explainer, approximate = explainer
+    values = tree_explainer.shap_values(
+        X, approximate=approximate, check_additivity=False
+    )
+    if isinstance(values, list):
+        values = values[class_index]
+    return values @ indicator
+
+
+def top_reasons(
+    values: np.ndarray, feature_names: np.ndarray, top_k: int = 3
+) -> pd.DataFrame:
+    """
+    The top_k features with the biggest SHAP values (the ones that raise the churn
+    probability the most) of each row.
+
+    Returns:
+        pd.DataFrame: columns reason_1, reason_1_shap, ..., reason_k, reason_k_shap.
+    """
+    top_k = min(top_k, values.shape[1])
+    top = np.argpartition(-values, top_k - 1, axis=1)[:, :top_k]
+    top_values = np.take_along_axis(values, top, axis=1)
+    order = np.argsort(-top_values, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_values = np.take_along_axis(top_values, order, axis=1)
+    reasons = {}
+    for r in range(top_k):
+        reasons[f"reason_{r + 1}"] = feature_names[top[:, r]]
+        reasons[f"reason_{r + 1}_shap"] = top_values[:, r]
+    return pd.DataFrame(reasons)
+
+
+def _init_worker(estimator, mode, background, max_trees):
+    global _worker_explainer
+    _worker_explainer = make_explainer(estimator, mode, background, max_trees)
+
+
+def _explain_worker(X: np.ndarray, indicator: np.ndarray, class_index: int):
+    return explain(_worker_explainer, X, indicator, class_index)
+
+
+def _to_dense(X) -> np.ndarray:
+    return np.asarray(X.toarray() if hasattr(X, "toarray") else X, dtype=np.float64)
+
+
+def _scored_batches(
+    pipeline: Pipeline,
+    input_file: Union[str, Path],
+    features: list,
+    threshold: float,
+    only_churn: bool,
+    batch_size: int,
+    id_col: str,
+):
+    """Reads input_file in batches and yields the ids, probabilities, classes and
+    model inputs of the customers to explain, the model inputs of all the
+    customers of the batch and the number of rows read."""
+    plan = PipelinePlan(list_funcs + list_feature_funcs)
+    with read_csv_with_schema(input_file, RAW_SCHEMA, chunksize=batch_size) as reader:
+        for batch in reader:
+            X = make_pipeline(dataframe=batch, functions=plan)[features]
+            X_model = _to_dense(pipeline[:-1].transform(X))
+            y_pred_proba, y_pred_cls = make_predict(
+                model=pipeline[-1],
+                X_test=X_model,
+                threshold=threshold,
+                return_classes=True,
+            )
+            rows = np.flatnonzero(y_pred_cls == 1) if only_churn else slice(None)
+            yield (
+                batch[id_col].to_numpy()[rows],
+                y_pred_proba[rows],
+                y_pred_cls[rows],
+                X_model[rows],
+                X_model,
+                len(batch),
+            )
+
+
+def explain_by_batches(
+    pipeline: Pipeline,
+    input_file: Union[str, Path],
+    output_file: Union[str, Path],
+    features: list,
+    threshold: float = 0.5,
+    top_k: int = 3,
+    only_churn: bool = False,
+    mode: str = "exact",
+    background_size: int = 100,
+    max_trees: Union[int, None] = None,
+    batch_size: int = 10000,
+    n_jobs: Union[int, None] = None,
+    id_col: str = "ID",
+    seed: int = 0,
+) -> dict:
+    """
+    Explains the churn probabilities of a raw ERP export (same format of data/raw)
+    with SHAP, in batches like predict_by_batches. Each batch goes through the data
+    cleaning and feature pipelines, the preprocessor and make_predict, and is
+    split among n_jobs processes that compute the SHAP values (each process
+    creates the explainer once). The values of the one-hot columns are summed by
+    ERP feature and the top_k reasons of each customer are appended to
+    output_file, so memory depends on batch_size and not on the size of input_file.
+
+    Example:
+
+    >>>
+    explain_by_batches(
+        pipeline=rf_model,
+        input_file="data/raw/customer_churn_data - customer_churn_data.csv",
+        output_file="data/processed/churn_reasons.csv",
+        features=NUM_FEATURES_RF + CAT_FEATURES_RF,
+        threshold=BEST_TH_RF,
+        only_churn=True,
+    )
+
+    Args:
+        pipeline (Pipeline): fitted model pipeline with a tree model.
+        input_file (Union[str, Path]): csv file with the customers to explain.
+        output_file (Union[str, Path]): csv file with the columns id_col,
+        churn_proba, churn_pred and the reasons of top_reasons.
+        features (list): features used by the model, in the order used to fit it.
+        threshold (float, optional): Threshold to make the decision to churn. Defaults to 0.5.
+        top_k (int, optional): reasons written per customer. Defaults to 3.
+        only_churn (bool, optional): explain only the customers predicted as churn
+        (the at-risk list). Defaults to False.
+        mode (str, optional): "exact", "approximate" or "interventional" (see
+        make_explainer). Defaults to "exact".
+        background_size (int, optional): rows sampled as the background of the
+        interventional mode, from all the customers of the first batch with
+        customers to explain (also with only_churn). Defaults to 100.
+        max_trees (Union[int, None], optional): number of trees explained (see
+        make_explainer). Defaults to None (all of them).
+        batch_size (int, optional): rows read at a time. Defaults to 10000.
+        n_jobs (Union[int, None], optional): number of processes. If None uses
+        os.cpu_count(). Defaults to None.
+        id_col (str, optional): customer id column of input_file. Defaults to "ID".
+        seed (int, optional): seed of the background sample. Defaults to 0.
+
+    Returns:
+        dict: number of rows read, rows explained, elapsed seconds and throughput
+        in rows explained per second.
+    """
+    logger = logging.getLogger(__name__)
+    n_jobs = n_jobs or os.cpu_count()
+    preprocessor, estimator = pipeline[:-1], pipeline[-1]
+    feature_names, indicator = feature_groups(preprocessor)
+    class_index = int(np.flatnonzero(estimator.classes_ == 1)[0])
+    explainer, executor = None, None
+    n_rows, n_explained = 0, 0
+    start = time.perf_counter()
+    try:
+        for i, (ids, y_pred_proba, y_pred_cls, X_model, X_batch, n_read) in enumerate(
+            _scored_batches(
+                pipeline,
+                input_file,
+                features,
+                threshold,
+                only_churn,
+                batch_size,
+                id_col,
+            )
+        ):
+            n_rows += n_read
+            if explainer is None and executor is None and len(X_model) > 0:
+                background = None
+                if mode == "interventional":
+                    # sampled from all the customers (not only the predicted
+                    # churners), so the reasons are relative to an average customer
+                    rng = np.random.default_rng(seed)
+                    size = min(background_size, len(X_batch))
+                    background = X_batch[rng.choice(len(X_batch), size, replace=False)]
+                if n_jobs == 1:
+                    explainer = make_explainer(estimator, mode, background, max_trees)
+                else:
+                    executor = ProcessPoolExecutor(
+                        max_workers=n_jobs,
+                        initializer=_init_worker,
+                        initargs=(estimator, mode, background, max_trees),
+                    )
+            if len(X_model) == 0:
+                values = np.zeros((0, len(feature_names)))
+            elif executor is None:
+                values = explain(explainer, X_model, indicator, class_index)
+            else:
+                chunks = np.array_split(X_model, min(len(X_model), n_jobs * 4))
+                values = np.concatenate(
+                    list(
+                        executor.map(
+                            _explain_worker,
+                            chunks,
+                            [indicator] * len(chunks),
+                            [class_index] * len(chunks),
+                        )
+                    )
+                )
+            reasons = pd.DataFrame(
+                {id_col: ids, "churn_proba": y_pred_proba, "churn_pred": y_pred_cls}
+            )
+            reasons = pd.concat(
+                [reasons, top_reasons(values, feature_names, top_k)], axis=1
+            )
+            reasons.to_csv(
+                output_file, mode="w" if i == 0 else "a", header=i == 0, index=False
+            )
+            n_explained += len(X_model)
+            logger.debug(f"batch {i}: {n_rows} rows read, {n_explained} explained")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": n_rows,
+        "explained": n_explained,
+        "seconds": elapsed,
+        "rows_per_second": n_explained / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+@click.command()
+@click.argument("model_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("input_filepath", type=click.Path(exists=True))
+@click.argument("output_filepath", type=click.Path())
+@click.option("--top-k", type=click.IntRange(min=1), default=3, show_default=True)
+@click.option(
+    "--only-churn", is_flag=True, help="Explain only the customers predicted as churn."
+)
+@click.option(
+    "--mode", type=click.Choice(EXPLAIN_MODES), default="exact", show_default=True
+)
+@click.option(
+    "--background-size", type=click.IntRange(min=1), default=100, show_default=True
+)
+@click.option("--max-trees", type=click.IntRange(min=1), default=None)
+@click.option("--batch-size", type=click.IntRange(min=1), default=10000)
+@click.option("--n-jobs", type=click.IntRange(min=1), default=None)
+def main(
+    model_dir,
+    input_filepath,
+    output_filepath,
+    top_k,
+    only_churn,
+    mode,
+    background_size,
+    max_trees,
+    batch_size,
+    n_jobs,
+):
+    """Writes the top SHAP reasons of the churn probability of each customer of a
+    raw ERP export (INPUT_FILEPATH) to OUTPUT_FILEPATH, with a model artifact of
+    train_model (MODEL_DIR) and the features and threshold of its manifest.
+    """
+    logger = logging.getLogger(__name__)
+    pipeline, manifest = load_model(model_dir, compiled=False)
+    logger.info(f"explaining {input_filepath} with {manifest['model_name']} ({mode})")
+    stats = explain_by_batches(
+        pipeline=pipeline,
+        input_file=input_filepath,
+        output_file=output_filepath,
+        features=manifest["features"]["NUM_FEATURES"]
+        + manifest["features"]["CAT_FEATURES"],
+        threshold=manifest["decision_threshold"],
+        top_k=top_k,
+        only_churn=only_churn,
+        mode=mode,
+        background_size=background_size,
+        max_trees=max_trees,
+        batch_size=batch_size,
+        n_jobs=n_jobs,
+    )
+    logger.info(
+        f"{stats['explained']} of {stats['rows']} rows explained in "
+        f"{stats['seconds']:.1f} s ({stats['rows_per_second']:.0f} rows/s)"
+    )
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,241 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.pipeline import Pipeline
+
+try:
+    from numba import njit, prange
+except ImportError:  # the numpy traversal is used without numba
+    njit = None
+    prange = range
+
+BLOCK_SIZE = 256
+
+
+class CompiledForest:
+    """
+    Fitted tree ensemble (RandomForestClassifier, ExtraTreesClassifier or a
+    single DecisionTreeClassifier) flattened into contiguous node arrays, so
+    predict_proba traverses all trees for a batch in one compiled (numba) or
+    vectorized (numpy) loop instead of dispatching each sklearn tree.
+
+    The nodes of all trees are concatenated and the children indexes point to
+    the concatenated arrays. Leaves have children_left == -1 and value holds
+    the class probabilities of each node (the normalized tree_.value). The
+    input is converted to float32 before the traversal, like sklearn does, so
+    predict_proba gives the same probabilities of the sklearn model.
+
+    Example:
+
+    >>>
+    compiled_model = CompiledForest.from_pipeline(rf_pipeline)
+    y_pred_proba = make_predict(model=compiled_model, X_test=X_test)
+
+    Args:
+        feature (np.ndarray): feature index compared in each node.
+        threshold (np.ndarray): threshold of each node (go left if value <= threshold).
+        children_left (np.ndarray): left child of each node, -1 for leaves.
+        children_right (np.ndarray): right child of each node, -1 for leaves.
+        value (np.ndarray): class probabilities of each node, shape (n_nodes, n_classes).
+        roots (np.ndarray): root node of each tree.
+        classes (np.ndarray): classes of the model (classes_).
+        preprocessor (Union[Pipeline, None], optional): steps applied on X before the
+        traversal, for example the steps before the model in a Pipeline. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        children_left: np.ndarray,
+        children_right: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        classes: np.ndarray,
+        preprocessor: Union[Pipeline, None] = None,
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.preprocessor = preprocessor
+
+    @classmethod
+    def from_estimator(cls, estimator, preprocessor=None) -> "CompiledForest":
+        """
+        Flattens a fitted tree ensemble or decision tree.
+
+        Args:
+            estimator: fitted RandomForestClassifier, ExtraTreesClassifier or
+            DecisionTreeClassifier.
+            preprocessor (Union[Pipeline, None], optional): steps applied on X before
+            the traversal. Defaults to None.
+
+        Returns:
+            CompiledForest: the flattened model.
+        """
+        trees = [e.tree_ for e in getattr(estimator, "estimators_", [estimator])]
+        n_classes = len(estimator.classes_)
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        children_left, children_right, values = [], [], []
+        for tree, offset in zip(trees, offsets):
+            is_leaf = tree.children_left == -1
+            children_left.append(np.where(is_leaf, -1, tree.children_left + offset))
+            children_right.append(np.where(is_leaf, -1, tree.children_right + offset))
+            # same normalization of DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :n_classes]
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value / normalizer)
+        return cls(
+            feature=np.ascontiguousarray(
+                np.concatenate([tree.feature for tree in trees]), dtype=np.int64
+            ),
+            threshold=np.ascontiguousarray(
+                np.concatenate([tree.threshold for tree in trees]), dtype=np.float64
+            ),
+            children_left=np.ascontiguousarray(
+                np.concatenate(children_left), dtype=np.int64
+            ),
+            children_right=np.ascontiguousarray(
+                np.concatenate(children_right), dtype=np.int64
+            ),
+            value=np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+            roots=offsets[:-1].astype(np.int64),
+            classes=estimator.classes_,
+            preprocessor=preprocessor,
+        )
+
+    @classmethod
+    def from_pipeline(cls, pipeline: Pipeline) -> "CompiledForest":
+        """
+        Flattens the model (last step) of a fitted pipeline. The other steps are
+        kept as the preprocessor.
+
+        Args:
+            pipeline (Pipeline): fitted pipeline with a tree model as last step.
+
+        Returns:
+            CompiledForest: the flattened model.
+        """
+        return cls.from_estimator(pipeline[-1], preprocessor=pipeline[:-1])
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def predict_proba(
+        self, X: Union[pd.DataFrame, np.ndarray], engine: str = "auto"
+    ) -> np.ndarray:
+        """
+        Predicts the class probabilities of X, the mean of the probabilities of
+        each tree. The numba kernels (serial or parallel) must not be called from
+        worker threads: after a call from a thread other than the main one the
+        process can hang at exit. Call it from the main thread (PredictionBatcher
+        predicts the predict_async batches on the event loop thread) or use
+        engine="numpy" in threads.
+
+        Args:
+            X (Union[pd.DataFrame, np.ndarray]): input of the preprocessor, or of
+            the model if there is no preprocessor.
+            engine (str, optional): "numba", "numpy" or "auto" (numba if installed).
+            Defaults to "auto".
+
+        Returns:
+            np.ndarray: probabilities, shape (n_samples, n_classes).
+        """
+        if self.preprocessor is not None:
+            X = self.preprocessor.transform(X)
+        if sparse.issparse(X):
+            X = X.toarray()
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if engine == "auto":
+            engine = "numba" if njit is not None else "numpy"
+        if engine == "numba":
+            if njit is None:
+                raise ImportError("numba is required for the numba engine")
+            traverse = (
+                _traverse_numba if X.shape[0] > BLOCK_SIZE else _traverse_numba_serial
+            )
+            proba = traverse(
+                X,
+                self.feature,
+                self.threshold,
+                self.children_left,
+                self.children_right,
+                self.value,
+                self.roots,
+            )
+        elif engine == "numpy":
+            proba = self._traverse_numpy(X)
+        else:
+            raise ValueError(f"engine must be auto, numba or numpy, not {engine}")
+        return proba / self.n_trees
+
+    def predict(self, X: Union[pd.DataFrame, np.ndarray], **kwargs) -> np.ndarray:
+        """Predicts the class with the biggest probability for each sample of X."""
+        return self.classes_[np.argmax(self.predict_proba(X, **kwargs), axis=1)]
+
+    def _traverse_numpy(self, X: np.ndarray, batch_size: int = 4096) -> np.ndarray:
+        """
+        Moves all (sample, tree) pairs of a batch one level down at each
+        iteration until all of them reach a leaf. The sum over the trees is made
+        in tree order, as sklearn does.
+        """
+        proba = np.zeros((X.shape[0], self.value.shape[1]), dtype=np.float64)
+        for start in range(0, X.shape[0], batch_size):
+            X_batch = X[start : start + batch_size]
+            rows = np.arange(X_batch.shape[0])[:, np.newaxis]
+            nodes = np.broadcast_to(self.roots, (X_batch.shape[0], self.n_trees))
+            nodes = nodes.copy()
+            while True:
+                left = self.children_left[nodes]
+                is_split = left != -1
+                if not is_split.any():
+                    break
+                go_left = X_batch[rows, self.feature[nodes]] <= self.threshold[nodes]
+                nodes = np.where(
+                    is_split,
+                    np.where(go_left, left, self.children_right[nodes]),
+                    nodes,
+                )
+            leaf_values = self.value[nodes]
+            for t in range(self.n_trees):
+                proba[start : start + batch_size] += leaf_values[:, t]
+        return proba
+
+
+def _traverse(X, feature, threshold, children_left, children_right, value, roots):
+    """
+    Sum of the leaf values reached by each row of X in each tree. Rows are
+    processed in blocks and each tree is traversed for the whole block before the
+    next one, so the nodes of a tree stay in cache.
+    """
+    n_samples, n_classes = X.shape[0], value.shape[1]
+    proba = np.zeros((n_samples, n_classes), dtype=np.float64)
+    n_blocks = (n_samples + BLOCK_SIZE - 1) // BLOCK_SIZE
+    for b in prange(n_blocks):
+        start = b * BLOCK_SIZE
+        stop = min(start + BLOCK_SIZE, n_samples)
+        for t in range(roots.shape[0]):
+            for i in range(start, stop):
+                node = roots[t]
+                while children_left[node] != -1:
+                    if X[i, feature[node]] <= threshold[node]:
+                        node = children_left[node]
+                    else:
+                        node = children_right[node]
+                for c in range(n_classes):
+                    proba[i, c] += value[node, c]
+    return proba
+
+
+if njit is not None:
+    _traverse_numba = njit(parallel=True, cache=True, nogil=True)(_traverse)
+    # batches of one block have nothing to run in parallel
+    _traverse_numba_serial = njit(cache=True, nogil=True)(_traverse)
@@ -1,21 +1,40 @@
-from typing import Union
+import logging
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Union
 
+import click
+import joblib
 import numpy as np
 import pandas as pd
-from sklearn.pipeline import Pipeline
+import yaml
+
+from ..data.make_dataset import (
+    RAW_SCHEMA,
+    PipelinePlan,
+    list_funcs,
+    make_pipeline,
+    read_csv_with_schema,
+)
+from ..features.build_features import list_feature_funcs
+
+if TYPE_CHECKING:  # sklearn is imported when a model is loaded, not with this module
+    from sklearn.pipeline import Pipeline
 
 
 def make_predict(
-    model: Pipeline,
+    model: "Pipeline",
     X_test: Union[pd.DataFrame, np.array],
     threshold: float = 0.5,
     use_predict_proba: Union[True, False] = True,
     return_classes: Union[False, True] = False,
+    dtype: Union[str, np.dtype] = "float64",
 ):
     """
     Predict values for model in X_test. Calculates the predict_proba
-    and predict_class. If a different value of threshold is set than
-    predict_classes will be from predict_proba (predict_proba > threshold).
+    and the predict_classes from it (predict_proba > threshold), so the
+    model runs only once. With the default threshold (0.5) the classes are
+    the same of model.predict.
 
     Args:
         model (Pipeline): The model pipepline fited to make predict.
@@ -23,6 +42,9 @@ def make_predict(
         threshold (float, optional): Threshold to make the decision to churn . Defaults to 0.5.
         use_predict_proba (Union[True, False], optional): Return the predicted probabilities . Defaults to True.
         return_classes (Union[False, True], optional): Return the predicted classes. Defaults to False.
+        dtype (Union[str, np.dtype], optional): dtype of the returned probabilities. Use
+        "float32" to halve the memory of the output of large batches, the classes are
+        computed before the conversion. Defaults to "float64".
 
     Returns:
         y_pred_proba,y_pred: predicted values, can return the predict_proba and
@@ -30,11 +52,8 @@ def make_predict(
     """
 
     y_pred_proba = model.predict_proba(X_test)[:, 1]
-
-    if threshold == 0.5:
-        y_pred_cls = model.predict(X_test)
-    else:
-        y_pred_cls = np.where(y_pred_proba > threshold, 1, 0)
+    y_pred_cls = np.where(y_pred_proba > threshold, 1, 0)
+    y_pred_proba = y_pred_proba.astype(dtype, copy=False)
 
     if use_predict_proba and return_classes:
         return y_pred_proba, y_pred_cls
@@ -43,3 +62,169 @@ def make_predict(
         return y_pred_cls
     else:
         return y_pred_proba
+
+
+def load_model_config(config_path: Union[str, Path]) -> dict:
+    """
+    Loads a model config yaml (config/*_config.yaml). The feature names are saved
+    as ISO-8859-1 bytes in the yaml and are decoded to str.
+
+    Args:
+        config_path (Union[str, Path]): path of the config yaml.
+
+    Returns:
+        dict: the model config with model_features as lists of str.
+    """
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    config["model_features"] = {
+        name: [col.decode(encoding="ISO-8859-1") for col in cols]
+        for name, cols in config["model_features"].items()
+    }
+    return config
+
+
+def predict_by_batches(
+    model: "Pipeline",
+    input_file: Union[str, Path],
+    output_file: Union[str, Path],
+    features: list,
+    threshold: float = 0.5,
+    batch_size: int = 10000,
+    id_col: str = "ID",
+    proba_dtype: Union[str, np.dtype] = "float64",
+) -> dict:
+    """
+    Scores a raw ERP export (same format of data/raw) in batches of batch_size
+    rows. Each batch goes through the data cleaning (make_dataset list_funcs) and
+    feature (build_features list_feature_funcs) pipelines and make_predict, and
+    the predictions are appended to output_file, so memory depends on batch_size
+    and not on the size of input_file.
+
+    Args:
+        model (Pipeline): The model pipeline fitted to make predict.
+        input_file (Union[str, Path]): csv file with the customers to score.
+        output_file (Union[str, Path]): csv file to write the predictions. It has the
+        columns id_col, churn_proba and churn_pred.
+        features (list): features used by the model, in the order used to fit it.
+        threshold (float, optional): Threshold to make the decision to churn. Defaults to 0.5.
+        batch_size (int, optional): number of rows scored at a time. Defaults to 10000.
+        id_col (str, optional): customer id column of input_file. Defaults to "ID".
+        proba_dtype (Union[str, np.dtype], optional): dtype of the predicted
+        probabilities (see make_predict dtype). Defaults to "float64".
+
+    Returns:
+        dict: number of rows scored, elapsed seconds and throughput in rows/s.
+    """
+    logger = logging.getLogger(__name__)
+    plan = PipelinePlan(list_funcs + list_feature_funcs)
+    n_rows = 0
+    start = time.perf_counter()
+    with read_csv_with_schema(input_file, RAW_SCHEMA, chunksize=batch_size) as reader:
+        for i, batch in enumerate(reader):
+            X = make_pipeline(dataframe=batch, functions=plan)[features]
+            y_pred_proba, y_pred_cls = make_predict(
+                model=model,
+                X_test=X,
+                threshold=threshold,
+                return_classes=True,
+                dtype=proba_dtype,
+            )
+            predictions = pd.DataFrame(
+                {
+                    id_col: batch[id_col].to_numpy(),
+                    "churn_proba": y_pred_proba,
+                    "churn_pred": y_pred_cls,
+                }
+            )
+            predictions.to_csv(
+                output_file, mode="w" if i == 0 else "a", header=i == 0, index=False
+            )
+            n_rows += len(batch)
+            logger.debug(f"batch {i}: {n_rows} rows scored")
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": n_rows,
+        "seconds": elapsed,
+        "rows_per_second": n_rows / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+@click.command()
+@click.argument("model_filepath", type=click.Path(exists=True))
+@click.argument("input_filepath", type=click.Path(exists=True))
+@click.argument("output_filepath", type=click.Path())
+@click.option(
+    "--config",
+    "config_filepath",
+    type=click.Path(exists=True),
+    default="config/random_forest_clf_for_churn_config.yaml",
+    show_default=True,
+    help="Model config with the features and the decision_threshold "
+    "(of a MODEL_FILEPATH saved with joblib).",
+)
+@click.option("--batch-size", type=click.IntRange(min=1), default=10000)
+@click.option(
+    "--proba-dtype",
+    type=click.Choice(["float64", "float32"]),
+    default="float64",
+    help="float32 writes smaller probabilities for large customer bases.",
+)
+def main(
+    model_filepath,
+    input_filepath,
+    output_filepath,
+    config_filepath,
+    batch_size,
+    proba_dtype,
+):
+    """Scores the customers of a raw ERP export (INPUT_FILEPATH) with a fitted
+    model (MODEL_FILEPATH, a model artifact directory of train_model or a
+    pipeline saved with joblib) and writes the churn probabilities and classes
+    to OUTPUT_FILEPATH. The features and the threshold of an artifact are the
+    ones of its manifest, otherwise the ones of --config.
+    """
+    logger = logging.getLogger(__name__)
+    if Path(model_filepath).is_dir():
+        from .train_model import load_model
+
+        model, manifest = load_model(model_filepath)
+        features = (
+            manifest["features"]["NUM_FEATURES"] + manifest["features"]["CAT_FEATURES"]
+        )
+        threshold = manifest["decision_threshold"]
+        model_name = f"{manifest['model_name']} v{manifest['model_version']}"
+    else:
+        config = load_model_config(config_filepath)
+        features = (
+            config["model_features"]["NUM_FEATURES"]
+            + config["model_features"]["CAT_FEATURES"]
+        )
+        threshold = (
+            config["model_parameters"]
+            .get("predict_params", {})
+            .get("decision_threshold", 0.5)
+        )
+        model = joblib.load(model_filepath)
+        model_name = config["model_name"]
+    logger.info(f"scoring {input_filepath} with {model_name}")
+    stats = predict_by_batches(
+        model=model,
+        input_file=input_filepath,
+        output_file=output_filepath,
+        features=features,
+        threshold=threshold,
+        batch_size=batch_size,
+        proba_dtype=proba_dtype,
+    )
+    logger.info(
+        f"{stats['rows']} rows scored in {stats['seconds']:.2f} s "
+        f"({stats['rows_per_second']:.0f} rows/s)"
+    )
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
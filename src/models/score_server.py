@@ -0,0 +1,549 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import deque
+from pathlib import Path
+from typing import Union
+
+import click
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.tree import DecisionTreeClassifier
+
+from ..data.make_dataset import list_funcs
+from ..features.build_features import list_feature_funcs
+from ..features.record_features import (
+    _is_null,
+    compile_record_pipeline,
+    make_record_pipeline,
+)
+from .batching import PredictionBatcher
+from .forest_inference import CompiledForest
+from .predict_model import load_model_config, make_predict
+from .train_model import load_model
+
+# models scored with CompiledForest by ScoringService
+TREE_MODELS = (DecisionTreeClassifier, RandomForestClassifier, ExtraTreesClassifier)
+
+
+class RecordEncoder:
+    """
+    Array version of a fitted preprocessor (the steps before the model in the
+    pipelines of notebook 05): the SimpleImputer, OneHotEncoder and passthrough
+    transformers of a ColumnTransformer, followed by column selections
+    (ColumnTransformer with only passthrough transformers, like select_cols).
+    Encodes records (dicts from feature name to value) straight into the model
+    input, without building a DataFrame and without the ColumnTransformer
+    dispatch. The output has the same values of preprocessor.transform.
+
+    Args:
+        n_inputs (int): number of columns of the ColumnTransformer output.
+        numeric (list): (output column, feature, missing value fill) of the imputed
+        and passthrough columns. fill is None for passthrough columns.
+        onehot (list): (feature, {category: output column}, output column of NaN or
+        None, raise on unknown categories) of the one-hot encoded columns.
+        selected (Union[np.ndarray, None], optional): columns of the ColumnTransformer
+        output given to the model. Defaults to None (all of them).
+    """
+
+    def __init__(
+        self,
+        n_inputs: int,
+        numeric: list,
+        onehot: list,
+        selected: Union[np.ndarray, None] = None,
+    ):
+        self.n_inputs = n_inputs
+        self.numeric = numeric
+        self.onehot = onehot
+        self.selected = selected
+
+    @classmethod
+    def from_pipeline(cls, preprocessor: Pipeline) -> "RecordEncoder":
+        """
+        Creates the encoder of a fitted preprocessor. Raises ValueError if some step
+        or transformer isn't supported.
+
+        Args:
+            preprocessor (Pipeline): fitted steps before the model, for example
+            pipeline[:-1].
+
+        Returns:
+            RecordEncoder: the encoder.
+        """
+        steps = [step for _, step in preprocessor.steps]
+        if not steps or not isinstance(steps[0], ColumnTransformer):
+            raise ValueError("the first step must be a ColumnTransformer")
+        column_transformer = steps[0]
+        numeric, onehot, n_inputs = [], [], 0
+        for name, transformer, cols in column_transformer.transformers_:
+            cols = cls._column_names(column_transformer, cols)
+            if transformer == "drop" or len(cols) == 0:
+                continue
+            if transformer == "passthrough":
+                numeric += [(n_inputs + j, col, None) for j, col in enumerate(cols)]
+                n_inputs += len(cols)
+            elif isinstance(transformer, SimpleImputer):
+                if transformer.add_indicator or not _is_null(
+                    transformer.missing_values
+                ):
+                    raise ValueError(f"SimpleImputer {name} is not supported")
+                kept = [
+                    (col, fill)
+                    for col, fill in zip(cols, transformer.statistics_)
+                    if not np.isnan(fill) or transformer.keep_empty_features
+                ]
+                numeric += [
+                    (n_inputs + j, col, fill) for j, (col, fill) in enumerate(kept)
+                ]
+                n_inputs += len(kept)
+            elif isinstance(transformer, OneHotEncoder):
+                if transformer.drop_idx_ is not None or getattr(
+                    transformer, "_infrequent_enabled", False
+                ):
+                    raise ValueError(f"OneHotEncoder {name} is not supported")
+                for col, categories in zip(cols, transformer.categories_):
+                    index, nan_index = {}, None
+                    for j, category in enumerate(categories):
+                        if _is_null(category):
+                            nan_index = n_inputs + j
+                        else:
+                            index[category] = n_inputs + j
+                    raise_unknown = transformer.handle_unknown == "error"
+                    onehot.append((col, index, nan_index, raise_unknown))
+                    n_inputs += len(categories)
+            else:
+                raise ValueError(f"{type(transformer).__name__} is not supported")
+        selected = np.arange(n_inputs)
+        for step in steps[1:]:
+            selected = selected[cls._selection(step, len(selected))]
+        return cls(
+            n_inputs=n_inputs,
+            numeric=numeric,
+            onehot=onehot,
+            selected=None if len(selected) == n_inputs else selected,
+        )
+
+    @staticmethod
+    def _column_names(column_transformer: ColumnTransformer, cols) -> list:
+        """Names of the input columns of a transformer (cols can be names or indexes)."""
+        if isinstance(cols, str):
+            return [cols]
+        cols = np.asarray(cols)
+        if cols.dtype == bool or np.issubdtype(cols.dtype, np.integer):
+            return list(column_transformer.feature_names_in_[cols])
+        return list(cols)
+
+    @staticmethod
+    def _selection(step, n_columns: int) -> np.ndarray:
+        """Indexes of the columns kept by a ColumnTransformer of passthrough transformers."""
+        if not isinstance(step, ColumnTransformer):
+            raise ValueError(f"{type(step).__name__} is not supported")
+        indexes = []
+        for name, transformer, cols in step.transformers_:
+            if transformer == "drop":
+                continue
+            if transformer != "passthrough":
+                raise ValueError(f"transformer {name} is not supported")
+            cols = np.asarray(cols)
+            if cols.dtype == bool:
+                cols = np.flatnonzero(cols)
+            indexes.append(np.arange(n_columns)[cols])
+        return np.concatenate(indexes) if indexes else np.array([], dtype=int)
+
+    def encode(self, records: list[dict]) -> np.ndarray:
+        """
+        Encodes records into the model input.
+
+        Args:
+            records (list[dict]): records with the features used by the preprocessor.
+
+        Returns:
+            np.ndarray: model input, shape (len(records), number of model features).
+        """
+        X = np.zeros((len(records), self.n_inputs), dtype=np.float64)
+        for i, record in enumerate(records):
+            row = X[i]
+            for j, col, fill in self.numeric:
+                value = record[col]
+                if _is_null(value):
+                    row[j] = np.nan if fill is None else fill
+                else:
+                    row[j] = value
+            for col, index, nan_index, raise_unknown in self.onehot:
+                value = record[col]
+                j = nan_index if _is_null(value) else index.get(value)
+                if j is not None:
+                    row[j] = 1.0
+                elif raise_unknown:
+                    raise ValueError(f"unknown category {value!r} in {col}")
+        return X if self.selected is None else X[:, self.selected]
+
+
+class ScoringService:
+    """
+    Scores single customers with a fitted model pipeline. A raw customer record
+    (the columns of data/raw, like a row of the ERP export) goes through the record
+    versions of the data cleaning and feature functions (see
+    src.features.record_features), is encoded with RecordEncoder and scored with
+    CompiledForest when the model is a tree ensemble. Pipelines that RecordEncoder
+    doesn't support are scored with the pipeline on a DataFrame.
+
+    Concurrent calls of score are micro-batched with a PredictionBatcher: a
+    record waits at most max_wait_ms for other records and up to max_batch_size
+    records are scored with one make_predict call. The latency of each call
+    (featurization included) is kept to report p50 and p99 (see stats).
+
+    Example:
+
+    >>>
+    service = ScoringService(pipeline=model, features=features, threshold=0.53)
+    result = await service.score(raw_record)
+
+    Args:
+        pipeline (Union[Pipeline, CompiledForest]): fitted model pipeline, or the
+        CompiledForest (with preprocessor) of a model artifact (see load_model).
+        features (list): features used by the pipeline, in the order used to fit it.
+        threshold (float, optional): Threshold to make the decision to churn. Defaults to 0.5.
+        functions (Union[list, None], optional): make_pipeline functions from the raw
+        record to the features. Defaults to None (list_funcs + list_feature_funcs).
+        max_batch_size (int, optional): max records scored at a time. Defaults to 64.
+        max_wait_ms (float, optional): max time a record waits for a batch. Defaults to 1.0.
+        latency_window (int, optional): number of latest calls kept for the latency
+        percentiles. Defaults to 10000.
+        id_col (str, optional): customer id column, returned with the scores. Defaults to "ID".
+    """
+
+    def __init__(
+        self,
+        pipeline: Union[Pipeline, CompiledForest],
+        features: list,
+        threshold: float = 0.5,
+        functions: Union[list, None] = None,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 1.0,
+        latency_window: int = 10000,
+        id_col: str = "ID",
+    ):
+        logger = logging.getLogger(__name__)
+        self.pipeline = pipeline
+        self.features = features
+        self.threshold = threshold
+        self.id_col = id_col
+        self.steps = compile_record_pipeline(
+            list_funcs + list_feature_funcs if functions is None else functions
+        )
+        if isinstance(pipeline, CompiledForest):
+            preprocessor, estimator = pipeline.preprocessor, pipeline
+        else:
+            preprocessor, estimator = pipeline[:-1], pipeline[-1]
+        try:
+            self.encoder = RecordEncoder.from_pipeline(preprocessor)
+        except ValueError as e:
+            logger.warning(f"using the DataFrame path, preprocessor not supported: {e}")
+            self.encoder = None
+        if self.encoder is None:
+            self.model = pipeline
+        elif isinstance(estimator, CompiledForest):
+            # shares the (memory mapped) node arrays of the loaded artifact
+            self.model = copy.copy(estimator)
+            self.model.preprocessor = None
+        elif isinstance(estimator, TREE_MODELS):
+            self.model = CompiledForest.from_estimator(estimator)
+        else:
+            self.model = estimator
+        self.batcher = PredictionBatcher(
+            model=self.model,
+            threshold=threshold,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            latency_window=latency_window,
+        )
+        self.latencies = deque(maxlen=latency_window)
+        self.n_requests = 0
+
+    def featurize(self, record: dict) -> dict:
+        """Features of a raw customer record."""
+        return make_record_pipeline(record, self.steps)
+
+    def prepare(self, record: dict) -> Union[np.ndarray, pd.DataFrame]:
+        """Model input of a raw customer record: an encoded row, or a one row
+        DataFrame of the features if there is no encoder."""
+        features = self.featurize(record)
+        if self.encoder is None:
+            return pd.DataFrame.from_records([features], columns=self.features)
+        return self.encoder.encode([features])[0]
+
+    def predict(self, rows: list) -> tuple:
+        """Probabilities and classes of rows given by prepare, without batching."""
+        if self.encoder is not None:
+            X = np.vstack(rows)
+        else:
+            X = pd.concat(rows, ignore_index=True)
+        return make_predict(
+            model=self.model, X_test=X, threshold=self.threshold, return_classes=True
+        )
+
+    async def score(self, record: dict) -> dict:
+        """
+        Scores a raw customer record, batched with the other concurrent calls.
+
+        Args:
+            record (dict): a customer, from raw column name to value.
+
+        Returns:
+            dict: id_col (if in record), churn_proba and churn_pred.
+        """
+        start = time.perf_counter()
+        y_pred_proba, y_pred_cls = await self.batcher.predict_async(
+            self.prepare(record)
+        )
+        result = {
+            "churn_proba": float(y_pred_proba[0]),
+            "churn_pred": int(y_pred_cls[0]),
+        }
+        if self.id_col in record:
+            result = {self.id_col: record[self.id_col], **result}
+        self.latencies.append(time.perf_counter() - start)
+        self.n_requests += 1
+        return result
+
+    def stats(self) -> dict:
+        """Number of calls, latency percentiles (ms) and the batcher metrics."""
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "requests": self.n_requests,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            **self.batcher.metrics(),
+        }
+
+    def reset_stats(self):
+        """Clears the latencies and the batcher metrics."""
+        self.latencies.clear()
+        self.n_requests = 0
+        self.batcher.reset_metrics()
+
+    async def close(self):
+        """Scores the queued records and stops the batcher."""
+        # close joins the worker thread, so it runs out of the event loop
+        await asyncio.to_thread(self.batcher.close)
+
+
+async def _handle_request(service: ScoringService, method: str, path: str, body: bytes):
+    """Routes a request: POST /score (a record or a list of records), GET /stats."""
+    if method == "GET" and path == "/stats":
+        return 200, service.stats()
+    if method == "GET" and path == "/health":
+        return 200, {"status": "ok"}
+    if method == "POST" and path == "/score":
+        try:
+            payload = json.loads(body)
+            records = payload if isinstance(payload, list) else [payload]
+            if not all(isinstance(record, dict) for record in records):
+                return 400, {"error": "the body must be a record or a list of records"}
+            if isinstance(payload, list):
+                return 200, list(
+                    await asyncio.gather(*[service.score(r) for r in payload])
+                )
+            return 200, await service.score(payload)
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            return 400, {"error": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            # the client always gets an answer, even for an unexpected failure
+            logging.getLogger(__name__).exception(f"error scoring {body[:200]!r}")
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+    return 404, {"error": f"{method} {path} not found"}
+
+
+async def handle_connection(
+    service: ScoringService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+):
+    """
+    Minimal HTTP/1.1 (keep-alive, Content-Length bodies) handler of the scoring
+    server, used with asyncio.start_server or asyncio.start_unix_server.
+    """
+    reasons = {
+        200: "OK",
+        400: "Bad Request",
+        404: "Not Found",
+        500: "Internal Server Error",
+    }
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, payload = await _handle_request(service, method, path, body)
+            data = json.dumps(payload).encode()
+            writer.write(
+                f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+            )
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(
+    service: ScoringService,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    unix_socket: Union[str, Path, None] = None,
+    backlog: int = 1024,
+) -> asyncio.AbstractServer:
+    """
+    Starts the scoring server on host:port, or on a Unix socket if unix_socket is
+    given. Only local connections are expected: there is no authentication.
+    backlog is the number of pending connections accepted by the socket.
+
+    Returns:
+        asyncio.AbstractServer: the started server.
+    """
+
+    async def handler(reader, writer):
+        await handle_connection(service, reader, writer)
+
+    if unix_socket is not None:
+        return await asyncio.start_unix_server(
+            handler, path=str(unix_socket), backlog=backlog
+        )
+    return await asyncio.start_server(handler, host=host, port=port, backlog=backlog)
+
+
+async def request(
+    method: str,
+    path: str,
+    payload=None,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    unix_socket: Union[str, Path, None] = None,
+):
+    """
+    Local client of the scoring server: sends one request (payload as JSON) and
+    returns the decoded JSON response.
+    """
+    if unix_socket is not None:
+        reader, writer = await asyncio.open_unix_connection(str(unix_socket))
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    _, _, data = response.partition(b"\r\n\r\n")
+    return json.loads(data)
+
+
+async def _serve_forever(service, host, port, unix_socket):
+    logger = logging.getLogger(__name__)
+    server = await start_server(service, host=host, port=port, unix_socket=unix_socket)
+    logger.info(f"scoring server listening on {unix_socket or f'{host}:{port}'}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+        logger.info(f"scoring stats: {service.stats()}")
+
+
+@click.command()
+@click.argument("model_filepath", type=click.Path(exists=True))
+@click.option(
+    "--config",
+    "config_filepath",
+    type=click.Path(exists=True),
+    default="config/random_forest_clf_for_churn_config.yaml",
+    show_default=True,
+    help="Model config with the features and the decision_threshold "
+    "(of a MODEL_FILEPATH saved with joblib).",
+)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8080, show_default=True)
+@click.option(
+    "--unix-socket", type=click.Path(), default=None, help="Listen on a Unix socket."
+)
+@click.option(
+    "--max-batch-size", type=click.IntRange(min=1), default=64, show_default=True
+)
+@click.option(
+    "--max-wait-ms", type=click.FloatRange(min=0), default=1.0, show_default=True
+)
+def main(
+    model_filepath,
+    config_filepath,
+    host,
+    port,
+    unix_socket,
+    max_batch_size,
+    max_wait_ms,
+):
+    """Serves churn scores of single customers with a fitted model (MODEL_FILEPATH,
+    a model artifact directory of train_model or a pipeline saved with joblib).
+    POST /score receives a raw customer record (or a list of them) as JSON and
+    GET /stats returns the p50/p99 latency. The features and the threshold of an
+    artifact are the ones of its manifest, otherwise the ones of --config.
+    """
+    if Path(model_filepath).is_dir():
+        model, manifest = load_model(model_filepath)
+        features = (
+            manifest["features"]["NUM_FEATURES"] + manifest["features"]["CAT_FEATURES"]
+        )
+        threshold = manifest["decision_threshold"]
+    else:
+        config = load_model_config(config_filepath)
+        model = joblib.load(model_filepath)
+        features = (
+            config["model_features"]["NUM_FEATURES"]
+            + config["model_features"]["CAT_FEATURES"]
+        )
+        threshold = (
+            config["model_parameters"]
+            .get("predict_params", {})
+            .get("decision_threshold", 0.5)
+        )
+    service = ScoringService(
+        pipeline=model,
+        features=features,
+        threshold=threshold,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+    )
+    try:
+        asyncio.run(_serve_forever(service, host, port, unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
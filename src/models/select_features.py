@@ -0,0 +1,329 @@
+import logging
+import time
+from pathlib import Path
+from typing import NamedTuple, Union
+
+import click
+import numpy as np
+import pandas as pd
+import yaml
+from joblib import Parallel, delayed
+from scipy import sparse
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_auc_score
+
+from ..data.make_dataset import load_dataset, make_pipeline
+from ..features.build_features import PROCESSED_SCHEMA
+from .cross_validation import Fold, precompute_folds
+from .predict_model import load_model_config
+from .train_model import FEATURE_FUNCS, make_preprocessor
+
+
+class FeatureSelection(NamedTuple):
+    """Result of select_features."""
+
+    support: np.ndarray
+    feature_names: np.ndarray
+    n_features: int
+    best_score: float
+    cv_scores: pd.DataFrame
+
+
+def _n_eliminated(n_features: int, step: Union[int, float], min_features: int) -> int:
+    """Features eliminated from n_features: step, or a fraction of them if step < 1,
+    keeping at least min_features."""
+    n = int(step) if step >= 1 else max(1, int(step * n_features))
+    return max(0, min(n, n_features - min_features))
+
+
+def _fit_step(
+    model: type,
+    params: dict,
+    X_train,
+    y_train: np.ndarray,
+    X_valid,
+    y_valid: Union[np.ndarray, None],
+    columns: np.ndarray,
+) -> tuple:
+    """
+    Fits model on the columns of X_train. Returns the feature importances of the
+    columns and the validation ROC AUC (None without validation data).
+    """
+    clf = model(**params).fit(X_train[:, columns], y_train)
+    score = None
+    if X_valid is not None:
+        y_pred_proba = clf.predict_proba(X_valid[:, columns])[:, 1]
+        score = roc_auc_score(y_valid, y_pred_proba)
+    return clf.feature_importances_, score
+
+
+def select_features(
+    folds: list[Fold],
+    X: Union[np.ndarray, sparse.spmatrix],
+    y: Union[pd.Series, np.ndarray],
+    feature_names: np.ndarray,
+    model: type = RandomForestClassifier,
+    params: Union[dict, None] = None,
+    step: Union[int, float] = 0.1,
+    min_features_to_select: Union[int, float] = 0.5,
+    patience: int = 2,
+    tol: float = 1e-3,
+    n_jobs: int = 1,
+) -> FeatureSelection:
+    """
+    Recursive feature elimination with cross-validation (like sklearn RFECV) over
+    precomputed folds. At each step the model is fitted on the remaining features
+    of every fold, the validation ROC AUC is recorded for that number of features
+    and the least important features (feature_importances_) of each fold are
+    eliminated. The folds and a chain on the whole X (that gives the final
+    support) run in parallel, n_jobs processes, and several features are eliminated
+    per step (step). While the mean ROC AUC stays within tol of the best one the
+    scores are on a plateau and the elimination goes on; it stops after patience
+    steps below the plateau or at min_features_to_select. The selected features
+    are the fewest ones with a mean ROC AUC within tol of the best.
+
+    The features are tracked by name, so the folds (whose one-hot columns may miss
+    categories that aren't in their train part, see Fold.feature_names) are
+    aligned with the columns of X.
+
+    Example:
+
+    >>>
+    folds = precompute_folds(preprocessor, X_train, y_train, cache_dir="data/interim/folds_cache")
+    Xt = preprocessor.fit_transform(X_train)
+    selection = select_features(
+        folds, Xt, y_train, preprocessor.get_feature_names_out(), params=model_best_params, n_jobs=6
+    )
+    arr_selected_features = selection.support
+
+    Args:
+        folds (list[Fold]): preprocessed folds (see precompute_folds).
+        X (Union[np.ndarray, sparse.spmatrix]): preprocessed training data.
+        y (Union[pd.Series, np.ndarray]): target.
+        feature_names (np.ndarray): names of the columns of X, in the pattern of
+        Fold.feature_names (get_feature_names_out).
+        model (type, optional): model class with feature_importances_. Defaults to
+        RandomForestClassifier.
+        params (Union[dict, None], optional): params of model. Defaults to None.
+        step (Union[int, float], optional): features eliminated per step, or the
+        fraction of the remaining features if < 1. Defaults to 0.1.
+        min_features_to_select (Union[int, float], optional): minimum number of
+        features, or the fraction of the features if < 1. Defaults to 0.5.
+        patience (int, optional): steps below the plateau before stopping.
+        Defaults to 2.
+        tol (float, optional): mean ROC AUC below the best one that is still on the
+        plateau. Defaults to 1e-3.
+        n_jobs (int, optional): number of processes. Defaults to 1.
+
+    Returns:
+        FeatureSelection: support (mask of the columns of X), feature_names,
+        n_features, best_score (mean ROC AUC of the support) and cv_scores (ROC AUC of each fold
+        and mean/std per number of features).
+    """
+    logger = logging.getLogger(__name__)
+    params = params or {}
+    feature_names = np.asarray(feature_names)
+    n_total = len(feature_names)
+    if min_features_to_select < 1:
+        min_features_to_select = int(min_features_to_select * n_total)
+    # the chains never lose all their features
+    min_features_to_select = max(1, min_features_to_select)
+    # column of each feature of feature_names in each fold (-1 if the fold doesn't have it)
+    fold_columns = []
+    for fold in folds:
+        position = {name: j for j, name in enumerate(fold.feature_names)}
+        fold_columns.append(
+            np.array([position.get(name, -1) for name in feature_names])
+        )
+    data = [
+        (fold.X_train, fold.y_train, fold.X_valid, fold.y_valid, columns)
+        for fold, columns in zip(folds, fold_columns)
+    ] + [(X, np.asarray(y), None, None, np.arange(n_total))]
+    # remaining features (indexes of feature_names) of each fold and of the whole X
+    remaining = [np.flatnonzero(columns >= 0) for *_, columns in data]
+    chain_support = []
+    scores, best_score, n_stale = [], -np.inf, 0
+    with Parallel(n_jobs=n_jobs) as parallel:
+        while True:
+            n_features = len(remaining[-1])
+            results = parallel(
+                delayed(_fit_step)(
+                    model, params, X_train, y_train, X_valid, y_valid, columns[features]
+                )
+                for (X_train, y_train, X_valid, y_valid, columns), features in zip(
+                    data, remaining
+                )
+            )
+            fold_scores = [score for _, score in results[:-1]]
+            scores.append([n_features] + fold_scores)
+            chain_support.append(remaining[-1])
+            mean_score = float(np.mean(fold_scores))
+            logger.info(f"{n_features} features: mean ROC AUC {mean_score:.5f}")
+            best_score = max(best_score, mean_score)
+            n_stale = n_stale + 1 if mean_score < best_score - tol else 0
+            if (
+                n_stale >= patience
+                or _n_eliminated(n_features, step, min_features_to_select) <= 0
+            ):
+                break
+            # eliminates the least important features of each chain, as many as its
+            # own number of features allows (the folds may miss some features and
+            # have no importance for them)
+            for i, (importances, _) in enumerate(results):
+                features = remaining[i]
+                n_eliminated = _n_eliminated(
+                    len(features), step, min_features_to_select
+                )
+                ranking = np.argsort(importances, kind="stable")
+                remaining[i] = np.sort(features[ranking[n_eliminated:]])
+
+    cv_scores = pd.DataFrame(
+        scores, columns=["n_features"] + [f"fold_{i}" for i in range(len(folds))]
+    )
+    fold_cols = cv_scores.columns[1:]
+    cv_scores["mean"] = cv_scores[fold_cols].mean(axis=1)
+    cv_scores["std"] = cv_scores[fold_cols].std(axis=1)
+    # the last step (fewest features) on the plateau of the best score
+    best_step = int(np.flatnonzero(cv_scores["mean"] >= best_score - tol)[-1])
+    support = np.zeros(n_total, dtype=bool)
+    support[chain_support[best_step]] = True
+    return FeatureSelection(
+        support=support,
+        feature_names=feature_names,
+        n_features=int(support.sum()),
+        best_score=float(cv_scores["mean"].iloc[best_step]),
+        cv_scores=cv_scores,
+    )
+
+
+def save_feature_selection(
+    selection: FeatureSelection, config_path: Union[str, Path]
+) -> dict:
+    """
+    Writes the support of a feature selection to the fs_params of a model config
+    yaml (config/*_config.yaml): select_cols_arr (the mask used by
+    make_model_pipeline) and the selected and removed features (ISO-8859-1 bytes,
+    like model_features). The other keys of the config are kept.
+
+    Args:
+        selection (FeatureSelection): output of select_features.
+        config_path (Union[str, Path]): path of the config yaml.
+
+    Returns:
+        dict: the saved fs_params.
+    """
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    fs_params = {
+        "select_cols_arr": selection.support.tolist(),
+        "selected_features": [
+            str(name).encode(encoding="ISO-8859-1")
+            for name in selection.feature_names[selection.support]
+        ],
+        "removed_features": [
+            str(name).encode(encoding="ISO-8859-1")
+            for name in selection.feature_names[~selection.support]
+        ],
+        "cv_score": float(selection.best_score),
+    }
+    config["model_parameters"]["fs_params"] = fs_params
+    with open(config_path, "w") as f:
+        yaml.dump(config, f)
+    return fs_params
+
+
+@click.command()
+@click.argument("train_filepath", type=click.Path(exists=True))
+@click.option(
+    "--config",
+    "config_filepath",
+    type=click.Path(exists=True),
+    default="config/random_forest_clf_for_churn_config.yaml",
+    show_default=True,
+    help="Model config with the features and the fit_params. The selection is "
+    "written to its fs_params with --save.",
+)
+@click.option("--n-splits", type=click.IntRange(min=2), default=5)
+@click.option("--n-jobs", type=click.IntRange(min=1), default=1)
+@click.option(
+    "--step",
+    type=click.FloatRange(min=0, min_open=True),
+    default=0.1,
+    show_default=True,
+    help="Features eliminated per step, or the fraction of the remaining ones if < 1.",
+)
+@click.option(
+    "--min-features",
+    type=click.FloatRange(min=0, min_open=True),
+    default=0.5,
+    show_default=True,
+    help="Minimum number of features, or the fraction of the features if < 1.",
+)
+@click.option("--patience", type=click.IntRange(min=1), default=2, show_default=True)
+@click.option(
+    "--folds-cache",
+    type=click.Path(),
+    default=None,
+    help="Directory to cache the preprocessed folds between runs.",
+)
+@click.option("--save", is_flag=True, help="Write the selection to the config.")
+def main(
+    train_filepath,
+    config_filepath,
+    n_splits,
+    n_jobs,
+    step,
+    min_features,
+    patience,
+    folds_cache,
+    save,
+):
+    """Selects the columns of the preprocessed TRAIN_FILEPATH (train_data.csv) used
+    by the model of the config with recursive feature elimination over cross
+    validation folds.
+    """
+    logger = logging.getLogger(__name__)
+    config = load_model_config(config_filepath)
+    num_features = config["model_features"]["NUM_FEATURES"]
+    cat_features = config["model_features"]["CAT_FEATURES"]
+    train_data = make_pipeline(
+        dataframe=load_dataset(train_filepath, schema=PROCESSED_SCHEMA),
+        functions=FEATURE_FUNCS[config["model_name"]],
+    )
+    X, y = train_data[num_features + cat_features], train_data[config["model_target"]]
+    folds = precompute_folds(
+        preprocessor=make_preprocessor(num_features, cat_features),
+        X=X,
+        y=y,
+        n_splits=n_splits,
+        cache_dir=folds_cache,
+    )
+    preprocessor = make_preprocessor(num_features, cat_features)
+    Xt = preprocessor.fit_transform(X)
+    start = time.perf_counter()
+    selection = select_features(
+        folds=folds,
+        X=Xt,
+        y=y,
+        feature_names=preprocessor.get_feature_names_out(),
+        params=config["model_parameters"]["fit_params"],
+        step=int(step) if step >= 1 else step,
+        min_features_to_select=int(min_features) if min_features >= 1 else min_features,
+        patience=patience,
+        n_jobs=n_jobs,
+    )
+    logger.info(
+        f"{selection.n_features} of {len(selection.support)} features selected in "
+        f"{time.perf_counter() - start:.1f} s (mean ROC AUC {selection.best_score:.5f})"
+    )
+    logger.info(f"removed: {list(selection.feature_names[~selection.support])}")
+    if save:
+        save_feature_selection(selection, config_filepath)
+        logger.info(f"fs_params written to {config_filepath}")
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,356 @@
+import json
+import logging
+from pathlib import Path
+from typing import NamedTuple, Union
+
+import click
+import numpy as np
+import pandas as pd
+import yaml
+from sklearn.base import clone
+from sklearn.model_selection import KFold, cross_val_predict
+
+from ..data.make_dataset import load_dataset, make_pipeline
+from ..features.build_features import PROCESSED_SCHEMA
+from .predict_model import load_model_config
+from .train_model import FEATURE_FUNCS, find_model, load_model
+
+
+class CostMatrix(NamedTuple):
+    """
+    Value of each outcome of a customer: revenue coefficient * receita_total +
+    fixed value. The defaults are the balance of notebook 05 with a retention
+    discount of 20% of the revenue offered to every customer predicted as churn:
+    the revenue of the churners found (tp) is saved minus the discount, the
+    discount is lost on the customers that wouldn't churn (fp) and the revenue of
+    the churners missed (fn) is lost. Without a retention cost the best value is
+    always to predict churn for every customer. A fixed cost of the retention
+    action can be set as a negative tp_fixed and fp_fixed.
+    """
+
+    tp_revenue: float = 0.8
+    fp_revenue: float = -0.2
+    fn_revenue: float = -1.0
+    tn_revenue: float = 0.0
+    tp_fixed: float = 0.0
+    fp_fixed: float = 0.0
+    fn_fixed: float = 0.0
+    tn_fixed: float = 0.0
+
+
+def _sweep(
+    y_true: np.ndarray,
+    y_score: np.ndarray,
+    revenue: np.ndarray,
+    cost_matrix: CostMatrix,
+    thresholds: Union[np.ndarray, None],
+) -> dict:
+    """Confusion counts, revenue and value of one model at each threshold."""
+    order = np.argsort(y_score)
+    scores = y_score[order]
+    is_pos = y_true[order]
+    # cumulative sums of the ascending scores: the customers predicted as churn
+    # at threshold t (score > t) are the ones after searchsorted(scores, t, "right")
+    cum_pos = np.concatenate([[0], np.cumsum(is_pos, dtype=np.int64)])
+    cum_pos_revenue = np.concatenate([[0.0], np.cumsum(revenue[order] * is_pos)])
+    cum_revenue = np.concatenate([[0.0], np.cumsum(revenue[order])])
+    if thresholds is None:
+        # the distinct scores and a threshold below the minimum (all customers churn)
+        is_last = np.append(scores[1:] != scores[:-1], True)
+        thresholds = np.append(scores[is_last][::-1], np.nextafter(scores[0], -np.inf))
+    k = np.searchsorted(scores, thresholds, side="right")
+
+    n = len(scores)
+    n_pos = cum_pos[-1]
+    pos_revenue, total_revenue = cum_pos_revenue[-1], cum_revenue[-1]
+    predicted_pos = n - k
+    tp = n_pos - cum_pos[k]
+    fp = predicted_pos - tp
+    fn = n_pos - tp
+    tn = n - n_pos - fp
+    tp_revenue = pos_revenue - cum_pos_revenue[k]
+    fp_revenue = total_revenue - cum_revenue[k] - tp_revenue
+    fn_revenue = pos_revenue - tp_revenue
+    tn_revenue = total_revenue - pos_revenue - fp_revenue
+
+    precision = np.divide(
+        tp, predicted_pos, out=np.zeros(len(k)), where=predicted_pos > 0
+    )
+    recall = tp / n_pos if n_pos > 0 else np.zeros(len(k))
+    f1 = np.divide(
+        2 * tp,
+        predicted_pos + n_pos,
+        out=np.zeros(len(k)),
+        where=predicted_pos + n_pos > 0,
+    )
+    value = (
+        cost_matrix.tp_revenue * tp_revenue
+        + cost_matrix.fp_revenue * fp_revenue
+        + cost_matrix.fn_revenue * fn_revenue
+        + cost_matrix.tn_revenue * tn_revenue
+        + cost_matrix.tp_fixed * tp
+        + cost_matrix.fp_fixed * fp
+        + cost_matrix.fn_fixed * fn
+        + cost_matrix.tn_fixed * tn
+    )
+    return {
+        "threshold": thresholds,
+        "tp": tp,
+        "fp": fp,
+        "fn": fn,
+        "tn": tn,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "revenue_gain": tp_revenue,
+        "revenue_loss": fn_revenue,
+        "value": value,
+    }
+
+
+def sweep_thresholds(
+    y_true: Union[pd.Series, np.ndarray],
+    y_scores: dict,
+    revenue: Union[pd.Series, np.ndarray],
+    cost_matrix: CostMatrix = CostMatrix(),
+    thresholds: Union[np.ndarray, None] = None,
+) -> pd.DataFrame:
+    """
+    Evaluates the decision thresholds of each model in one pass over its sorted
+    scores: the customers are sorted by score once and the confusion counts and
+    the receita_total of each outcome at every threshold come from cumulative
+    sums, instead of recomputing the predictions for each threshold. A customer
+    is predicted as churn when score > threshold, like make_predict. Missing
+    revenues count as 0.
+
+    Example:
+
+    >>>
+    sweep = sweep_thresholds(
+        y_true=y_test,
+        y_scores={"decision_tree": dt_y_pred_proba, "random_forest": rf_y_pred_proba},
+        revenue=X_test["receita_total"],
+    )
+
+    Args:
+        y_true (Union[pd.Series, np.ndarray]): true classes (1 = churn).
+        y_scores (dict): model name -> churn probabilities of the customers of y_true.
+        revenue (Union[pd.Series, np.ndarray]): receita_total of the customers.
+        cost_matrix (CostMatrix, optional): value of each outcome. Defaults to
+        CostMatrix() (revenue saved - retention discount - revenue lost).
+        thresholds (Union[np.ndarray, None], optional): thresholds evaluated. If None
+        uses every distinct score of each model (the exact optimum). Defaults to None.
+
+    Raises:
+        ValueError: if y_true is empty or the scores of a model don't have its shape.
+
+    Returns:
+        pd.DataFrame: one row per model and threshold (in decreasing threshold
+        order) with tp, fp, fn, tn, precision, recall, f1, revenue_gain (receita_total
+        of the tp), revenue_loss (receita_total of the fn) and value (cost_matrix).
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    if y_true.size == 0:
+        raise ValueError("y_true is empty, there are no customers to evaluate")
+    revenue = np.nan_to_num(np.asarray(revenue, dtype=np.float64))
+    if thresholds is not None:
+        thresholds = np.sort(np.asarray(thresholds, dtype=np.float64))[::-1]
+    sweeps = []
+    for name, y_score in y_scores.items():
+        y_score = np.asarray(y_score, dtype=np.float64)
+        if y_score.shape != y_true.shape:
+            raise ValueError(
+                f"scores of {name} have shape {y_score.shape}, y_true has {y_true.shape}"
+            )
+        sweep = pd.DataFrame(_sweep(y_true, y_score, revenue, cost_matrix, thresholds))
+        sweep.insert(0, "model", name)
+        sweeps.append(sweep)
+    return pd.concat(sweeps, ignore_index=True)
+
+
+def optimize_threshold(
+    y_true: Union[pd.Series, np.ndarray],
+    y_scores: dict,
+    revenue: Union[pd.Series, np.ndarray],
+    cost_matrix: CostMatrix = CostMatrix(),
+    thresholds: Union[np.ndarray, None] = None,
+    metric: str = "value",
+) -> pd.DataFrame:
+    """
+    Best threshold of each model: the row of sweep_thresholds with the biggest
+    metric (the highest threshold among ties).
+
+    Example:
+
+    >>>
+    best = optimize_threshold(y_test, {"random_forest": rf_y_pred_proba}, X_test["receita_total"])
+    best.loc["random_forest", "threshold"]
+
+    Args:
+        metric (str, optional): column of sweep_thresholds maximized ("value",
+        "f1", ...). Defaults to "value".
+        The other args are the ones of sweep_thresholds.
+
+    Returns:
+        pd.DataFrame: one row per model (index) with the columns of sweep_thresholds.
+    """
+    sweep = sweep_thresholds(y_true, y_scores, revenue, cost_matrix, thresholds)
+    best = sweep.loc[sweep.groupby("model", sort=False)[metric].idxmax()]
+    return best.set_index("model")
+
+
+def save_decision_threshold(threshold: float, config_path: Union[str, Path]) -> float:
+    """
+    Writes threshold to predict_params.decision_threshold of a model config yaml
+    (config/*_config.yaml). The other keys of the config are kept.
+
+    Args:
+        threshold (float): decision threshold.
+        config_path (Union[str, Path]): path of the config yaml.
+
+    Returns:
+        float: the saved threshold.
+    """
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    threshold = float(threshold)
+    config["model_parameters"].setdefault("predict_params", {})[
+        "decision_threshold"
+    ] = threshold
+    with open(config_path, "w") as f:
+        yaml.dump(config, f)
+    return threshold
+
+
+def save_artifact_threshold(threshold: float, model_dir: Union[str, Path]) -> float:
+    """
+    Writes threshold to the decision_threshold of the manifest.json of a model
+    artifact (see train_model.save_model), the threshold used by the predict,
+    explain and score_server command lines.
+
+    Args:
+        threshold (float): decision threshold.
+        model_dir (Union[str, Path]): directory of the artifact.
+
+    Returns:
+        float: the saved threshold.
+    """
+    manifest_path = Path(model_dir) / "manifest.json"
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["decision_threshold"] = float(threshold)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest["decision_threshold"]
+
+
+def _parse_costs(ctx, param, values) -> CostMatrix:
+    costs = {}
+    for value in values:
+        name, _, cost = value.partition("=")
+        if name not in CostMatrix._fields:
+            raise click.BadParameter(
+                f"{name} isn't one of {', '.join(CostMatrix._fields)}"
+            )
+        try:
+            costs[name] = float(cost)
+        except ValueError:
+            raise click.BadParameter(f"{value} must be name=number")
+    return CostMatrix(**costs)
+
+
+@click.command()
+@click.argument("train_filepath", type=click.Path(exists=True))
+@click.option(
+    "--config",
+    "config_filepath",
+    type=click.Path(exists=True),
+    default="config/random_forest_clf_for_churn_config.yaml",
+    show_default=True,
+    help="Model config. The best threshold is written to it with --save.",
+)
+@click.option(
+    "--model",
+    "model_dir",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Model artifact (see train_model). Defaults to the latest version of the "
+    "model_name of the config in models/.",
+)
+@click.option(
+    "--cost",
+    "cost_matrix",
+    multiple=True,
+    callback=_parse_costs,
+    help="Value of an outcome as name=number (CostMatrix fields), e.g. "
+    "--cost fp_fixed=-50. Can be repeated.",
+)
+@click.option("--n-splits", type=click.IntRange(min=2), default=5, show_default=True)
+@click.option("--n-jobs", type=click.IntRange(min=1), default=1, show_default=True)
+@click.option("--metric", default="value", show_default=True)
+@click.option("--revenue-col", default="receita_total", show_default=True)
+@click.option(
+    "--save",
+    is_flag=True,
+    help="Write the best threshold to the config and to the manifest of the model.",
+)
+def main(
+    train_filepath,
+    config_filepath,
+    model_dir,
+    cost_matrix,
+    n_splits,
+    n_jobs,
+    metric,
+    revenue_col,
+    save,
+):
+    """Finds the decision threshold of a model artifact that maximizes the value of
+    the cost matrix on the out-of-fold predictions of TRAIN_FILEPATH
+    (train_data.csv): the pipeline of the artifact is fitted again on each of
+    --n-splits folds and scores the other one, so the test data stays out of the
+    choice of the threshold.
+    """
+    logger = logging.getLogger(__name__)
+    config = load_model_config(config_filepath)
+    model_dir = model_dir or find_model(config["model_name"])
+    pipeline, manifest = load_model(model_dir, compiled=False)
+    features = (
+        manifest["features"]["NUM_FEATURES"] + manifest["features"]["CAT_FEATURES"]
+    )
+    train_data = make_pipeline(
+        dataframe=load_dataset(train_filepath, schema=PROCESSED_SCHEMA),
+        functions=FEATURE_FUNCS[manifest["model_name"]],
+    )
+    y_true = train_data[manifest["model_target"]]
+    # same folds of cross_validation.precompute_folds
+    y_score = cross_val_predict(
+        clone(pipeline),
+        train_data[features],
+        y_true,
+        cv=KFold(n_splits=n_splits, shuffle=True, random_state=42),
+        method="predict_proba",
+        n_jobs=n_jobs,
+    )[:, 1]
+    best = optimize_threshold(
+        y_true=y_true,
+        y_scores={manifest["model_name"]: y_score},
+        revenue=train_data[revenue_col],
+        cost_matrix=cost_matrix,
+        metric=metric,
+    ).iloc[0]
+    logger.info(f"{cost_matrix}")
+    logger.info(f"best threshold of {model_dir}:\n{best.to_string()}")
+    if save:
+        threshold = save_decision_threshold(best["threshold"], config_filepath)
+        save_artifact_threshold(threshold, model_dir)
+        logger.info(
+            f"decision_threshold {threshold} written to {config_filepath} and {model_dir}"
+        )
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
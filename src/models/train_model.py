@@ -0,0 +1,375 @@
+import importlib
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Union
+
+import click
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from scipy import sparse
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.utils.validation import check_is_fitted
+
+from ..data.make_dataset import load_dataset, make_pipeline
+from ..features.build_features import PROCESSED_SCHEMA, rf_feature_funcs
+from .forest_inference import CompiledForest
+from .predict_model import load_model_config
+
+MODELS = {
+    "decision_tree_clf_for_churn": DecisionTreeClassifier,
+    "random_forest_clf_for_churn": RandomForestClassifier,
+}
+
+# make_pipeline functions applied on the processed data to create the features of
+# each model (notebook 05: the decision tree uses the processed data as it is)
+FEATURE_FUNCS = {
+    "decision_tree_clf_for_churn": [],
+    "random_forest_clf_for_churn": rf_feature_funcs,
+}
+
+# version of the layout of the model artifacts written by save_model
+ARTIFACT_FORMAT_VERSION = 1
+
+
+class CategoricalOneHotEncoder(OneHotEncoder):
+    """
+    OneHotEncoder that encodes pandas categorical columns (see load_dataset
+    schema) from their integer codes: the categories of each column are matched
+    once with the fitted categories_ and the rows are encoded with an array lookup
+    of the codes, instead of comparing the strings of each row. fit and the
+    fitted categories_ are the ones of OneHotEncoder, so the output is the same.
+    Inputs that aren't DataFrames of categorical columns and the options drop,
+    min_frequency, max_categories and handle_unknown="ignore" (checked on the
+    constructor params only, no private sklearn attributes) use
+    OneHotEncoder.transform.
+    """
+
+    def transform(self, X):
+        check_is_fitted(self)
+        if not self._encodes_codes(X):
+            return super().transform(X)
+        offsets = np.cumsum([0] + [len(cats) for cats in self.categories_])
+        indices = np.empty((len(X), len(self.categories_)), dtype=np.int64)
+        for j, (col, categories) in enumerate(zip(X.columns, self.categories_)):
+            values = X[col]
+            lookup = self._codes_lookup(values.cat.categories, categories)
+            # the missing values have code -1, the last position of lookup
+            positions = lookup[values.cat.codes.to_numpy()]
+            if (positions < 0).any():
+                unknown = values[positions < 0].unique().tolist()
+                raise ValueError(
+                    f"Found unknown categories {unknown} in column {j} during transform"
+                )
+            indices[:, j] = positions + offsets[j]
+        out = sparse.csr_matrix(
+            (
+                np.ones(indices.size),
+                indices.ravel(),
+                np.arange(0, indices.size + 1, indices.shape[1]),
+            ),
+            shape=(len(X), offsets[-1]),
+            dtype=self.dtype,
+        )
+        return out if self.sparse_output else out.toarray()
+
+    def _encodes_codes(self, X) -> bool:
+        """If X can be encoded from the categorical codes."""
+        return (
+            isinstance(X, pd.DataFrame)
+            and list(X.columns) == list(getattr(self, "feature_names_in_", []))
+            and all(isinstance(dtype, pd.CategoricalDtype) for dtype in X.dtypes)
+            and self.handle_unknown == "error"
+            and self.drop is None
+            and self.min_frequency is None
+            and self.max_categories is None
+            # sparse was removed in sklearn 1.4, sparse_output is used instead
+            and getattr(self, "sparse", "deprecated") == "deprecated"
+        )
+
+    @staticmethod
+    def _codes_lookup(
+        column_categories: pd.Index, categories: np.ndarray
+    ) -> np.ndarray:
+        """Position in categories of each code of a column (-1 if unknown). The last
+        element is the position of the missing values."""
+        is_nan = pd.isna(categories)
+        lookup = np.full(len(column_categories) + 1, -1, dtype=np.int64)
+        lookup[:-1] = pd.Index(categories[~is_nan]).get_indexer(column_categories)
+        if is_nan.any():
+            lookup[-1] = np.flatnonzero(is_nan)[0]
+        return lookup
+
+
+def make_preprocessor(num_features: list, cat_features: list) -> ColumnTransformer:
+    """
+    Creates the preprocessor used by the churn models: imputes the numeric
+    features with the median and one-hot encodes the categoric features
+    (CategoricalOneHotEncoder, that uses the codes of categorical columns).
+
+    Args:
+        num_features (list): numeric feature names.
+        cat_features (list): categoric feature names.
+
+    Returns:
+        ColumnTransformer: the (not fitted) preprocessor.
+    """
+    return ColumnTransformer(
+        transformers=[
+            ("num", SimpleImputer(strategy="median"), num_features),
+            ("cat", CategoricalOneHotEncoder(), cat_features),
+        ]
+    )
+
+
+def make_model_pipeline(config: dict) -> Pipeline:
+    """
+    Creates the pipeline of a model config (see load_model_config), like the
+    pipelines of notebook 05: preprocessor, the feature selection of fs_params
+    (if in config) and the model of MODELS[model_name] with the fit_params.
+
+    Args:
+        config (dict): model config with decoded features.
+
+    Returns:
+        Pipeline: the (not fitted) model pipeline.
+    """
+    steps = [
+        (
+            "preprocessor",
+            make_preprocessor(
+                config["model_features"]["NUM_FEATURES"],
+                config["model_features"]["CAT_FEATURES"],
+            ),
+        )
+    ]
+    fs_params = config["model_parameters"].get("fs_params")
+    if fs_params is not None:
+        col_selector = ColumnTransformer(
+            transformers=[("select_cols", "passthrough", fs_params["select_cols_arr"])]
+        )
+        steps.append(("select_cols", col_selector))
+    model = MODELS[config["model_name"]](**config["model_parameters"]["fit_params"])
+    steps.append(("model", model))
+    return Pipeline(steps=steps)
+
+
+def save_model(
+    pipeline: Pipeline,
+    config: dict,
+    models_dir: Union[str, Path] = "models",
+    overwrite: bool = False,
+) -> Path:
+    """
+    Saves a fitted model pipeline in models_dir/<model_name>/v<model_version>
+    (the model_name and model_version of config):
+
+    - pipeline.joblib: the pipeline;
+    - preprocessor.joblib: the steps before the model (pipeline[:-1]);
+    - forest.joblib: for tree models, the CompiledForest of the model (without the
+      preprocessor), whose node arrays are loaded with mmap_mode by load_model;
+    - manifest.json: model name, version and target, the features in the order
+      used to fit, the decision_threshold and the files of the artifact.
+
+    The joblib files aren't compressed, so the arrays can be memory mapped.
+
+    Example:
+
+    >>>
+    model_dir = save_model(rf_model, config)  # models/random_forest_clf_for_churn/v1
+
+    Args:
+        pipeline (Pipeline): fitted model pipeline (see make_model_pipeline).
+        config (dict): model config with decoded features (see load_model_config).
+        models_dir (Union[str, Path], optional): root of the artifacts. Defaults to "models".
+        overwrite (bool, optional): replace an artifact of the same version.
+        Defaults to False.
+
+    Raises:
+        FileExistsError: if the artifact of the version exists and not overwrite.
+
+    Returns:
+        Path: directory of the artifact.
+    """
+    check_is_fitted(pipeline[-1])
+    model_dir = Path(models_dir) / config["model_name"] / f"v{config['model_version']}"
+    if (model_dir / "manifest.json").exists() and not overwrite:
+        raise FileExistsError(
+            f"{model_dir} exists, increase model_version in the config or overwrite"
+        )
+    model_dir.mkdir(parents=True, exist_ok=True)
+    joblib.dump(pipeline, model_dir / "pipeline.joblib")
+    joblib.dump(pipeline[:-1], model_dir / "preprocessor.joblib")
+    files = ["pipeline.joblib", "preprocessor.joblib"]
+    n_trees = None
+    if isinstance(pipeline[-1], (DecisionTreeClassifier, RandomForestClassifier)):
+        forest = CompiledForest.from_estimator(pipeline[-1])
+        joblib.dump(forest, model_dir / "forest.joblib")
+        files.append("forest.joblib")
+        n_trees = forest.n_trees
+    manifest = {
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "model_name": config["model_name"],
+        "model_version": config["model_version"],
+        "model_target": config["model_target"],
+        "features": {
+            "NUM_FEATURES": config["model_features"]["NUM_FEATURES"],
+            "CAT_FEATURES": config["model_features"]["CAT_FEATURES"],
+        },
+        "decision_threshold": config["model_parameters"]
+        .get("predict_params", {})
+        .get("decision_threshold", 0.5),
+        "n_trees": n_trees,
+        "files": {name: (model_dir / name).stat().st_size for name in files},
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "versions": {
+            "sklearn": sklearn.__version__,
+            "numpy": np.__version__,
+            "joblib": joblib.__version__,
+        },
+    }
+    with open(model_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return model_dir
+
+
+def find_model(
+    model_name: str,
+    model_version: Union[int, None] = None,
+    models_dir: Union[str, Path] = "models",
+) -> Path:
+    """
+    Directory of a model artifact saved by save_model.
+
+    Args:
+        model_name (str): model_name of the config.
+        model_version (Union[int, None], optional): model_version of the config. If
+        None uses the latest version saved. Defaults to None.
+        models_dir (Union[str, Path], optional): root of the artifacts. Defaults to "models".
+
+    Raises:
+        FileNotFoundError: if there is no artifact of the model (or of the version).
+
+    Returns:
+        Path: directory of the artifact.
+    """
+    if model_version is not None:
+        model_dir = Path(models_dir) / model_name / f"v{model_version}"
+        if not (model_dir / "manifest.json").exists():
+            raise FileNotFoundError(f"no artifact in {model_dir}")
+        return model_dir
+    versions = [
+        path.parent
+        for path in (Path(models_dir) / model_name).glob("v*/manifest.json")
+        if path.parent.name[1:].isdigit()
+    ]
+    if not versions:
+        raise FileNotFoundError(f"no artifact of {model_name} in {models_dir}")
+    return max(versions, key=lambda path: int(path.name[1:]))
+
+
+def load_model(
+    model_dir: Union[str, Path],
+    compiled: bool = True,
+    mmap_mode: Union[str, None] = "r",
+) -> tuple:
+    """
+    Loads a model artifact saved by save_model. With compiled (and a tree model)
+    returns the CompiledForest of the artifact with preprocessor.joblib as its
+    preprocessor: the node arrays are memory mapped (mmap_mode), so the load
+    takes milliseconds and the processes that load the same artifact share one
+    copy of the forest in the page cache. Otherwise returns the pipeline (the
+    sklearn trees copy their arrays when they're unpickled).
+
+    Example:
+
+    >>>
+    model, manifest = load_model(find_model("random_forest_clf_for_churn"))
+    y_pred_proba, y_pred_class = make_predict(
+        model=model,
+        X_test=X_test[manifest["features"]["NUM_FEATURES"] + manifest["features"]["CAT_FEATURES"]],
+        threshold=manifest["decision_threshold"],
+        return_classes=True,
+    )
+
+    Args:
+        model_dir (Union[str, Path]): directory of the artifact (see find_model).
+        compiled (bool, optional): return the CompiledForest of tree models.
+        Defaults to True.
+        mmap_mode (Union[str, None], optional): mmap_mode of joblib.load for the
+        arrays of forest.joblib. Defaults to "r".
+
+    Raises:
+        ValueError: if the artifact was written by a newer save_model.
+
+    Returns:
+        tuple: the model (CompiledForest or Pipeline) and the manifest (dict).
+    """
+    model_dir = Path(model_dir)
+    with open(model_dir / "manifest.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest["format_version"] > ARTIFACT_FORMAT_VERSION:
+        raise ValueError(
+            f"{model_dir} has format_version {manifest['format_version']}, "
+            f"this version reads up to {ARTIFACT_FORMAT_VERSION}"
+        )
+    if compiled and "forest.joblib" in manifest["files"]:
+        model = joblib.load(model_dir / "forest.joblib", mmap_mode=mmap_mode)
+        model.preprocessor = joblib.load(model_dir / "preprocessor.joblib")
+    else:
+        model = joblib.load(model_dir / "pipeline.joblib")
+    return model, manifest
+
+
+@click.command()
+@click.argument("train_filepath", type=click.Path(exists=True))
+@click.option(
+    "--config",
+    "config_filepath",
+    type=click.Path(exists=True),
+    default="config/random_forest_clf_for_churn_config.yaml",
+    show_default=True,
+)
+@click.option("--models-dir", type=click.Path(), default="models", show_default=True)
+@click.option(
+    "--overwrite", is_flag=True, help="Replace the artifact of the same version."
+)
+def main(train_filepath, config_filepath, models_dir, overwrite):
+    """Fits the model of a config on TRAIN_FILEPATH (train_data.csv) and saves it
+    in models/<model_name>/v<model_version> (see save_model).
+    """
+    logger = logging.getLogger(__name__)
+    config = load_model_config(config_filepath)
+    features = (
+        config["model_features"]["NUM_FEATURES"]
+        + config["model_features"]["CAT_FEATURES"]
+    )
+    train_data = make_pipeline(
+        dataframe=load_dataset(train_filepath, schema=PROCESSED_SCHEMA),
+        functions=FEATURE_FUNCS[config["model_name"]],
+    )
+    start = time.perf_counter()
+    pipeline = make_model_pipeline(config).fit(
+        train_data[features], train_data[config["model_target"]]
+    )
+    logger.info(f"{config['model_name']} fitted in {time.perf_counter() - start:.1f} s")
+    model_dir = save_model(pipeline, config, models_dir=models_dir, overwrite=overwrite)
+    logger.info(f"model saved in {model_dir}")
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # main of the imported module, so the saved pipelines refer to the classes of
+    # src.models.train_model and not of __main__
+    importlib.import_module(__spec__.name).main()
@@ -0,0 +1,266 @@
+import logging
+import time
+from pathlib import Path
+from typing import Union
+
+import click
+import numpy as np
+import optuna
+import pandas as pd
+import yaml
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import f1_score, roc_auc_score
+
+from ..data.make_dataset import load_dataset, make_pipeline
+from ..features.build_features import PROCESSED_SCHEMA, rf_feature_funcs
+from .cross_validation import Fold, precompute_folds
+from .predict_model import load_model_config
+from .train_model import make_preprocessor
+
+
+def get_rf_params(trial: optuna.trial.Trial) -> dict:
+    """
+    Search space of the random forest (the same used in notebook 04).
+
+    Args:
+        trial (optuna.trial.Trial): optuna trial to suggest the params.
+
+    Returns:
+        dict: RandomForestClassifier params.
+    """
+    params = {
+        "max_depth": trial.suggest_int("max_depth", 8, 9, log=True),
+        "min_samples_split": trial.suggest_int("min_samples_split", 5, 8, log=True),
+        "n_estimators": trial.suggest_int("n_estimators", 400, 520, log=True),
+        "criterion": trial.suggest_categorical(
+            "criterion", ["gini", "entropy", "log_loss"]
+        ),
+        "class_weight": trial.suggest_categorical(
+            "class_weight", ["balanced", "balanced_subsample"]
+        ),
+        "random_state": 82,
+    }
+    return params
+
+
+def make_objective(model: type, params_func: callable, folds: list[Fold]) -> callable:
+    """
+    Creates the optuna objective: mean validation ROC AUC of model over the
+    precomputed folds. The running mean is reported after each fold so the
+    pruner can stop unpromising trials before all folds are fitted. The full
+    params and the mean macro f1 are saved as trial user attrs.
+
+    Args:
+        model (type): model class, called with the params of params_func.
+        params_func (callable): function that receives a trial and returns the params.
+        folds (list[Fold]): preprocessed folds (see precompute_folds).
+
+    Returns:
+        callable: the objective function.
+    """
+
+    def objective(trial: optuna.trial.Trial) -> float:
+        params = params_func(trial)
+        trial.set_user_attr("params", params)
+        rocs, f1s = [], []
+        for step, fold in enumerate(folds):
+            clf = model(**params).fit(fold.X_train, fold.y_train)
+            y_pred_proba = clf.predict_proba(fold.X_valid)[:, 1]
+            rocs.append(roc_auc_score(fold.y_valid, y_pred_proba))
+            f1s.append(f1_score(fold.y_valid, y_pred_proba > 0.5, average="macro"))
+            trial.report(np.mean(rocs), step=step)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+        trial.set_user_attr("avg_f1", float(np.mean(f1s)))
+        return float(np.mean(rocs))
+
+    return objective
+
+
+def _run_worker(
+    study_name: str, storage: str, objective: callable, n_trials: int
+) -> None:
+    """Loads the shared study and runs n_trials of it (one worker process)."""
+    study = optuna.load_study(study_name=study_name, storage=_make_storage(storage))
+    study.optimize(objective, n_trials=n_trials)
+
+
+def _make_storage(storage: Union[str, None]):
+    """
+    optuna storage from a path: a sqlite url is used as is and any other path is
+    used as a journal file, which supports writes from several processes.
+    """
+    if storage is None or storage.startswith("sqlite:///"):
+        return storage
+    return optuna.storages.JournalStorage(optuna.storages.JournalFileStorage(storage))
+
+
+def optimize_model(
+    model: type,
+    params_func: callable,
+    folds: list[Fold],
+    num_trials: int,
+    n_workers: int = 1,
+    storage: Union[str, None] = None,
+    study_name: str = "churn_model",
+    n_startup_trials: int = 5,
+) -> optuna.Study:
+    """
+    Runs an optuna study that maximizes the mean ROC AUC of model over the
+    precomputed folds. The trials are split between n_workers processes that
+    share the study through storage. Trials with a running mean ROC AUC below
+    the median of the previous trials at the same fold are pruned.
+
+    Args:
+        model (type): model class, called with the params of params_func.
+        params_func (callable): function that receives a trial and returns the params.
+        folds (list[Fold]): preprocessed folds (see precompute_folds).
+        num_trials (int): total number of trials.
+        n_workers (int, optional): number of worker processes. Defaults to 1.
+        storage (Union[str, None], optional): sqlite url ("sqlite:///path.db") or the
+        path of a journal file to save the study. Required if n_workers > 1. If the
+        study already exists in storage its trials are continued. Defaults to None
+        (in memory).
+        study_name (str, optional): name of the study. Defaults to "churn_model".
+        n_startup_trials (int, optional): trials run before pruning starts. Defaults to 5.
+
+    Returns:
+        optuna.Study: the finished study.
+    """
+    if n_workers > 1 and storage is None:
+        raise ValueError("a storage is required to run more than one worker")
+    study = optuna.create_study(
+        study_name=study_name,
+        storage=_make_storage(storage),
+        direction="maximize",
+        pruner=optuna.pruners.MedianPruner(
+            n_startup_trials=n_startup_trials, n_warmup_steps=1
+        ),
+        load_if_exists=True,
+    )
+    objective = make_objective(model=model, params_func=params_func, folds=folds)
+    if n_workers == 1:
+        study.optimize(objective, n_trials=num_trials)
+        return study
+
+    trials_per_worker = np.diff(np.linspace(0, num_trials, n_workers + 1).astype(int))
+    Parallel(n_jobs=n_workers)(
+        delayed(_run_worker)(study_name, storage, objective, int(n_trials))
+        for n_trials in trials_per_worker
+        if n_trials > 0
+    )
+    return optuna.load_study(study_name=study_name, storage=_make_storage(storage))
+
+
+def save_best_params(study: optuna.Study, config_path: Union[str, Path]) -> dict:
+    """
+    Writes the params of the best trial to the fit_params of a model config yaml
+    (config/*_config.yaml). The other keys of the config are kept, so a warning
+    is logged when the config has a feature selection (fs_params.select_cols_arr)
+    or a decision_threshold found with the previous params: they must be found
+    again (make select_features, make threshold).
+
+    Args:
+        study (optuna.Study): finished study.
+        config_path (Union[str, Path]): path of the config yaml.
+
+    Returns:
+        dict: the saved params.
+    """
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    best_params = study.best_trial.user_attrs.get("params", study.best_params)
+    config["model_parameters"]["fit_params"] = best_params
+    with open(config_path, "w") as f:
+        yaml.dump(config, f)
+    stale = []
+    if "select_cols_arr" in config["model_parameters"].get("fs_params", {}):
+        stale.append("fs_params.select_cols_arr (make select_features)")
+    if "decision_threshold" in config["model_parameters"].get("predict_params", {}):
+        stale.append("predict_params.decision_threshold (make threshold)")
+    if stale:
+        logging.getLogger(__name__).warning(
+            f"{config_path} has {' and '.join(stale)} found with the previous "
+            "fit_params, run them again with the new params"
+        )
+    return best_params
+
+
+@click.command()
+@click.argument("train_filepath", type=click.Path(exists=True))
+@click.option(
+    "--config",
+    "config_filepath",
+    type=click.Path(exists=True),
+    default="config/random_forest_clf_for_churn_config.yaml",
+    show_default=True,
+    help="Model config with the features. The best params are written to it.",
+)
+@click.option("--n-trials", type=click.IntRange(min=1), default=20)
+@click.option("--n-splits", type=click.IntRange(min=2), default=5)
+@click.option("--n-workers", type=click.IntRange(min=1), default=1)
+@click.option(
+    "--storage",
+    default=None,
+    help="sqlite url or journal file path of the study. Required with --n-workers > 1.",
+)
+@click.option("--study-name", default="random_forest_clf_for_churn")
+@click.option(
+    "--folds-cache",
+    type=click.Path(),
+    default=None,
+    help="Directory to cache the preprocessed folds between runs.",
+)
+def main(
+    train_filepath,
+    config_filepath,
+    n_trials,
+    n_splits,
+    n_workers,
+    storage,
+    study_name,
+    folds_cache,
+):
+    """Tunes the random forest on TRAIN_FILEPATH (train_data.csv) and writes the
+    best params to the model config.
+    """
+    logger = logging.getLogger(__name__)
+    config = load_model_config(config_filepath)
+    num_features = config["model_features"]["NUM_FEATURES"]
+    cat_features = config["model_features"]["CAT_FEATURES"]
+    train_data = make_pipeline(
+        dataframe=load_dataset(train_filepath, schema=PROCESSED_SCHEMA),
+        functions=rf_feature_funcs,
+    )
+    folds = precompute_folds(
+        preprocessor=make_preprocessor(num_features, cat_features),
+        X=train_data[num_features + cat_features],
+        y=train_data[config["model_target"]],
+        n_splits=n_splits,
+        cache_dir=folds_cache,
+    )
+    start = time.perf_counter()
+    study = optimize_model(
+        model=RandomForestClassifier,
+        params_func=get_rf_params,
+        folds=folds,
+        num_trials=n_trials,
+        n_workers=n_workers,
+        storage=storage,
+        study_name=study_name,
+    )
+    n_pruned = len(study.get_trials(states=[optuna.trial.TrialState.PRUNED]))
+    logger.info(
+        f"{len(study.trials)} trials ({n_pruned} pruned) in "
+        f"{time.perf_counter() - start:.1f} s, best roc auc {study.best_value:.4f}"
+    )
+    best_params = save_best_params(study=study, config_path=config_filepath)
+    logger.info(f"best params {best_params} saved to {config_filepath}")
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()